@@ -1,6 +1,10 @@
 from .objective_function import ObjectiveFunction
-from .sample_sources import SampleDatabase, MapMatcherScriptSource, MapMatcherFakeSource
-from .samples import MapMatcherSample
+from .sample_sources import SampleDatabase, ArenaSampleDatabase, SQLiteSampleDatabase, SampleHandle, PoolSampleSource, MapMatcherScriptSource, MapMatcherFakeSource, with_fidelity
+from .samples import MapMatcherSample, MapMatcherSampleSummary
 from .performance_measures import PerformanceMeasure
+from .acquisition import propose_batch
+from .job_queue import JobQueue, QueueSampleSource, run_worker
+from .multi_fidelity import SuccessiveHalving
+from .early_stopping import EarlyStopping
 
-__all__ = ["ObjectiveFunction", "SampleDatabase", "MapMatcherScriptSource", "MapMatcherFakeSource", "MapMatcherSample", "PerformanceMeasure"]
+__all__ = ["ObjectiveFunction", "SampleDatabase", "ArenaSampleDatabase", "SQLiteSampleDatabase", "SampleHandle", "PoolSampleSource", "MapMatcherScriptSource", "MapMatcherFakeSource", "with_fidelity", "MapMatcherSample", "MapMatcherSampleSummary", "PerformanceMeasure", "propose_batch", "JobQueue", "QueueSampleSource", "run_worker", "SuccessiveHalving", "EarlyStopping"]
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+
+##########################################################################
+# Copyright (c) 2017 German Aerospace Center (DLR). All rights reserved. #
+# SPDX-License-Identifier: BSD-2-Clause                                  #
+##########################################################################
+
+"""
+Contains acquisition helpers for proposing several points at once, on top of the Gaussian process of the Bayesian optimization modules.
+The Bayesian optimization modules only propose one point at a time, which has to be evaluated before the next one can be proposed.
+If the evaluation modules can generate several samples concurrently (see PoolSampleSource), propose_batch supplies enough points
+for all of them. It can also take points whose evaluation is still pending into account, for proposing points asynchronously
+whenever an evaluation finished.
+
+All functions work in the optimizer's parameter space, i.e. with the (possibly normalized) points of its TargetSpace,
+and use the upper confidence bound as acquisition function, like the optimizer does by default.
+"""
+
+import numpy as np
+from scipy.optimize import minimize
+from sklearn.base import clone
+
+def upper_confidence_bound(gp, X, kappa):
+    """
+    Returns the upper confidence bound (mean + kappa * standard deviation) of the Gaussian process at the points X.
+
+    :param gp: A fitted sklearn GaussianProcessRegressor.
+    :param X: Array of points, with one row per point.
+    :param kappa: Weight of the standard deviation. Higher values lead to more exploration.
+    """
+    mean, std = gp.predict(X, return_std=True)
+    return mean + kappa * std
+
+def maximize_acquisition(acquisition, bounds, random_state, n_warmup=10000, n_iter=25):
+    """
+    Returns the point within bounds where the acquisition function is maximal.
+    Like the Bayesian optimization modules, this evaluates the acquisition function at n_warmup random points first,
+    then runs L-BFGS-B from the best of those and from n_iter random starting points.
+
+    :param acquisition: Function that returns the acquisition values for an array of points.
+    :param bounds: Array with a (min, max) row per parameter.
+    :param random_state: A numpy RandomState.
+    :param n_warmup: Number of random points to evaluate.
+    :param n_iter: Number of random starting points for L-BFGS-B.
+    """
+    x_tries = random_state.uniform(bounds[:, 0], bounds[:, 1], size=(n_warmup, bounds.shape[0]))
+    ys = acquisition(x_tries)
+    x_max = x_tries[ys.argmax()]
+    max_acq = ys.max()
+    x_seeds = np.vstack([x_max, random_state.uniform(bounds[:, 0], bounds[:, 1], size=(n_iter, bounds.shape[0]))])
+    for x_try in x_seeds:
+        res = minimize(lambda x: -acquisition(x.reshape(1, -1))[0], x_try, bounds=bounds, method="L-BFGS-B")
+        if res.success and -res.fun >= max_acq:
+            x_max = res.x
+            max_acq = -res.fun
+    # Due to floating point technicalities, L-BFGS-B may end up slightly out of bounds
+    return np.clip(x_max, bounds[:, 0], bounds[:, 1])
+
+def propose_batch(gp, X, Y, bounds, q, kappa, random_state, liar='min', pending=None, **maximize_kwargs):
+    """
+    Proposes q points to evaluate at the same time, with the constant liar strategy:
+    After choosing a point, it's added to the observations with a fake value (the "lie"), and the Gaussian process is fitted again.
+    Since the standard deviation vanishes near observations, the next point is chosen somewhere else.
+    A pessimistic lie ('min') spreads the points the most, an optimistic one ('max') concentrates them near the current maximum.
+    With the 'believer' liar (Kriging believer), the lie is the Gaussian process' mean at the point instead of a constant.
+    Points whose evaluation is still pending are added with a lie before choosing the first point, so they aren't proposed again.
+
+    :param gp: A sklearn GaussianProcessRegressor, configured like the optimizer's. It isn't changed, a clone is fitted instead.
+    :param X: Array of the points observed so far, with one row per point.
+    :param Y: Array of the observed values.
+    :param bounds: Array with a (min, max) row per parameter.
+    :param q: The number of points to propose.
+    :param kappa: See upper_confidence_bound.
+    :param random_state: A numpy RandomState.
+    :param liar: The fake value for chosen points: 'min', 'mean' or 'max' of Y, or 'believer'.
+    :param pending: Optional list of points that are being evaluated right now.
+    :param maximize_kwargs: Additional keyword arguments for maximize_acquisition.
+    :return: Array with q rows, one for each proposed point.
+    """
+    if not liar in ['min', 'mean', 'max', 'believer']:
+        raise ValueError("liar has to be one of 'min', 'mean', 'max' or 'believer'", liar)
+    X = np.asarray(X, dtype=np.float64)
+    Y = np.asarray(Y, dtype=np.float64)
+    batch_gp = clone(gp)
+    batch_gp.fit(X, Y)
+    fantasized_X = [np.asarray(x, dtype=np.float64) for x in (pending if pending is not None else [])]
+    fantasized_Y = [_lie(batch_gp, Y, x, liar) for x in fantasized_X]
+    batch = []
+    for i in range(q):
+        if len(fantasized_X) > 0:
+            batch_gp.fit(np.vstack([X] + fantasized_X), np.concatenate([Y, fantasized_Y]))
+        x = maximize_acquisition(lambda x: upper_confidence_bound(batch_gp, x, kappa), bounds, random_state, **maximize_kwargs)
+        batch.append(x)
+        fantasized_Y.append(_lie(batch_gp, Y, x, liar))
+        fantasized_X.append(x)
+    return np.array(batch)
+
+def _lie(gp, Y, x, liar):
+    """
+    Returns the fake value for a point that isn't evaluated yet, see propose_batch.
+    """
+    if liar == 'believer':
+        return gp.predict(x.reshape(1, -1))[0]
+    return getattr(np, liar)(Y)
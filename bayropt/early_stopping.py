@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+
+##########################################################################
+# Copyright (c) 2017 German Aerospace Center (DLR). All rights reserved. #
+# SPDX-License-Identifier: BSD-2-Clause                                  #
+##########################################################################
+
+"""
+Contains the logic for aborting map matcher runs early, if their partial results show that they can't beat the best known sample.
+The partial results are streamed by the interface module while the run is going (see MapMatcherScriptSource).
+"""
+
+import numpy as np
+
+from .samples import MapMatcherSample
+
+class EarlyStopping(object):
+    """
+    Estimates the final performance measure of a running evaluation from the matches it made so far,
+    and decides whether the evaluation is hopeless, i.e. whether even its optimistic estimate is worse than the incumbent.
+
+    The estimate assumes the remaining part of the dataset behaves like the part that was processed already:
+    The number of remaining matches is drawn from a Poisson distribution with the rate observed so far,
+    and their errors are drawn from the observed errors (bootstrapping). The performance measure of the observed
+    matches combined with each of n_bootstrap such continuations gives the distribution of the final value.
+    """
+    def __init__(self, performance_measure, incumbent=None, confidence=0.95, min_progress=0.1, check_interval=0.05,
+                 n_bootstrap=100, seed=0):
+        """
+        :param performance_measure: The performance measure the evaluations are rated with.
+        :param incumbent: The best known value of the performance measure, None disables early stopping until it's set.
+        :param confidence: The confidence level of the estimate's bounds. An evaluation is hopeless if the upper bound is below the incumbent.
+        :param min_progress: The fraction of the dataset that has to be processed before an evaluation may be considered hopeless.
+        :param check_interval: The minimum increase of progress between checks, since each check rates n_bootstrap samples.
+        :param n_bootstrap: The number of simulated continuations of the evaluation.
+        :param seed: Seed for the random continuations, so the decisions are reproducible.
+        """
+        self.performance_measure = performance_measure
+        self.incumbent = incumbent
+        self.confidence = confidence
+        self.min_progress = min_progress
+        self.check_interval = check_interval
+        self.n_bootstrap = n_bootstrap
+        self.seed = seed
+
+    def estimate(self, translation_errors, rotation_errors, progress):
+        """
+        Estimates the performance measure's value at the end of an evaluation.
+
+        :param translation_errors: The translation errors of the matches so far.
+        :param rotation_errors: The rotation errors of the matches so far.
+        :param progress: The fraction of the dataset that was processed so far, in (0, 1].
+        :return: Tuple (estimate, lower_bound, upper_bound), or None if there are no matches to extrapolate from yet.
+        """
+        translation_errors = np.asarray(translation_errors, dtype=np.float64)
+        rotation_errors = np.asarray(rotation_errors, dtype=np.float64)
+        nr_matches = len(translation_errors)
+        if nr_matches == 0 or progress <= 0:
+            return None
+        random_state = np.random.RandomState(self.seed)
+        nr_remaining_matches = random_state.poisson(nr_matches * (1 - min(progress, 1)) / progress, size=self.n_bootstrap)
+        values = []
+        for nr_remaining in nr_remaining_matches:
+            indices = np.concatenate([np.arange(nr_matches), random_state.randint(nr_matches, size=nr_remaining)])
+            sample = MapMatcherSample()
+            sample.translation_errors = translation_errors[indices]
+            sample.rotation_errors = rotation_errors[indices]
+            values.append(self.performance_measure(sample))
+        lower_bound, upper_bound = np.percentile(values, [50 * (1 - self.confidence), 50 * (1 + self.confidence)])
+        return float(np.mean(values)), float(lower_bound), float(upper_bound)
+
+    def hopeless(self, translation_errors, rotation_errors, progress):
+        """
+        Returns whether an evaluation can't beat the incumbent anymore with the given confidence (see estimate).
+        Evaluations without matches so far are never hopeless, since there's nothing to extrapolate from.
+        """
+        if self.incumbent is None or progress < self.min_progress:
+            return False
+        estimate = self.estimate(translation_errors, rotation_errors, progress)
+        if estimate is None:
+            return False
+        print("\tEstimated performance measure at progress ", round(progress, 3), ": ", round(estimate[0], 4),
+              " (", round(estimate[1], 4), " to ", round(estimate[2], 4), "), incumbent: ", round(self.incumbent, 4), sep="")
+        return estimate[2] < self.incumbent
@@ -0,0 +1,315 @@
+#!/usr/bin/env python3
+
+##########################################################################
+# Copyright (c) 2017 German Aerospace Center (DLR). All rights reserved. #
+# SPDX-License-Identifier: BSD-2-Clause                                  #
+##########################################################################
+
+"""
+Contains a durable job queue for spreading sample generation over several machines, without any external broker.
+
+The coordinator puts the parameters of samples it needs into a JobQueue (via a QueueSampleSource), which is a SQLite file
+that all machines can access. Independent worker processes (see run_worker) claim jobs from the queue, generate the samples
+with their own sample generator (e.g. a MapMatcherScriptSource) and add them to the shared SampleDatabase.
+Then, they mark the jobs as done, which lets the QueueSampleSource retrieve the samples from the database.
+
+Claimed jobs are leased to their worker for a limited time, which the worker renews while it's working on the job.
+If a worker dies, its lease expires and the job is queued again. Failed jobs are retried, up to max_attempts times in total.
+"""
+
+import os
+import time
+import pickle
+import socket
+import sqlite3
+import threading
+import traceback
+import concurrent.futures
+
+from .samples import MapMatcherSample
+from .sample_sources import SampleSource, SampleDatabase
+
+class JobQueue(object):
+    """
+    Durable queue of sample generation jobs in a SQLite file, which can be shared by processes on several machines.
+    Each job has one of the states 'queued', 'running', 'done' or 'failed'. Jobs are identified by the hash of their params_dict,
+    so putting the same parameters twice doesn't create a second job (unless the first one failed).
+    All state changes happen in SQLite transactions, so concurrent workers never claim the same job.
+    """
+
+    LOCK_TIMEOUT = 600 # Seconds to wait for other processes' write transactions
+
+    def __init__(self, queue_path, max_attempts=3):
+        """
+        Opens the job queue at queue_path, or creates a new one.
+
+        :param queue_path: Path to the queue's SQLite file.
+        :param max_attempts: Number of times a job is tried before it's marked as failed.
+                             Attempts whose worker died (i.e. its lease expired) count as well.
+        """
+        self.queue_path = queue_path
+        self.max_attempts = max_attempts
+        # The connection is shared with a QueueSampleSource's polling thread, so the threads are serialized by a lock
+        self._connection = sqlite3.connect(queue_path, timeout=JobQueue.LOCK_TIMEOUT, isolation_level=None, check_same_thread=False)
+        self._thread_lock = threading.RLock()
+        self._connection.execute("CREATE TABLE IF NOT EXISTS jobs (params_hashed TEXT PRIMARY KEY, params_dict BLOB NOT NULL, "
+                                 "state TEXT NOT NULL, attempts INTEGER NOT NULL, worker TEXT, lease_expires REAL, error TEXT, "
+                                 "created REAL NOT NULL, updated REAL NOT NULL)")
+        self._connection.execute("CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, created)")
+
+    def _transaction(self, function, *args):
+        """
+        Calls function(*args) within a write transaction and returns its result.
+        The transaction is started with BEGIN IMMEDIATE, so no other process can change the queue in between.
+        """
+        with self._thread_lock:
+            self._connection.execute("BEGIN IMMEDIATE")
+            try:
+                result = function(*args)
+                self._connection.execute("COMMIT")
+                return result
+            except:
+                self._connection.execute("ROLLBACK")
+                raise
+
+    def put(self, params_dict):
+        """
+        Queues a job for generating the sample with the given parameters, unless there already is a job for them.
+        Failed jobs are queued again, with a fresh number of attempts.
+
+        :param params_dict: The parameters of the requested sample.
+        :return: The job's id, i.e. the hash of params_dict.
+        """
+        params_hashed = SampleDatabase.dict_hash(params_dict)
+        def put_job():
+            row = self._connection.execute("SELECT state FROM jobs WHERE params_hashed = ?", (params_hashed,)).fetchone()
+            now = time.time()
+            if row is None:
+                self._connection.execute("INSERT INTO jobs (params_hashed, params_dict, state, attempts, created, updated) VALUES (?, ?, 'queued', 0, ?, ?)",
+                                         (params_hashed, pickle.dumps(params_dict, protocol=pickle.HIGHEST_PROTOCOL), now, now))
+            elif row[0] == 'failed':
+                self._connection.execute("UPDATE jobs SET state = 'queued', attempts = 0, worker = NULL, error = NULL, updated = ? "
+                                         "WHERE params_hashed = ?", (now, params_hashed))
+        self._transaction(put_job)
+        return params_hashed
+
+    def claim(self, worker, lease_duration):
+        """
+        Claims the oldest queued job for a worker. Jobs whose lease expired are queued again (or failed) first.
+
+        :param worker: A name that identifies the worker, e.g. its host name and process id.
+        :param lease_duration: Seconds until the lease expires, unless it's renewed (see renew).
+        :return: Tuple (job_id, params_dict), or None if no job is queued.
+        """
+        def claim_job():
+            now = time.time()
+            self._requeue_expired(now)
+            row = self._connection.execute("SELECT params_hashed, params_dict FROM jobs WHERE state = 'queued' ORDER BY created LIMIT 1").fetchone()
+            if row is None:
+                return None
+            self._connection.execute("UPDATE jobs SET state = 'running', attempts = attempts + 1, worker = ?, lease_expires = ?, updated = ? "
+                                     "WHERE params_hashed = ?", (worker, now + lease_duration, now, row[0]))
+            return row[0], pickle.loads(row[1])
+        return self._transaction(claim_job)
+
+    def _requeue_expired(self, now):
+        """
+        Queues running jobs whose lease expired again, or marks them as failed if they used up their attempts.
+        Must be called within a transaction.
+        """
+        for job_id, worker, attempts in self._connection.execute("SELECT params_hashed, worker, attempts FROM jobs WHERE state = 'running' AND lease_expires < ?",
+                                                                 (now,)).fetchall():
+            print("\tLease of job", job_id, "by worker", worker, "expired.")
+            self._finish(job_id, "Lease of worker " + str(worker) + " expired", attempts, now)
+
+    def _finish(self, job_id, error, attempts, now):
+        """
+        Queues a job again after an attempt failed, or marks it as failed if it used up its attempts.
+        Must be called within a transaction.
+        """
+        state = 'queued' if attempts < self.max_attempts else 'failed'
+        self._connection.execute("UPDATE jobs SET state = ?, worker = NULL, lease_expires = NULL, error = ?, updated = ? WHERE params_hashed = ?",
+                                 (state, error, now, job_id))
+
+    def renew(self, job_id, worker, lease_duration):
+        """
+        Extends the lease of a worker on a running job.
+
+        :return: Whether the worker still holds the lease. If not, the job was given to another worker meanwhile.
+        """
+        def renew_lease():
+            now = time.time()
+            return self._connection.execute("UPDATE jobs SET lease_expires = ?, updated = ? WHERE params_hashed = ? AND state = 'running' AND worker = ?",
+                                            (now + lease_duration, now, job_id, worker)).rowcount == 1
+        return self._transaction(renew_lease)
+
+    def complete(self, job_id, worker):
+        """
+        Marks a job as done, after its sample was added to the database.
+        This also works if the worker's lease expired meanwhile, since the sample is there anyway.
+        """
+        def complete_job():
+            self._connection.execute("UPDATE jobs SET state = 'done', worker = ?, lease_expires = NULL, error = NULL, updated = ? WHERE params_hashed = ?",
+                                     (worker, time.time(), job_id))
+        self._transaction(complete_job)
+
+    def fail(self, job_id, worker, error):
+        """
+        Reports that a worker couldn't generate the sample of a job. The job is retried, unless it used up its attempts.
+        Reports of workers that lost their lease are ignored.
+
+        :param error: Description of the error, e.g. a traceback.
+        """
+        def fail_job():
+            row = self._connection.execute("SELECT attempts FROM jobs WHERE params_hashed = ? AND state = 'running' AND worker = ?",
+                                           (job_id, worker)).fetchone()
+            if row is not None:
+                self._finish(job_id, error, row[0], time.time())
+        self._transaction(fail_job)
+
+    def status(self, job_id):
+        """
+        Returns a dict with the 'state', 'attempts', 'worker' and 'error' of a job, or None if there's no such job.
+        """
+        with self._thread_lock:
+            row = self._connection.execute("SELECT state, attempts, worker, error FROM jobs WHERE params_hashed = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        return dict(zip(['state', 'attempts', 'worker', 'error'], row))
+
+    def counts(self):
+        """
+        Returns a dict that maps each state to the number of jobs in that state.
+        """
+        with self._thread_lock:
+            return dict(self._connection.execute("SELECT state, COUNT(*) FROM jobs GROUP BY state").fetchall())
+
+class QueueSampleSource(SampleSource):
+    """
+    Sample source that doesn't generate samples itself, but puts jobs for them into a JobQueue.
+    Worker processes (see run_worker) generate the samples and add them to the SampleDatabase, from which they're retrieved.
+    Thus, the QueueSampleSource has to be the sample_generator of that SampleDatabase, which has to be assigned to its database
+    member after creating the database.
+
+    Like the PoolSampleSource, it has a submit method that returns a concurrent.futures.Future.
+    A background thread polls the queue for finished jobs every poll_interval seconds and resolves their futures.
+    """
+    def __init__(self, job_queue, poll_interval=10, sample_type=MapMatcherSample):
+        """
+        :param job_queue: The JobQueue the workers take the jobs from.
+        :param poll_interval: Seconds between checks for finished jobs.
+        :param sample_type: The type of the samples generated by the workers.
+        """
+        print("Setting up QueueSampleSource with queue", job_queue.queue_path)
+        self.job_queue = job_queue
+        self.poll_interval = poll_interval
+        self._sample_type = sample_type
+        self.database = None
+        self._waiting = {} # Maps job ids to (params_dict, future) tuples
+        self._waiting_lock = threading.Lock()
+        self._poller = None
+
+    def submit(self, params_dict):
+        """
+        Queues a job for the sample with the given parameters.
+
+        :return: A concurrent.futures.Future, whose result is the sample, as stored in the database by a worker.
+        """
+        if self.database is None:
+            raise RuntimeError("QueueSampleSource needs the database the workers add samples to, assign it to its database member.")
+        job_id = self.job_queue.put(params_dict)
+        print("\tQueued job", job_id, "- jobs by state:", self.job_queue.counts())
+        with self._waiting_lock:
+            if not job_id in self._waiting:
+                self._waiting[job_id] = (params_dict, concurrent.futures.Future())
+            if self._poller is None or not self._poller.is_alive():
+                self._poller = threading.Thread(target=self._poll, daemon=True)
+                self._poller.start()
+            return self._waiting[job_id][1]
+
+    def _poll(self):
+        """
+        Resolves the futures of finished jobs, until no job is waiting anymore.
+        """
+        while True:
+            with self._waiting_lock:
+                waiting = list(self._waiting.items())
+                if len(waiting) == 0:
+                    self._poller = None
+                    return
+            for job_id, (params_dict, future) in waiting:
+                status = self.job_queue.status(job_id)
+                if status['state'] in ['queued', 'running']:
+                    continue
+                try:
+                    if status['state'] == 'failed':
+                        raise RuntimeError("Job for sample " + job_id + " failed after " + str(status['attempts']) + " attempts:\n" + str(status['error']))
+                    future.set_result(self.database[params_dict])
+                except BaseException as e:
+                    future.set_exception(e)
+                with self._waiting_lock:
+                    del self._waiting[job_id]
+            time.sleep(self.poll_interval)
+
+    def __getitem__(self, params_dict):
+        """
+        Queues a job for the sample with the given parameters and blocks until a worker finished it.
+
+        :param params_dict: A dictionary of parameters of the requested sample.
+        """
+        return self.submit(params_dict).result()
+
+    @property
+    def sample_type(self):
+        """
+        The type of the samples generated by the workers.
+        """
+        return self._sample_type
+
+def run_worker(job_queue, sample_db, sample_generator, lease_duration=600, poll_interval=10, max_jobs=None, worker=None):
+    """
+    Runs a worker, which claims jobs from job_queue, generates their samples with sample_generator and adds them to sample_db.
+    The worker renews its lease while a sample is being generated, every third of lease_duration.
+    Exceptions of the sample_generator are reported to the queue (see JobQueue.fail), then the worker goes on with the next job.
+
+    :param job_queue: The JobQueue to take jobs from.
+    :param sample_db: The SampleDatabase to add the samples to, usually the same one the coordinator uses.
+    :param sample_generator: Sample source that actually generates samples, e.g. a MapMatcherScriptSource.
+    :param lease_duration: Seconds after which a job is given to another worker if this one doesn't renew its lease (e.g. since it died).
+    :param poll_interval: Seconds to wait before checking again, if the queue is empty.
+    :param max_jobs: Stop after this many jobs. If None, runs forever.
+    :param worker: Name of the worker in the queue, defaults to host name and process id.
+    :return: The number of finished jobs (including failed ones).
+    """
+    worker = worker or socket.gethostname() + ":" + str(os.getpid())
+    print("Starting worker", worker, "on queue", job_queue.queue_path)
+    nr_jobs = 0
+    with concurrent.futures.ThreadPoolExecutor(1) as executor:
+        while max_jobs is None or nr_jobs < max_jobs:
+            job = job_queue.claim(worker, lease_duration)
+            if job is None:
+                time.sleep(poll_interval)
+                continue
+            job_id, params_dict = job
+            print("\tWorker", worker, "claimed job", job_id)
+            try:
+                if not sample_db.exists(params_dict): # The sample may have been added before its job was finished, e.g. by a worker that died
+                    generation = executor.submit(sample_generator.__getitem__, params_dict)
+                    while True:
+                        try:
+                            sample = generation.result(timeout=lease_duration / 3)
+                            break
+                        except concurrent.futures.TimeoutError:
+                            if not job_queue.renew(job_id, worker, lease_duration):
+                                print("\tWarning: Worker", worker, "lost its lease on job", job_id, "- finishing it anyway.")
+                    try:
+                        sample_db.add_sample(sample, params_dict)
+                    except LookupError: # Another worker finished it meanwhile
+                        pass
+                job_queue.complete(job_id, worker)
+            except Exception:
+                print("\tWorker", worker, "failed on job", job_id)
+                traceback.print_exc()
+                job_queue.fail(job_id, worker, traceback.format_exc())
+            nr_jobs += 1
+    return nr_jobs
@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+
+##########################################################################
+# Copyright (c) 2017 German Aerospace Center (DLR). All rights reserved. #
+# SPDX-License-Identifier: BSD-2-Clause                                  #
+##########################################################################
+
+"""
+Contains a scheduler for evaluating many candidate points cheaply on fractions of the dataset ("fidelities"),
+and only evaluating the promising ones on the complete dataset.
+The low-fidelity samples are stored in the SampleDatabase with an additional fidelity parameter (see sample_sources.with_fidelity),
+so they don't show up among the samples that define the ObjectiveFunction, and their values never reach the optimizer's Gaussian process.
+"""
+
+class SuccessiveHalving(object):
+    """
+    Successive halving scheduler: All candidates are evaluated at the lowest fidelity, then the best 1/eta of them
+    are promoted to the next higher fidelity, which is eta times as high, and so on until the remaining ones are evaluated at full fidelity.
+    E.g. with min_fidelity 1/9 and eta 3, 27 candidates are evaluated on a ninth of the dataset, 9 of them on a third and 3 completely.
+    That's the cost of 9 complete evaluations for finding the best of 27 candidates, as long as the ranking at low fidelities is meaningful.
+    """
+    def __init__(self, obj_function, min_fidelity=1/9, eta=3):
+        """
+        Creates a SuccessiveHalving scheduler.
+
+        :param obj_function: The ObjectiveFunction to evaluate the candidates with (see ObjectiveFunction.evaluate_batch).
+        :param min_fidelity: The fraction of the dataset the candidates are evaluated on first, in (0, 1].
+        :param eta: Factor by which the fidelity increases and the number of candidates decreases per rung. Has to be greater than 1.
+        """
+        if not 0 < min_fidelity <= 1:
+            raise ValueError("min_fidelity has to be in (0, 1].", min_fidelity)
+        if not eta > 1:
+            raise ValueError("eta has to be greater than 1.", eta)
+        self.obj_function = obj_function
+        self.eta = eta
+        self.fidelities = [1.0]
+        while self.fidelities[0] / eta >= min_fidelity * (1 - 1e-9): # Tolerate rounding errors, e.g. for min_fidelity = 1/9
+            self.fidelities.insert(0, self.fidelities[0] / eta)
+
+    def run(self, candidates):
+        """
+        Evaluates the candidates rung by rung, see class documentation.
+        The candidates of each rung are evaluated as a batch, i.e. concurrently if the ObjectiveFunction's sample_source supports it.
+
+        :param candidates: List of optimized_params dicts, like the keyworded arguments of ObjectiveFunction.evaluate.
+        :return: List of tuples (candidate, value) for the candidates that were evaluated at full fidelity, with their full-fidelity values.
+        """
+        for fidelity in self.fidelities:
+            print("\tSuccessive halving: Evaluating ", len(candidates), " candidates at fidelity ", round(fidelity, 4), ".", sep="")
+            # evaluate_batch preprocesses the params in place, so it gets copies
+            values = self.obj_function.evaluate_batch([candidate.copy() for candidate in candidates], fidelity if fidelity < 1 else None)
+            if fidelity == self.fidelities[-1]:
+                return list(zip(candidates, values))
+            nr_promoted = max(1, len(candidates) // self.eta)
+            ranking = sorted(range(len(candidates)), key=lambda i: values[i], reverse=True)
+            candidates = [candidates[i] for i in ranking[:nr_promoted]]
@@ -20,7 +20,10 @@ optimized_params contains only those parameters that are currently being optimiz
 To get from a specific set of optimized_params to the complete_params, default_params are used to determine the values of all non-optimized parameters.
 """
 
+import concurrent.futures
+
 from .performance_measures import PerformanceMeasure
+from .sample_sources import with_fidelity
 
 class ObjectiveFunction(object):
     """
@@ -39,7 +42,8 @@ class ObjectiveFunction(object):
     However, this will only work as long as the types are somewhat compatible.
     """
 
-    def __init__(self, sample_source, performance_measure, default_params, design_space, rounding_decimal_places=0, normalization=True):
+    def __init__(self, sample_source, performance_measure, default_params, design_space, rounding_decimal_places=0, normalization=True,
+                 neighbour_tolerance=0, censored_penalty=None):
         """
         Creates an ObjectiveFunction object.
         
@@ -58,6 +62,12 @@ class ObjectiveFunction(object):
         :param normalization: Set to False if the optimization modules aren't working on normalized values.
                               If True, the objective function will denormalize requests it gets from the optimization modules before passing
                               them to the evaluation modules.
+        :param neighbour_tolerance: If greater than zero and the sample_source supports it (see SampleDatabase.nearest),
+                                    evaluate uses existing samples within this distance instead of generating new ones.
+                                    The distance is measured in the normalized parameter space, i.e. each parameter's
+                                    design_space bounds have a distance of 1.
+        :param censored_penalty: The value of censored samples, i.e. of evaluations that were aborted since they exceeded
+                                 their budget (see MapMatcherScriptSource). Defaults to the lower bound of the performance_measure's value_range.
         """
 
         # error checking
@@ -71,6 +81,8 @@ class ObjectiveFunction(object):
         self.design_space = design_space
         self._rounding_decimal_places = rounding_decimal_places
         self._normalization = normalization
+        self.neighbour_tolerance = neighbour_tolerance
+        self.censored_penalty = censored_penalty if censored_penalty is not None else performance_measure.value_range[0]
         if not self._rounding_decimal_places == 0:
             print("\tWill round floating parameters to", self._rounding_decimal_places, "decimal places."\
                   " (e.g. 0.12918318241288 to", round(0.12918318241288, self._rounding_decimal_places), ")")
@@ -78,6 +90,8 @@ class ObjectiveFunction(object):
             print("\tWill normalize parameter values within the bounds given by the design space.")
         else:
             print("\tWill not normalize parameters, this may degenerate optimization performance.")
+        if self.neighbour_tolerance > 0:
+            print("\tWill reuse existing samples within a (normalized) distance of", self.neighbour_tolerance, "of requested ones.")
 
     def evaluate(self, **optimized_params):
         """
@@ -94,6 +108,63 @@ class ObjectiveFunction(object):
         :param optimized_params: A keyworded argument list (used as a dictionary with parameter names as keys).
         """
 
+        complete_params = self._complete_params(optimized_params)
+        # Get the sample from the sample source
+        sample = self._neighbour(complete_params)
+        if sample is None:
+            sample = self.sample_source[complete_params]
+        return self._rate(sample)
+
+    def evaluate_batch(self, optimized_params_list, fidelity=None):
+        """
+        Calculates the objective function's values at several points at once, e.g. for a batch proposed by acquisition.propose_batch.
+        If the sample_source has a submit method (e.g. a SampleDatabase that uses a PoolSampleSource), all samples that need to be
+        generated are generated concurrently. Otherwise, this is the same as calling evaluate for each point.
+
+        :param optimized_params_list: List of optimized_params dicts, like the keyworded arguments of evaluate.
+        :param fidelity: Optionally, the fraction of the dataset the samples are evaluated on (see sample_sources.with_fidelity).
+                         Values of different fidelities aren't comparable, since the performance measure rates fewer matches.
+        :return: List of the values at the given points, in the same order.
+        """
+        futures = [self._submit(optimized_params, fidelity) for optimized_params in optimized_params_list]
+        return [future.result() for future in futures]
+
+    def submit(self, **optimized_params):
+        """
+        Non-blocking variant of evaluate, for asynchronous optimization.
+        If the sample_source has a submit method (see evaluate_batch), the sample is generated in the background.
+        Otherwise, this blocks until the sample is available, like evaluate.
+
+        :param optimized_params: A keyworded argument list (used as a dictionary with parameter names as keys).
+        :return: A concurrent.futures.Future, whose result is the objective function's value at optimized_params.
+        """
+        return self._submit(optimized_params)
+
+    def _submit(self, optimized_params, fidelity=None):
+        """
+        Implements submit, for samples at the given fidelity (see evaluate_batch).
+        """
+        complete_params = self._complete_params(optimized_params, fidelity)
+        sample = self._neighbour(complete_params)
+        if sample is None and hasattr(self.sample_source, 'submit'):
+            requested_sample = self.sample_source.submit(complete_params)
+        else:
+            requested_sample = concurrent.futures.Future()
+            requested_sample.set_result(sample if sample is not None else self.sample_source[complete_params])
+        value = concurrent.futures.Future()
+        def rate(requested_sample):
+            try:
+                value.set_result(self._rate(requested_sample.result()))
+            except BaseException as e:
+                value.set_exception(e)
+        requested_sample.add_done_callback(rate)
+        return value
+
+    def _complete_params(self, optimized_params, fidelity=None):
+        """
+        Preprocesses the optimized_params requested by the optimizer (see preprocess_optimized_params), in place,
+        and returns the complete_params that define the corresponding sample, at the given fidelity (see evaluate_batch).
+        """
         print("\033[1;34mSampling objective function at:", end="")
         # Preprocess the parameters
         if self._normalization:
@@ -106,17 +177,45 @@ class ObjectiveFunction(object):
                 if self._rounding_decimal_places and isinstance(value, float):
                     normalized_parameters[name] = round(normalized_parameters[name], self._rounding_decimal_places)
                 print(" (norm: ", normalized_parameters[name], ")", sep="", end="")
+        if fidelity is not None:
+            print("\n\tat fidelity", fidelity, end="")
         print("\033[0m")
         # Create the full set of parameters by updating the default parameters with the optimized parameters.
         complete_params = self.default_params.copy()
         complete_params.update(optimized_params)
-        # Get the sample from the sample source
-        sample = self.sample_source[complete_params]
-        # Calculate and return the metric
-        value = self.performance_measure(sample)
+        return with_fidelity(complete_params, fidelity)
+
+    def _rate(self, sample):
+        """
+        Calculates and returns the performance_measure's value of a sample requested by evaluate.
+        """
+        value = self._value(sample)
         print("\033[1;34m\tSample's performance measure:\033[1;37m", value, "\033[0m")
         return value
 
+    def _value(self, sample, performance_measure=None):
+        """
+        Returns the performance_measure's value of a sample, or the censored_penalty if the sample is censored.
+        """
+        censored = getattr(sample, 'censored', None)
+        if censored is not None:
+            return self.censored_penalty
+        return (performance_measure or self.performance_measure)(sample)
+
+    def _neighbour(self, complete_params):
+        """
+        Returns an existing sample within neighbour_tolerance of complete_params, or None if there is none (or it's disabled).
+        """
+        if self.neighbour_tolerance <= 0 or not hasattr(self.sample_source, 'nearest'):
+            return None
+        scales = {p_name: 1 / (p_max - p_min) for p_name, (p_min, p_max) in self.design_space.items()}
+        neighbour = self.sample_source.nearest(complete_params, scales, self.neighbour_tolerance)
+        if neighbour is None:
+            return None
+        sample, params_dict = neighbour
+        print("\tReusing existing sample with parameters:", {p_name: params_dict[p_name] for p_name in self.design_space})
+        return sample
+
     def normalize_parameters(self, optimized_params):
         """
         Takes a dict of optimized parameters as given by the evaluation modules and normalizes the values.
@@ -203,6 +302,13 @@ class ObjectiveFunction(object):
         Returns samples in the same format as __iter__.
         :param enforce_bounds: If set to True, only samples are returned which also lie in the current design_space.
         """
+        if hasattr(self.sample_source, 'select'):
+            # Let the sample source find the samples, so it doesn't have to load all samples from disk
+            free_params_bounds = {p_name: bounds for p_name, bounds in self.design_space.items() if not p_name in fixed_params}
+            fixed_params = {p_name: p_value for p_name, p_value in self.default_params.items() if not p_name in free_params_bounds}
+            for sample, params_dict, value in self.scores(self.sample_source.select(fixed_params, free_params_bounds)):
+                yield params_dict, value, sample
+            return
         for x, y, s in self:
             # For each sample, check if it's usable:
             usable = True
@@ -225,16 +331,74 @@ class ObjectiveFunction(object):
 
         This means only information from those Samples are yielded, which have parameter values matching the ones in default_params .
         Only parameter values of currently optimized parameters are allowed to differ.
-        The filtering is done in the _defined_by function.
+        The filtering is done by the sample_source's select method, if it has one. Otherwise, in the _defined_by function.
         
         Yields tuples (x, y, s), with
             x: A dict of the complete rosparams that were used to create that sample.
             y: The sample's value as given by the current performance measure.
             s: The sample itself, in case other information needs to be extracted.
         """
+        for sample, params_dict, value in self.scores(self.samples()):
+            yield params_dict, value, sample
+
+    def samples(self):
+        """
+        Iterator over the samples which define this ObjectiveFunction (see __iter__), without rating them.
+        If the sample_source is a SampleDatabase, the samples are SampleHandles, which only load a sample when its data is accessed.
+
+        Yields tuples (s, x), with the sample s and the dict x of the complete rosparams that were used to create that sample.
+        """
+        if hasattr(self.sample_source, 'select'):
+            # Let the sample source do the filtering, so it only needs to load relevant samples from disk
+            fixed_params = {p_name: p_value for p_name, p_value in self.default_params.items() if not p_name in self.design_space}
+            for sample, params_dict in self.sample_source.select(fixed_params, {p_name: None for p_name in self.design_space}):
+                yield sample, params_dict
+            return
         for sample, params_dict in self.sample_source:
             if self._defined_by(params_dict):
-                yield params_dict, self.performance_measure(sample), sample
+                yield sample, params_dict
+
+    def scores(self, samples, performance_measure=None):
+        """
+        Iterator that rates samples with a performance measure, using the scores cached by the sample_source if possible.
+
+        :param samples: Iterable of (sample, params_dict) tuples, like returned by samples. params_dict may be None.
+        :param performance_measure: The measure to use, defaults to this ObjectiveFunction's performance_measure.
+        Yields tuples (s, x, y) with the sample s, its params_dict x and its value y.
+        """
+        performance_measure = performance_measure or self.performance_measure
+        fingerprint = performance_measure.fingerprint if hasattr(self.sample_source, 'store_scores') else None
+        if fingerprint is None:
+            for sample, params_dict in self._prefetched(samples, performance_measure):
+                yield sample, params_dict, self._value(sample, performance_measure)
+            return
+        new_scores = {}
+        try:
+            for sample, params_dict in self._prefetched(samples, performance_measure, fingerprint):
+                cached_scores = getattr(sample, 'scores', None) # Only SampleHandles of the sample_source have cached scores
+                if cached_scores is not None and fingerprint in cached_scores:
+                    yield sample, params_dict, cached_scores[fingerprint]
+                    continue
+                value = self._value(sample, performance_measure)
+                if cached_scores is not None and getattr(sample, 'censored', None) is None: # The penalty may change
+                    new_scores[sample.params_hashed] = value
+                yield sample, params_dict, value
+        finally:
+            if new_scores: # Also store the scores calculated so far if the iteration is stopped early
+                self.sample_source.store_scores(fingerprint, new_scores)
+
+    def _prefetched(self, samples, performance_measure=None, fingerprint=None):
+        """
+        Returns the given iterable of (sample, params_dict) tuples, as loaded in parallel by the sample_source
+        (see SampleDatabase.iter_parallel), if the performance_measure needs the complete samples.
+        If a fingerprint is given, samples that have a cached score for it aren't loaded.
+        """
+        performance_measure = performance_measure or self.performance_measure
+        if performance_measure.summary_only or not hasattr(self.sample_source, 'iter_parallel'):
+            return samples
+        if fingerprint is None:
+            return self.sample_source.iter_parallel(samples)
+        return self.sample_source.iter_parallel(samples, skip_loading=lambda handle: fingerprint in handle.scores)
 
     def _defined_by(self, complete_params):
         """
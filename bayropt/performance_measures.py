@@ -10,6 +10,8 @@ Classes for different ways to measure the map matcher's performance, based on in
 Only classes that end with Measure (not *Function classes) take a Sample as __call__ parameter and are meant for immediate usage with objective_function.py.
 """
 
+import json
+import hashlib
 import numpy as np
 import matplotlib.pyplot as plt
 import matplotlib as matplotlib
@@ -49,6 +51,10 @@ class PerformanceMeasure(object):
 
     AVAILABLE_TYPES = ['LogisticTranslationErrorMeasure', 'LogisticMaximumErrorMeasure', 'MixerMeasure', 'ZeroMeanMixerMeasure', 'NrMatchesMeasure']
 
+    # Whether the measure only needs attributes that are also in a MapMatcherSampleSummary (e.g. nr_matches).
+    # If not, users that rate many samples should load them in bulk beforehand (see SampleDatabase.iter_parallel).
+    summary_only = False
+
     def __init__(self):
         """
         Placeholder constructor, will maybe do sth in the future...
@@ -93,10 +99,29 @@ class PerformanceMeasure(object):
         """
         return (0, 1)
 
+    def to_dict(self):
+        """
+        Returns the measure's configuration as dict, in the format from_dict expects.
+        Returns None for measures that can't be created by from_dict.
+        """
+        return None
+
+    @property
+    def fingerprint(self):
+        """
+        A hash of the measure's configuration (see to_dict), which identifies the scores the measure calculates.
+        Used to cache scores of samples, see ObjectiveFunction.scores. None, if the measure has no dict representation.
+        """
+        measure_dict = self.to_dict()
+        if measure_dict is None:
+            return None
+        return hashlib.sha1(json.dumps(measure_dict, sort_keys=True).encode('utf-8')).hexdigest()
+
     @classmethod
     def from_dict(cls, measure_dict):
         if measure_dict['type'] == cls.AVAILABLE_TYPES[0]: # LogisticTranslationErrorMeasure
-            return LogisticTranslationErrorMeasure(max_relevant_error=measure_dict['max_relevant_error'])
+            return LogisticTranslationErrorMeasure(max_relevant_error=measure_dict['max_relevant_error'],
+                                                   min_relevant_error=measure_dict.get('min_relevant_error', 0.05))
         elif measure_dict['type'] == cls.AVAILABLE_TYPES[1]: # LogisticMaximumErrorMeasure
             return LogisticMaximumErrorMeasure(submap_size=measure_dict['submap_size'], max_relevant_error=measure_dict['max_relevant_error'])
         elif measure_dict['type'] == cls.AVAILABLE_TYPES[2]: # MixerMeasure
@@ -159,6 +184,10 @@ class LogisticTranslationErrorMeasure(LogisticFunction):
         k = - (np.log(-(l / (self.x_min_y_value - 1)) - 1)) / (self.min_relevant_error - self.max_relevant_error)
         super().__init__(l, x0, k)
 
+    def to_dict(self):
+        return {'type': 'LogisticTranslationErrorMeasure', 'max_relevant_error': self.max_relevant_error,
+                'min_relevant_error': self.min_relevant_error}
+
     def __call__(self, sample):
         if isinstance(sample, np.ndarray) or isinstance(sample, float): # Special case for plotting the function
             return super(LogisticTranslationErrorMeasure, self).__call__(sample)
@@ -212,6 +241,12 @@ class MixerMeasure(PerformanceMeasure):
         """
         return 1 - self.matches_weight
 
+    def to_dict(self):
+        if self.error_measure.to_dict() is None or self.matches_measure.to_dict() is None:
+            return None
+        return {'type': type(self).__name__, 'error_measure': self.error_measure.to_dict(),
+                'matches_measure': self.matches_measure.to_dict(), 'matches_weight': self.matches_weight}
+
     def __str__(self):
         #return u"$p(\\mathbf{e^t}, \\mathbf{e^r}, m) = " + str(self.matches_weight) + u" \\cdot \\upsilon(m) + " + str(self.error_weight) + u" \\cdot \\epsilon(\\mathbf{e^t}, \\mathbf{e^r})$"
         return u"$p(\\mathbf{e^t}, \\mathbf{e^r}, m)$"
@@ -264,6 +299,9 @@ class LogisticMaximumErrorMeasure(LogisticTranslationErrorMeasure):
         self.submap_size = submap_size
         super().__init__(max_relevant_error)
 
+    def to_dict(self):
+        return {'type': 'LogisticMaximumErrorMeasure', 'submap_size': self.submap_size, 'max_relevant_error': self.max_relevant_error}
+
     def __call__(self, sample):
         if isinstance(sample, np.ndarray) or isinstance(sample, float): # Special case for plotting the function
             return super(LogisticMaximumErrorMeasure, self).__call__(sample)
@@ -284,7 +322,11 @@ class NrMatchesMeasure(PerformanceMeasure):
     """
     Uses the function x / (a + x) to map the number of matches to [0,1).
     More matches means this measure gets closer to 1.
+    Since it only needs the number of matches, it also accepts a MapMatcherSampleSummary instead of a sample.
     """
+
+    summary_only = True
+
     def __init__(self, expected_nr_matches):
         """
         :param expected_nr_matches: A number of matches which is already considered quite good for the dataset
@@ -295,6 +337,9 @@ class NrMatchesMeasure(PerformanceMeasure):
         self.expected_nr_matches_y_value = 0.9
         self.a = self.expected_nr_matches * (1 - self.expected_nr_matches_y_value) / self.expected_nr_matches_y_value
 
+    def to_dict(self):
+        return {'type': 'NrMatchesMeasure', 'expected_nr_matches': self.expected_nr_matches}
+
     def __str__(self):
         return u"$\\upsilon_a(m) = \\frac{m}{a + m}$"
 
@@ -7,10 +7,28 @@
 
 import os
 import sys
+import json
+import hashlib
+import numbers
 import pickle
+import sqlite3
+import time
+import itertools
+import threading
+import collections
+import signal
+import datetime
+import traceback
+import multiprocessing
+import concurrent.futures
 import numpy as np
+try:
+    import resource
+except ImportError: # Not available on Windows, evaluation budgets aren't supported there
+    resource = None
 
-from .samples import MapMatcherSample
+from .samples import MapMatcherSample, MapMatcherSampleSummary
+from .storage import Journal, ColumnArena, LRUCache, FileLock, PackedPayload, NeighbourIndex, SingleFlight
 
 """
 Contains classes that serve as sample sources and are able to generate samples.
@@ -22,7 +40,7 @@ This modules expects parameters that define a sample as a python dictionary.
 For quick tests, you can use MapMatcherScriptSourceTest to get some fake MapMatcherSample objects without long evaluation durations.
 When using a real sample source, consider using within the SampleDatabase class.
 The SampleDatabase can be used as a intermediate layer between objective function and your actual sample source.
-It will save all generated sample in a pickled dictionary.
+It will save all generated sample in a journaled, pickled dictionary.
 This way, samples won't be generated twice, for example if you rerun your experiment.
 Additionally, SampleDatabase supplies methods to iterate over all generated samples, which can useful for visualization purposes.
 """
@@ -48,11 +66,67 @@ class SampleSource(object):
         """
         return None
 
+FIDELITY_PARAM = "fidelity" # Name of the parameter that holds the fidelity of low-fidelity samples
+
+def with_fidelity(params_dict, fidelity):
+    """
+    Returns a copy of params_dict for requesting a sample at the given fidelity, i.e. on that fraction of the dataset.
+    The fidelity is stored as an additional parameter, so the SampleDatabase keys samples by fidelity as well.
+    Full fidelity (None or 1) leaves the params_dict unchanged, so those samples are the same as without multi-fidelity evaluation.
+
+    :param params_dict: A dictionary of parameters.
+    :param fidelity: The fraction of the dataset to evaluate on, in (0, 1].
+    """
+    params_dict = params_dict.copy()
+    params_dict.pop(FIDELITY_PARAM, None)
+    if fidelity is not None and fidelity < 1:
+        if fidelity <= 0:
+            raise ValueError("The fidelity has to be in (0, 1].", fidelity)
+        params_dict[FIDELITY_PARAM] = float(fidelity)
+    return params_dict
+
+def split_fidelity(params_dict):
+    """
+    The inverse of with_fidelity: Returns a tuple (params_dict, fidelity) of a copy of params_dict without the fidelity
+    and the fidelity, which is None for full fidelity.
+    """
+    params_dict = params_dict.copy()
+    return params_dict, params_dict.pop(FIDELITY_PARAM, None)
+
+def unpickle_sample_file(pickle_path, sample_type, fallback_paths=()):
+    """
+    Loads a sample from its pickled representation and checks that it has the expected type.
+    The file may either be a plain pickle or a packed payload (see storage.PackedPayload), which is detected automatically.
+    This is a module-level function, so it can be executed in a process pool (see SampleDatabase.load_many).
+
+    :param pickle_path: Path to the Sample's pickled representation.
+    :param sample_type: The type the sample is expected to have.
+    :param fallback_paths: Paths that are tried if there's no file at pickle_path (see SampleDatabase._pickle_paths).
+                           pickle_path is tried again last, in case the file was just moved there (see SampleDatabase.migrate_sample_files).
+    """
+    # Just try to open each path: Checking whether the file exists first would race with files being moved meanwhile
+    for path in [pickle_path] + list(fallback_paths):
+        try:
+            sample_pickle_handle = open(path, 'rb')
+            pickle_path = path
+            break
+        except FileNotFoundError:
+            continue
+    else:
+        raise FileNotFoundError("Couldn't find the sample's pickled representation at any of", [pickle_path] + list(fallback_paths))
+    with sample_pickle_handle:
+        if PackedPayload.is_packed(sample_pickle_handle):
+            sample = PackedPayload.load(sample_pickle_handle, sample_type)
+        else:
+            sample = pickle.load(sample_pickle_handle)
+        if not isinstance(sample, sample_type):
+            raise TypeError("The object unpickled from", pickle_path, "has the wrong type!",
+                            "Is:", type(sample), "should be:", sample_type)
+        return sample
+
 class SampleDatabase(SampleSource):
     """
     The SampleDatabase class can be used as an intermediate module between objective function and an actual sample source.
-    This class will only work while the PYTHONHASHSEED remains the same. To enforce this, set this env variable to a fixed value before starting your script.
-    Otherwise, the dict_hash method returns different results for the same parameter dictionary in different sessions.
 
     When a sample is requested via __getitem__, the database will immediately return that sample if it was previously generated.
     If it doesn't exist in the database, the request will be conveyed to the actual sample source, which will generate the sample.
@@ -63,36 +137,136 @@ class SampleDatabase(SampleSource):
     Each item contains the following data:
         * pickle_name: The name or identifier of the pickled sample object. Used to find the sample's pickled representation in the sample_dir.
         * params_dict: The complete rosparams dict used to generate this Sample. Its hash should be equal to the item's key.
+        * summary: The dict representation of the sample's MapMatcherSampleSummary (see samples.py).
+                   Allows using summary statistics of a sample without loading it from disk, see summary and summaries.
+    Since dict_hash only depends on the parameter values, the same database can be used from any process (and with any PYTHONHASHSEED).
+    Databases that were created with the old, seed-dependent hash are migrated to the new keys when they're opened.
+
+    The dict isn't rewritten completely on every change. Instead, changes are appended as records to a journal (see storage.Journal),
+    which lives next to the database file (database_path + ".journal"). When the database is opened, the journal is replayed on
+    top of the pickled dict. Once the journal has more records than both the compaction_interval and the number of samples,
+    the complete dict is pickled again and the journal is cleared. That way, adding or removing a sample takes (amortized)
+    constant time, independent of the database's size.
+
+    Samples returned by __getitem__ are kept in an in-memory LRU cache (see storage.LRUCache) with a budget of cache_size bytes.
+    Repeated requests for the same sample are answered from the cache, without reading the sample from disk again.
+    Note that this means repeated requests return the same sample object, so samples shouldn't be modified by their users.
+
+    Many samples can be loaded concurrently via load_many and iter_parallel, by a pool of loader_workers threads or processes.
+    Threads are usually sufficient to hide file system latency (e.g. on network file systems), since reading files
+    releases the GIL. Processes additionally parallelize the unpickling itself.
+
+    The payload_format determines how new samples are written to the sample_dir: Either as plain pickle ('pickle'),
+    or as compressed arrays ('packed', see storage.PackedPayload), which is much smaller for samples with many errors.
+    Samples in either format can always be read, so the format of an existing database can be changed at any time.
+
+    With many thousands of samples, a single sample_dir gets slow (directory lookups, listing, backups).
+    Thus, sample files can be sharded into shard_levels nested subdirectories, named after the leading hex digits of the
+    sha1 hash of the sample's pickle_name. Each level has 16^shard_width subdirectories, e.g. <sample_dir>/3f/a2/<name>.pkl.
+    Samples that are still in the flat sample_dir are found as well, migrate_sample_files moves them to their shards.
     """
 
-    def __init__(self, database_path, sample_dir_path, sample_generator):
+    # Whether _store_sample may be called from several threads at once
+    concurrent_payload_writes = True
+
+    def __init__(self, database_path, sample_dir_path, sample_generator, compaction_interval=1000, cache_size=64 * 2**20,
+                 loader_workers=8, loader_pool='thread', payload_format='pickle', payload_compression='zlib', payload_float32=False,
+                 shard_levels=0, shard_width=2):
         """
         Initializes the SampleDatabase object.
 
         :param database_path: Path to the database file (the pickled database dict).
         :param sample_dir_path: Path to the directory where samples created by this SampleDatabase should be stored.
         :param sample_generator: Sample source object that generates new samples via its __getitem__(params_dict) method.
+        :param compaction_interval: Minimum number of journal records before the journal is compacted into the database file.
+        :param cache_size: Memory budget of the sample cache in bytes. Set to 0 to disable caching.
+        :param loader_workers: Number of workers that load samples concurrently in load_many and iter_parallel.
+        :param loader_pool: Either 'thread' or 'process', the kind of pool used for loading samples concurrently.
+                            Payloads of samples added via add_samples are always written by threads.
+        :param payload_format: Either 'pickle' or 'packed', the format in which new samples are written.
+        :param payload_compression: Only used with the 'packed' payload_format. One of 'none', 'zlib' or 'lzma'.
+        :param payload_float32: Only used with the 'packed' payload_format. If True, errors are stored with single precision.
+                                Note that the summaries in the database are still calculated with the original precision.
+        :param shard_levels: Number of nested subdirectories of the sample_dir in which sample files are stored. 0 means no sharding.
+        :param shard_width: Number of hex digits per subdirectory name, i.e. each level has a fan-out of 16^shard_width.
         """
         # Error checking
         if os.path.isdir(database_path):
             raise ValueError("Given database path is a directory!", database_path)
         if not os.path.isdir(sample_dir_path):
             raise ValueError("Given sample_dir_path path is not a directory!", sample_dir_path)
+        if not loader_pool in ['thread', 'process']:
+            raise ValueError("loader_pool has to be either 'thread' or 'process'", loader_pool)
+        if not payload_format in ['pickle', 'packed']:
+            raise ValueError("payload_format has to be either 'pickle' or 'packed'", payload_format)
+        if not payload_compression in PackedPayload.COMPRESSIONS:
+            raise ValueError("payload_compression has to be one of", PackedPayload.COMPRESSIONS, payload_compression)
+        if shard_levels < 0 or shard_width < 1 or shard_levels * shard_width > 40:
+            raise ValueError("Invalid sharding, shard_levels * shard_width can't exceed the 40 digits of a sha1 hash", shard_levels, shard_width)
 
         self._database_path = database_path
         self.sample_dir_path = sample_dir_path
         self.sample_generator = sample_generator
+        self.compaction_interval = compaction_interval
+        self._cache = LRUCache(cache_size, SampleDatabase._sample_size)
+        self.loader_workers = loader_workers
+        self.loader_pool = loader_pool
+        self.payload_format = payload_format
+        self.payload_compression = payload_compression
+        self.payload_float32 = payload_float32
+        self.shard_levels = shard_levels
+        self.shard_width = shard_width
+        self._lock = FileLock(database_path + ".lock")
+        # Makes sure each sample is only generated once, even if it's requested by several threads or processes at once
+        self._single_flight = SingleFlight(database_path + ".inflight")
+        self._neighbour_indices = {} # Maps the scales used by nearest to a NeighbourIndex, see _neighbour_index
+        self._open_index()
 
-        if os.path.exists(self._database_path): # If file exists...
-            print("\tFound existing datapase pickle, loading from:", self._database_path, end=" ")
-            # ...initialize the database from the file handle (hopefully points to a pickled dict...)
-            with open(self._database_path, 'rb') as db_handle:
-                self._db_dict = pickle.load(db_handle)
-            print("- Loaded", len(self._db_dict), "samples.")
-        else:
-            print("\tDidn't find existing database pickle, initializing new database at", self._database_path, end=".\n")
-            self._db_dict = {} # ..otherwise initialize as an empty dict and save it
-            self._save()
+    def _open_index(self):
+        """
+        Loads the database dict from the database file and its journal, or creates a new one.
+        Subclasses that store the database differently overwrite this method, together with
+        _get_entry, _has_entry, _entries, _save, compact and __len__.
+        """
+        self._journal = Journal(self._database_path)
+        self._db_dict = {}
+        with self._lock.exclusive(): # Other processes may be creating or migrating the database at the same time
+            if os.path.exists(self._database_path): # If file exists...
+                print("\tFound existing datapase pickle, loading from:", self._database_path, end=" ")
+                # ...initialize the database from the file and apply all changes that were made since it was written
+                self._read_index()
+                print("- Loaded", len(self._db_dict), "samples.")
+                self._migrate_keys()
+            else:
+                print("\tDidn't find existing database pickle, initializing new database at", self._database_path, end=".\n")
+                self.compact() # ..otherwise save the empty dict
+
+    def refresh(self):
+        """
+        Picks up the changes other processes made to the database since this object read it last.
+        This is cheap if nothing changed, so it's called by exists, __len__ and all methods that iterate over the database.
+
+        Several processes (e.g. coordinators of different experiments) can safely work on the same database at the same time:
+        Reading the database files happens while holding a shared lock on the database's lock file,
+        changing them (see _save and compact) while holding it exclusively.
+        """
+        if self._journal.is_current() == (True, True):
+            return
+        with self._lock.shared():
+            self._read_index()
+
+    def _read_index(self):
+        """
+        Reads the snapshot again, if it was replaced by a compaction, and replays all journal records that weren't applied yet.
+        Must be called while holding the lock.
+        """
+        snapshot_current, journal_current = self._journal.is_current()
+        if not snapshot_current:
+            self._db_dict = self._journal.read_snapshot()
+            self._cache.clear()
+            self._neighbour_indices.clear()
+        for record in self._journal.replay():
+            self._apply(record)
 
     def __getitem__(self, params_dict):
         """
@@ -101,27 +275,106 @@ class SampleDatabase(SampleSource):
         Either from the dictionary, if a sample was already generated with those parameters.
         Otherwise, if the requested sample doesn't exist in the db, it'll get generated via the sample_generator member.
         This causes the function call to block until it's done. (possibly for hours)
+        If the same sample is already being generated for another thread or process that uses this database,
+        the call waits for that generation instead of starting another one (see storage.SingleFlight).
 
         :param params_dict: The parameters dictionary that defines the requested sample.
         """
 
         params_hashed = SampleDatabase.dict_hash(params_dict)
         if not self.exists(params_dict): # Check whether the sample needs to get generated
-            # Generate a new sample and store it in the database
-            print("\tNo sample with hash ", params_hashed, " in database, forwarding request to my sample_generator.")
-            generated_sample = self.sample_generator[params_dict]
-            print("\tSample generation finished, adding it to database.")
-            self.add_sample(generated_sample, params_dict)
+            with self._single_flight.owned(params_hashed):
+                # Check again, since the sample may have been generated by someone else while waiting for the ownership
+                if not self.exists(params_dict):
+                    # Generate a new sample and store it in the database
+                    print("\tNo sample with hash ", params_hashed, " in database, forwarding request to my sample_generator.")
+                    generated_sample = self.sample_generator[params_dict]
+                    self._register_sample(generated_sample, params_dict)
         # Get the sample's db entry
-        db_entry = self._db_dict[params_hashed]
+        db_entry = self._get_entry(params_hashed)
         # load the Sample from disk
         print("\tRetrieving sample ", db_entry['pickle_name'], "(hash: ", params_hashed, ") from db.", sep="'")
-        extracted_sample = self._unpickle_sample(db_entry['pickle_name'])
+        extracted_sample = self._cache.get(params_hashed)
+        if extracted_sample is None:
+            extracted_sample = self._load_sample(db_entry)
+            self._cache.put(params_hashed, extracted_sample)
         # Do a sanity check of the parameters, just in case of a hash collision
         if not params_dict == db_entry['params_dict']:
             raise LookupError("Got a sample with hash " + params_hashed + ", but its parameters didn't match the requested parameters. (Hash function collision?)", params_dict, db_entry['params_dict'])
         return extracted_sample
 
+    def submit(self, params_dict):
+        """
+        Non-blocking variant of __getitem__: Returns a concurrent.futures.Future, whose result is the requested sample.
+        If the sample needs to be generated and the sample_generator has a submit method too (e.g. a PoolSampleSource),
+        the generation runs in the background and the sample is added to the database as soon as it's finished.
+        Otherwise, the sample is retrieved (or generated) right away and the returned future is already done.
+        If the same sample is already being generated (see __getitem__), a background thread waits for that generation instead.
+
+        :param params_dict: The parameters dictionary that defines the requested sample.
+        """
+        result = concurrent.futures.Future()
+        if self.exists(params_dict) or not hasattr(self.sample_generator, 'submit'):
+            result.set_result(self[params_dict])
+            return result
+        params_hashed = SampleDatabase.dict_hash(params_dict)
+        if not self._single_flight.acquire(params_hashed, blocking=False):
+            print("\tSample with hash ", params_hashed, " is already being generated, waiting for it.")
+            threading.Thread(target=self._await_generation, args=(params_dict, result), daemon=True).start()
+            return result
+        try:
+            generated = self.exists(params_dict) # By someone else, right before acquiring the ownership
+            if not generated:
+                print("\tNo sample with hash ", params_hashed, " in database, submitting request to my sample_generator.")
+                generation = self.sample_generator.submit(params_dict)
+        except BaseException:
+            self._single_flight.release(params_hashed)
+            raise
+        if generated:
+            self._single_flight.release(params_hashed)
+            result.set_result(self[params_dict])
+            return result
+        generation.add_done_callback(lambda generation: self._register_generated(generation, params_dict, result))
+        return result
+
+    def _await_generation(self, params_dict, result):
+        """
+        Waits for the generation of a sample that someone else owns (see submit) and passes the sample on to the result future.
+        """
+        try:
+            result.set_result(self[params_dict])
+        except BaseException as e:
+            result.set_exception(e)
+
+    def _register_generated(self, generation, params_dict, result):
+        """
+        Adds a sample that was generated in the background (see submit) to the database and passes it on to the result future.
+        This is called by the thread that finished the generation, which also releases the ownership of the generation.
+        """
+        try:
+            registered_sample = self._register_sample(generation.result(), params_dict)
+        except BaseException as e:
+            self._single_flight.release(SampleDatabase.dict_hash(params_dict))
+            result.set_exception(e)
+            return
+        self._single_flight.release(SampleDatabase.dict_hash(params_dict))
+        result.set_result(registered_sample)
+
+    def _register_sample(self, generated_sample, params_dict):
+        """
+        Adds a sample that the sample_generator generated to the database and returns the sample stored in the database.
+        The sample may have been added already, e.g. by another process that generated it at the same time,
+        or by the workers of a QueueSampleSource. Then, the existing sample is kept.
+        """
+        if not self.exists(params_dict):
+            print("\tSample generation finished, adding it to database.")
+            try:
+                self.add_sample(generated_sample, params_dict)
+                return generated_sample
+            except LookupError: # It was added by someone else meanwhile
+                pass
+        return self[params_dict]
+
     @property
     def sample_type(self):
         """
@@ -129,43 +382,688 @@ class SampleDatabase(SampleSource):
         """
         return self.sample_generator.sample_type
 
-    def _save(self):
+    @property
+    def cache_stats(self):
+        """
+        Statistics of the sample cache, see storage.LRUCache.stats.
+        """
+        return self._cache.stats
+
+    @classmethod
+    def _sample_size(cls, sample):
+        """
+        Estimates how many bytes of memory the given sample occupies.
+        Lists are assumed to contain python floats.
+        """
+        size = sys.getsizeof(sample)
+        for value in vars(sample).values():
+            if isinstance(value, np.ndarray):
+                size += value.nbytes
+            elif isinstance(value, list):
+                size += sys.getsizeof(value) + len(value) * sys.getsizeof(0.0)
+            else:
+                size += sys.getsizeof(value)
+        return size
+
+    def _save(self, record, override_existing=True):
+        """
+        Applies a change record to the database dict and appends it to the journal.
+        Compacts the journal, if it got too long.
+
+        :param record: Tuple that describes the change, see _apply.
+        :param override_existing: If False, raises a LookupError if the record would replace an existing db entry.
+                                  This is checked while holding the lock, so it includes entries added by other processes.
+        """
+        with self._lock.exclusive():
+            self.refresh() # Records that other processes appended meanwhile have to be applied before this one
+            if not override_existing:
+                self._check_new_keys(record)
+            self._journal.append(record)
+            self._apply(record)
+            if len(self._journal) > max(self.compaction_interval, len(self._db_dict)):
+                self.compact()
+
+    def _apply(self, record):
+        """
+        Applies a single change record to the database dict.
+        Records are tuples, the first element determines the kind of change:
+            * ('add', params_hashed, db_entry): Sets the db entry at params_hashed.
+            * ('remove', params_hashed): Removes the db entry at params_hashed, if it exists.
+            * ('batch', records): Applies all records in the list, in order. Used to add many samples at once (see add_samples).
+            * ('scores', fingerprint, scores): Stores the scores of a performance measure in the db entries, see store_scores.
+        Applying the same record twice has the same effect as applying it once.
+        Cached samples of changed db entries are discarded, since the record may come from another process (see refresh).
+        """
+        if record[0] == 'scores':
+            for params_hashed, db_entry in SampleDatabase._scored_entries(record, self._db_dict.get):
+                self._db_dict[params_hashed] = db_entry
+        elif record[0] == 'add':
+            self._db_dict[record[1]] = record[2]
+            self._cache.discard(record[1])
+            self._update_neighbour_indices(record)
+        elif record[0] == 'remove':
+            self._db_dict.pop(record[1], None)
+            self._cache.discard(record[1])
+            self._update_neighbour_indices(record)
+        elif record[0] == 'batch':
+            for batched_record in record[1]:
+                self._apply(batched_record)
+        else:
+            raise ValueError("Unknown journal record type", record[0])
+
+    @classmethod
+    def _scored_entries(cls, record, get_entry):
+        """
+        Iterator over the (params_hashed, db_entry) tuples of db entries updated by a 'scores' record, see store_scores.
+        Scores are only stored in db entries that still refer to the same sample file as when the scores were calculated.
+
+        :param get_entry: Function that returns the current db entry for a hash, or None if there is none.
+        """
+        fingerprint, scores = record[1], record[2]
+        for params_hashed, (pickle_name, score) in scores.items():
+            db_entry = get_entry(params_hashed)
+            if db_entry is None or db_entry['pickle_name'] != pickle_name:
+                continue # The sample was removed or replaced meanwhile
+            db_entry = dict(db_entry) # Don't change the dicts SampleHandles refer to
+            db_entry['scores'] = dict(db_entry.get('scores', {}), **{fingerprint: score})
+            yield params_hashed, db_entry
+
+    def _check_new_keys(self, record):
+        """
+        Raises a LookupError if an 'add' record (or one within a 'batch' record) would replace an existing db entry.
+        """
+        if record[0] == 'batch':
+            for batched_record in record[1]:
+                self._check_new_keys(batched_record)
+        elif record[0] == 'add' and self._has_entry(record[1]):
+            raise LookupError("Newly created sample's hash already exists in the database! Hash:", str(record[1]),\
+                              "Existing sample's pickle name is:", self._get_entry(record[1])['pickle_name'])
+
+    def _discard_payloads(self, records):
         """
-        Pickles the current state of the database dict.
+        Deletes the stored data of samples whose 'add' records couldn't be saved, unless an existing db entry refers to it.
         """
-        with open(self._database_path, 'wb') as db_handle:
-            pickle.dump(self._db_dict, db_handle)
+        for record in records:
+            if self._has_entry(record[1]) and self._get_entry(record[1])['pickle_name'] == record[2]['pickle_name']:
+                continue # The data belongs to the existing db entry
+            self._delete_sample(record[2])
+
+    def _migrate_keys(self):
+        """
+        Re-keys databases that were indexed with python's built-in (PYTHONHASHSEED-dependent) hash function.
+        The new keys are calculated from the params_dict stored in each db entry, the sample files stay untouched.
+        """
+        if all(isinstance(params_hashed, str) for params_hashed in self._db_dict.keys()):
+            return # Nothing to do
+        print("\tMigrating database to seed-independent sample keys...", end=" ")
+        migrated_db_dict = {}
+        for db_entry in self._db_dict.values():
+            params_hashed = SampleDatabase.dict_hash(db_entry['params_dict'])
+            if params_hashed in migrated_db_dict:
+                print("\n\tWarning: Found duplicate entries for sample", db_entry['pickle_name'], "and", migrated_db_dict[params_hashed]['pickle_name'], "- only keeping the latter.")
+                continue
+            migrated_db_dict[params_hashed] = db_entry
+        self._db_dict = migrated_db_dict
+        self._neighbour_indices.clear()
+        self.compact()
+        print("Done.")
+
+    def compact(self):
+        """
+        Pickles the current state of the database dict and clears the journal.
+        """
+        with self._lock.exclusive():
+            self.refresh() # Otherwise, records of other processes would get lost
+            print("\tCompacting sample database journal into", self._database_path)
+            self._journal.compact(self._db_dict)
+
+    def _get_entry(self, params_hashed):
+        """
+        Returns the db entry with the given hash, raises a KeyError if it doesn't exist.
+        """
+        return self._db_dict[params_hashed]
+
+    def _has_entry(self, params_hashed):
+        """
+        Returns whether a db entry with the given hash exists.
+        """
+        return params_hashed in self._db_dict
+
+    def _entries(self):
+        """
+        Iterator over all (params_hashed, db_entry) tuples in the database.
+        """
+        self.refresh()
+        return iter(list(self._db_dict.items()))
 
     def exists(self, params_dict):
         """
         Returns whether a sample with the given rosparams already exists in the database.
         """
-        return SampleDatabase.dict_hash(params_dict) in self._db_dict.keys()
+        self.refresh()
+        return self._has_entry(SampleDatabase.dict_hash(params_dict))
 
     def __len__(self):
         """
         Returns the total number of samples stored in this database.
         """
+        self.refresh()
         return len(self._db_dict)
 
     def __iter__(self):
         """
-        Iterator for getting all sample objects contained in the database.
+        Iterator for getting all samples contained in the database.
+        The samples are yielded as SampleHandles, which only load the sample from disk when its data is accessed.
+
+        :return: Tuple (s, p), with the SampleHandle s and the corresponding params_dict p.
+        """
+        for params_hashed, db_entry in self._entries():
+            yield SampleHandle(self, params_hashed, db_entry), db_entry['params_dict'].copy()
+
+    def load_many(self, keys):
+        """
+        Loads the samples with the given hashes concurrently (see iter_parallel).
+
+        :param keys: Iterable of params_dict hashes.
+        :return: List of samples, in the same order as keys.
+        """
+        handles = []
+        for params_hashed in keys:
+            if not self._has_entry(params_hashed):
+                raise LookupError("Couldn't find a sample with hash", params_hashed)
+            handles.append((SampleHandle(self, params_hashed, self._get_entry(params_hashed)), None))
+        return [handle.sample for handle, params_dict in self.iter_parallel(handles)]
+
+    def iter_parallel(self, samples=None, skip_loading=None):
+        """
+        Iterator that loads samples concurrently, but yields them in the original order.
+        The samples of up to 4 * loader_workers items ahead of the current item are loaded in the background.
+        Samples that are in the sample cache or were already loaded aren't loaded again.
+
+        :param samples: Iterable of (SampleHandle, params_dict) tuples, like returned by __iter__ and select.
+                        If None, all samples of the database are used.
+        :param skip_loading: Optional function that gets a SampleHandle and returns True if its sample isn't needed.
+                             Those handles are yielded without loading their sample. (e.g. if their score is cached, see store_scores)
+                             Items that aren't SampleHandles (e.g. samples that were already loaded) are yielded unchanged.
+        :return: The same tuples as samples, but each SampleHandle has its sample loaded.
+        """
+        if samples is None:
+            samples = iter(self)
+        if self.loader_pool == 'process':
+            executor = concurrent.futures.ProcessPoolExecutor(self.loader_workers)
+        else:
+            executor = concurrent.futures.ThreadPoolExecutor(self.loader_workers)
+        with executor:
+            window = collections.deque() # (handle, params_dict, future) tuples, in order
+            for handle, params_dict in samples:
+                future = None
+                if not isinstance(handle, SampleHandle) or (skip_loading is not None and skip_loading(handle)):
+                    future = False
+                elif not handle.loaded and not handle.params_hashed in self._cache:
+                    future = self._submit_load(executor, handle._db_entry)
+                window.append((handle, params_dict, future))
+                if len(window) >= 4 * self.loader_workers:
+                    yield SampleDatabase._finish_load(*window.popleft())
+            while len(window) > 0:
+                yield SampleDatabase._finish_load(*window.popleft())
+
+    def _submit_load(self, executor, db_entry):
+        """
+        Submits loading the sample of the given db entry to the executor and returns the future.
+        """
+        if isinstance(executor, concurrent.futures.ProcessPoolExecutor):
+            # Process pools can't call methods of this object, only module-level functions
+            pickle_paths = self._pickle_paths(db_entry['pickle_name'])
+            return executor.submit(unpickle_sample_file, pickle_paths[0], self.sample_type, pickle_paths[1:] + pickle_paths[:1])
+        return executor.submit(self._load_sample, db_entry)
+
+    @classmethod
+    def _finish_load(cls, handle, params_dict, future):
+        """
+        Waits for the future of a sample loaded by iter_parallel and stores the sample in its handle.
+        The future is False for handles whose sample shouldn't be loaded.
+        """
+        if future is False:
+            pass
+        elif future is not None:
+            handle._sample = future.result()
+        else:
+            handle.sample # Makes sure the sample is loaded, e.g. from the cache
+        return handle, params_dict
+
+    def store_scores(self, fingerprint, scores):
+        """
+        Stores the scores a performance measure calculated for samples in their db entries, so they don't have to be calculated again.
+        The scores are stored per fingerprint of the measure's configuration (see PerformanceMeasure.fingerprint),
+        so changing the configuration automatically means the scores are calculated again.
+        Replacing a sample discards its scores, since the new db entry doesn't contain them.
+
+        :param fingerprint: The fingerprint of the performance measure.
+        :param scores: A dict that maps the hashes of samples to their scores.
+        """
+        scores = {params_hashed: (self._get_entry(params_hashed)['pickle_name'], score)
+                  for params_hashed, score in scores.items() if self._has_entry(params_hashed)}
+        self._save(('scores', fingerprint, scores))
+
+    def iter_params(self):
+        """
+        Iterator for getting the parameters of all samples contained in the database, without touching the samples at all.
+        The yielded params_dicts are the ones stored in the database, so they must not be modified.
+
+        :return: Tuple (h, p), with the hash h of the params_dict p.
+        """
+        for params_hashed, db_entry in self._entries():
+            yield params_hashed, db_entry['params_dict']
 
-        :return: Tuple (s, p), with the Sample object s and the corresponding params_dict p.
+    def select(self, fixed_params, free_params_bounds):
         """
-        for sample in self._db_dict.values():
-            yield self._unpickle_sample(sample['pickle_name']), sample['params_dict'].copy()
+        Iterator over all samples whose parameters satisfy the following conditions:
+            * Parameters in fixed_params have the value given there. (they're allowed to be missing in the sample's params_dict)
+            * Parameters in free_params_bounds exist and lie within the given (min, max) bounds. Bounds may be None, for no restriction.
+            * The sample has no other parameters.
+        Only the params_dicts in the db entries are checked. Matching samples are yielded as SampleHandles, like in __iter__.
+
+        :param fixed_params: Dict that maps parameter names to their required value.
+        :param free_params_bounds: Dict that maps parameter names to a (min, max) tuple or None.
+        :return: Tuples (s, p), like __iter__.
+        """
+        for params_hashed, db_entry in self._entries():
+            if SampleDatabase._satisfies(db_entry['params_dict'], fixed_params, free_params_bounds):
+                yield SampleHandle(self, params_hashed, db_entry), db_entry['params_dict'].copy()
+
+    def nearest(self, params_dict, scales, tolerance):
+        """
+        Finds the stored sample that is nearest to params_dict, e.g. to reuse a sample whose parameters were rounded differently.
+        Only the parameters in scales may differ, all others have to be identical. The distance is the euclidean distance
+        of the scaled parameter values. The search uses a KD-tree per combination of the other parameters (see NeighbourIndex),
+        which is built with the first query for the given scales and kept up to date afterwards.
+
+        :param params_dict: The parameters dictionary of the requested sample.
+        :param scales: Dict that maps the names of the parameters that may differ to the factors their values are scaled with,
+                       e.g. 1 / (max - min) of their bounds.
+        :param tolerance: Maximum distance of the found sample.
+        :return: Tuple (s, p) like select, or None if there's no sample within tolerance.
+        """
+        self.refresh()
+        group_and_point = SampleDatabase._neighbour_point(params_dict, scales)
+        if group_and_point is None:
+            return None
+        neighbour = self._neighbour_index(scales).nearest(group_and_point[0], group_and_point[1], tolerance)
+        if neighbour is None:
+            return None
+        db_entry = self._get_entry(neighbour[0])
+        return SampleHandle(self, neighbour[0], db_entry), db_entry['params_dict'].copy()
+
+    def _neighbour_index(self, scales):
+        """
+        Returns the NeighbourIndex of all db entries for the given scales, building it if necessary.
+        """
+        scales_key = tuple(sorted(scales.items()))
+        if not scales_key in self._neighbour_indices:
+            neighbour_index = NeighbourIndex()
+            for params_hashed, db_entry in self._entries():
+                group_and_point = SampleDatabase._neighbour_point(db_entry['params_dict'], scales)
+                if group_and_point is not None:
+                    neighbour_index.add(group_and_point[0], params_hashed, group_and_point[1])
+            self._neighbour_indices[scales_key] = neighbour_index
+        return self._neighbour_indices[scales_key]
+
+    def _update_neighbour_indices(self, record):
+        """
+        Applies an 'add' or 'remove' record to the neighbour indices that were built already.
+        """
+        for scales_key, neighbour_index in self._neighbour_indices.items():
+            neighbour_index.remove(record[1])
+            if record[0] == 'add':
+                group_and_point = SampleDatabase._neighbour_point(record[2]['params_dict'], dict(scales_key))
+                if group_and_point is not None:
+                    neighbour_index.add(group_and_point[0], record[1], group_and_point[1])
+
+    @classmethod
+    def _neighbour_point(cls, params_dict, scales):
+        """
+        Returns a tuple (group, point) for indexing params_dict in a NeighbourIndex. The group is the hash of all parameters
+        that aren't in scales, the point contains the scaled values of the others. Returns None if one of those is missing
+        or isn't a number.
+        """
+        point = []
+        for param_name, scale in sorted(scales.items()):
+            value = params_dict.get(param_name)
+            if not isinstance(value, numbers.Real) or isinstance(value, bool):
+                return None
+            point.append(value * scale)
+        group = SampleDatabase.dict_hash({p_name: p_value for p_name, p_value in params_dict.items() if not p_name in scales})
+        return group, point
+
+    def summary(self, params_dict):
+        """
+        Returns the MapMatcherSampleSummary of the sample with the given rosparams, without loading the sample from disk.
+        Returns None for samples of other types.
+
+        :param params_dict: The parameters dictionary that defines the requested sample.
+        """
+        params_hashed = SampleDatabase.dict_hash(params_dict)
+        if not self._has_entry(params_hashed):
+            raise LookupError("Couldn't find a sample with hash", params_hashed)
+        return self._entry_summary(params_hashed, self._get_entry(params_hashed))
+
+    def summaries(self):
+        """
+        Iterator for getting the summaries of all samples in the database, without loading the samples from disk.
+
+        :return: Tuple (s, p), with the MapMatcherSampleSummary s and the corresponding params_dict p.
+        """
+        for params_hashed, db_entry in self._entries():
+            yield self._entry_summary(params_hashed, db_entry), db_entry['params_dict'].copy()
+
+    def _entry_summary(self, params_hashed, db_entry):
+        """
+        Returns the MapMatcherSampleSummary stored in the given db entry.
+        Db entries from older versions don't contain summaries, in that case it's calculated once and stored in the db entry.
+        """
+        if not 'summary' in db_entry:
+            print("\tCalculating missing summary of sample", db_entry['pickle_name'])
+            db_entry = dict(db_entry, summary=SampleDatabase._summarize(self._load_sample(db_entry)))
+            self._save(('add', params_hashed, db_entry))
+        if db_entry['summary'] is None:
+            return None
+        return MapMatcherSampleSummary(db_entry['summary'])
+
+    @classmethod
+    def _summarize(cls, sample):
+        """
+        Returns the dict representation of the sample's summary, or None if the sample isn't a MapMatcherSample.
+        """
+        if not isinstance(sample, MapMatcherSample):
+            return None
+        return MapMatcherSampleSummary.from_sample(sample).to_dict()
+
+    @classmethod
+    def _satisfies(cls, params_dict, fixed_params, free_params_bounds):
+        """
+        Returns whether the given params_dict satisfies the conditions described in select.
+        """
+        for p_name, p_value in params_dict.items():
+            if p_name in fixed_params:
+                if not p_value == fixed_params[p_name]:
+                    return False
+            elif p_name in free_params_bounds:
+                bounds = free_params_bounds[p_name]
+                if bounds is not None and (p_value < bounds[0] or p_value > bounds[1]):
+                    return False
+            else:
+                return False
+        # Check that all free params were there
+        return all(p_name in params_dict for p_name in free_params_bounds)
 
     def _to_pickle_path(self, pickle_name):
         """
         Returns the pickle_path for a sample's pickled representation, identified by its pickle_name.
+        That's the location in its shard, if sharding is enabled. (see shard_levels)
         """
         if pickle_name is None:
             raise ValueError("pickle_name should never be None!")
-        pickle_path = os.path.abspath(os.path.join(self.sample_dir_path, pickle_name + ".pkl"))
+        name_hash = hashlib.sha1(pickle_name.encode('utf-8')).hexdigest()
+        shard_dirs = [name_hash[level * self.shard_width:(level + 1) * self.shard_width] for level in range(self.shard_levels)]
+        pickle_path = os.path.abspath(os.path.join(self.sample_dir_path, *shard_dirs, pickle_name + ".pkl"))
         return pickle_path
 
+    def _pickle_paths(self, pickle_name):
+        """
+        Returns the list of locations at which a sample's pickled representation may be, the preferred one (see _to_pickle_path) first.
+        If sharding is enabled, the sample may also still be in the flat sample_dir.
+        """
+        pickle_paths = [self._to_pickle_path(pickle_name)]
+        if self.shard_levels > 0:
+            pickle_paths.append(os.path.abspath(os.path.join(self.sample_dir_path, pickle_name + ".pkl")))
+        return pickle_paths
+
+    def _find_pickle_path(self, pickle_name):
+        """
+        Returns the path of the existing pickled representation of a sample, or None if there is none.
+        """
+        for pickle_path in self._pickle_paths(pickle_name):
+            if os.path.isfile(pickle_path):
+                return pickle_path
+        return None
+
+    def migrate_sample_files(self):
+        """
+        Moves the pickled representations of all samples from the flat sample_dir to their shards. (see shard_levels)
+        This can be done while other processes use the database: Each file is moved atomically and readers check both locations.
+        Files that were moved already are skipped, so an interrupted migration can simply be started again.
+
+        :return: The number of moved files.
+        """
+        if self.shard_levels == 0:
+            print("\tSharding is disabled (shard_levels is 0), nothing to migrate.")
+            return 0
+        nr_moved = 0
+        for params_hashed, db_entry in self._entries():
+            pickle_path, flat_pickle_path = self._pickle_paths(db_entry['pickle_name'])
+            if not os.path.isfile(flat_pickle_path):
+                continue # Already migrated (or not stored as a file at all)
+            os.makedirs(os.path.dirname(pickle_path), exist_ok=True)
+            os.replace(flat_pickle_path, pickle_path)
+            nr_moved += 1
+            if nr_moved % 1000 == 0:
+                print("\tMoved", nr_moved, "sample files so far...")
+        print("\tMoved", nr_moved, "sample files to their shards.")
+        return nr_moved
+
+    def add_parameter(self, param_name, value):
+        """
+        Adds a new parameter to the params_dicts of all samples that don't have it yet, e.g. after a new rosparam was
+        introduced to the map matcher. value should be the one that induces the same behaviour as before the parameter existed.
+        Only the index is changed: Each patched db entry is stored at the hash of its new params_dict, the sample data
+        stays untouched. All changes are saved with a single change record, so either all samples are patched or none.
+        Samples that already have the parameter are skipped, so an interrupted migration can simply be started again.
+        If a patched params_dict collides with an existing sample, the existing sample is kept and the old one is left as it is.
+
+        :param param_name: The name of the new parameter.
+        :param value: The parameter's value, used for all samples that don't have it.
+        :return: The number of patched samples.
+        """
+        with self._lock.exclusive():
+            self.refresh()
+            records = []
+            new_hashes = set()
+            for params_hashed, db_entry in self._entries():
+                if param_name in db_entry['params_dict']:
+                    continue # Patched already
+                params_dict = dict(db_entry['params_dict'], **{param_name: value})
+                new_params_hashed = SampleDatabase.dict_hash(params_dict)
+                if new_params_hashed in new_hashes or self._has_entry(new_params_hashed):
+                    print("\tWarning: Sample", db_entry['pickle_name'], "would replace an existing sample with hash", new_params_hashed,
+                          "- not patching it.")
+                    continue
+                new_hashes.add(new_params_hashed)
+                records.append(('remove', params_hashed))
+                records.append(('add', new_params_hashed, dict(db_entry, params_dict=params_dict)))
+            print("\tAdding parameter", param_name, "=", value, "to", len(records) // 2, "samples.")
+            if len(records) > 0:
+                self._save(('batch', records))
+        return len(records) // 2
+
+    def check(self, repair=False, orphan_age=3600):
+        """
+        Checks the consistency of the database index and the sample_dir, optionally repairs it and compacts the storage.
+        The following problems are detected:
+            * missing: Db entries whose sample data doesn't exist (anymore).
+            * orphans: Sample files in the sample_dir that no db entry refers to, e.g. from crashed runs.
+                       Only files that weren't modified for orphan_age seconds count, since others may be added right now.
+            * duplicates: Db entries that refer to the same sample file as a later db entry. The file belongs to the later one.
+            * wrong_keys: Db entries that aren't stored at the hash of their params_dict.
+            * misplaced: Sample files that are still in the flat sample_dir, although sharding is enabled.
+        The existence of sample files is checked by loader_workers threads, the index and sample_dir are each scanned once.
+        Memory usage only grows with the number of samples, not with their size.
+
+        If repair is True, missing and duplicate entries are removed from the index (with a single change record),
+        wrong keys are corrected, orphans are deleted, misplaced files are moved to their shards and the storage is compacted.
+
+        :param repair: Whether to repair the found problems. Otherwise, they're only reported.
+        :param orphan_age: Minimum age (in seconds) of unreferenced files to be considered orphans.
+        :return: A dict that maps each kind of problem to the list of affected hashes or file paths.
+        """
+        report = {'missing': [], 'orphans': [], 'duplicates': [], 'wrong_keys': [], 'misplaced': []}
+        print("\tChecking", len(self), "db entries...")
+        referenced_files = {} # Maps the file names of all existing samples to the hash of the (latest) db entry that refers to them
+        with concurrent.futures.ThreadPoolExecutor(self.loader_workers) as executor:
+            entries = self._entries()
+            while True:
+                chunk = list(itertools.islice(entries, 1000 * self.loader_workers))
+                if len(chunk) == 0:
+                    break
+                for (params_hashed, db_entry), exists in zip(chunk, executor.map(lambda entry: self._payload_exists(entry[1]), chunk)):
+                    if not exists:
+                        report['missing'].append(params_hashed)
+                        continue
+                    if params_hashed != SampleDatabase.dict_hash(db_entry['params_dict']):
+                        report['wrong_keys'].append(params_hashed)
+                    if db_entry['pickle_name'] in referenced_files:
+                        report['duplicates'].append(referenced_files[db_entry['pickle_name']])
+                    referenced_files[db_entry['pickle_name']] = params_hashed
+        print("\tScanning sample files in", self.sample_dir_path, "...")
+        flat_dir = os.path.abspath(self.sample_dir_path)
+        for pickle_path in self._payload_files():
+            pickle_name = os.path.splitext(os.path.basename(pickle_path))[0]
+            if not pickle_name in referenced_files:
+                if os.path.getmtime(pickle_path) < time.time() - orphan_age:
+                    report['orphans'].append(pickle_path)
+            elif self.shard_levels > 0 and os.path.dirname(pickle_path) == flat_dir:
+                report['misplaced'].append(pickle_path)
+        for problem, affected in report.items():
+            print("\tFound", len(affected), problem, "" if len(affected) == 0 else affected[:10] + (["..."] if len(affected) > 10 else []))
+        if repair:
+            self._repair(report)
+        return report
+
+    def _repair(self, report):
+        """
+        Repairs the problems found by check, see there.
+        """
+        print("\tRepairing the database...")
+        removed = set(report['missing'] + report['duplicates'])
+        records = [('remove', params_hashed) for params_hashed in removed]
+        for params_hashed in report['wrong_keys']:
+            if params_hashed in removed:
+                continue
+            db_entry = self._get_entry(params_hashed)
+            records.append(('remove', params_hashed))
+            correct_hash = SampleDatabase.dict_hash(db_entry['params_dict'])
+            if correct_hash in removed or not self._has_entry(correct_hash):
+                records.append(('add', correct_hash, db_entry))
+        if len(records) > 0:
+            self._save(('batch', records))
+        for pickle_path in report['orphans']:
+            print("\tRemoving orphaned sample file", pickle_path)
+            os.remove(pickle_path)
+        if len(report['misplaced']) > 0:
+            self.migrate_sample_files()
+        self._compact_payloads()
+        self.compact()
+
+    def export_bundle(self, path, keys=None, samples_per_file=10000):
+        """
+        Exports samples into bundle files, which can be imported into another database with import_bundle.
+        Instead of one file per sample, a bundle is a single npz archive: The number arrays of all its samples
+        (e.g. their errors) are concatenated into one array per attribute, the db entries and all other attributes
+        are stored in a pickled index. Thus, copying a bundle is sequential I/O, no matter how many samples it contains.
+        To limit the memory usage, at most samples_per_file samples are put into one bundle file.
+
+        :param path: Path of the bundle. The files are named <path without .npz>-<number>.npz.
+        :param keys: Hashes of the samples to export. All samples are exported, if None.
+        :param samples_per_file: Maximum number of samples per bundle file.
+        :return: List of the written bundle files.
+        """
+        if keys is None:
+            handles = ((handle, params_dict) for handle, params_dict in self)
+        else:
+            handles = ((SampleHandle(self, params_hashed, self._get_entry(params_hashed)), None) for params_hashed in keys)
+        path_prefix = path[:-len(".npz")] if path.endswith(".npz") else path
+        bundle_paths = []
+        loaded_handles = self.iter_parallel(handles)
+        while True:
+            chunk = list(itertools.islice(loaded_handles, samples_per_file))
+            if len(chunk) == 0:
+                break
+            bundle_paths.append(path_prefix + "-" + str(len(bundle_paths)).zfill(4) + ".npz")
+            print("\tExporting", len(chunk), "samples to bundle", bundle_paths[-1])
+            SampleDatabase._write_bundle(bundle_paths[-1], [handle for handle, params_dict in chunk])
+            del chunk
+        return bundle_paths
+
+    @classmethod
+    def _write_bundle(cls, bundle_path, handles):
+        """
+        Writes a single bundle file with the samples behind the given (loaded) SampleHandles, see export_bundle.
+        """
+        index = []
+        arrays = collections.defaultdict(list) # Maps attribute names to the list of arrays of all samples
+        for handle in handles:
+            split = PackedPayload.split_attributes(handle.sample)
+            index.append({'params_dict': handle.params_dict, 'attributes': split['attributes'],
+                          'array_lengths': {name: len(array) for name, array in split['arrays'].items()}})
+            for name, array in split['arrays'].items():
+                arrays[name].append(array)
+        bundle = {"array:" + name: np.concatenate(name_arrays) for name, name_arrays in arrays.items()}
+        bundle['index'] = np.frombuffer(pickle.dumps(index, protocol=pickle.HIGHEST_PROTOCOL), dtype=np.uint8)
+        with open(bundle_path, 'wb') as bundle_handle:
+            np.savez(bundle_handle, **bundle)
+
+    def import_bundle(self, bundle_path, skip_existing=True):
+        """
+        Imports the samples of a bundle file (see export_bundle) into the database.
+        The samples are added with add_samples, i.e. their payloads are written concurrently and the index is updated once.
+        Samples are identified by the hash of their params_dict, which is calculated again, not taken from the bundle.
+
+        :param bundle_path: Path to the bundle file.
+        :param skip_existing: If True, samples that are in the database already are skipped.
+                              Otherwise, a LookupError is raised and nothing is imported.
+        :return: List of the hashes of the imported samples.
+        """
+        print("\tImporting samples from bundle", bundle_path)
+        with np.load(bundle_path) as bundle:
+            index = pickle.loads(bundle['index'].tobytes())
+            arrays = {name[len("array:"):]: bundle[name] for name in bundle.files if name.startswith("array:")}
+        self.refresh()
+        samples = []
+        offsets = collections.defaultdict(int)
+        for bundle_entry in index:
+            sample = self.sample_type()
+            for name, value in bundle_entry['attributes'].items():
+                setattr(sample, name, value)
+            for name, length in bundle_entry['array_lengths'].items():
+                setattr(sample, name, arrays[name][offsets[name]:offsets[name] + length])
+                offsets[name] += length
+            if skip_existing and self._has_entry(SampleDatabase.dict_hash(bundle_entry['params_dict'])):
+                continue
+            samples.append((sample, bundle_entry['params_dict']))
+        print("\tSkipping", len(index) - len(samples), "samples that already exist.")
+        return self.add_samples(samples)
+
+    def _payload_exists(self, db_entry):
+        """
+        Returns whether the sample data of the given db entry exists. (see check)
+        """
+        return self._find_pickle_path(db_entry['pickle_name']) is not None
+
+    def _payload_files(self):
+        """
+        Iterator over the paths of all sample files in the sample_dir and its shards. (see check)
+        """
+        for directory, subdirectories, file_names in os.walk(os.path.abspath(self.sample_dir_path)):
+            for file_name in file_names:
+                if file_name.endswith(".pkl"):
+                    yield os.path.join(directory, file_name)
+
+    def _compact_payloads(self):
+        """
+        Reclaims the space of removed samples, for storage types that don't do that immediately. (see check)
+        Sample files are removed together with their db entry, so there's nothing to do here.
+        """
+        pass
+
     def _pickle_sample(self, sample, pickle_name, override_existing=False):
         """
         Helper method for saving samples to disk.
@@ -175,8 +1073,13 @@ class SampleDatabase(SampleSource):
         """
         pickle_path = self._to_pickle_path(pickle_name)
         # Safety check, don't just overwrite other pickles!
-        if not override_existing and os.path.exists(pickle_path):
-            raise ValueError("A pickle file already exists at the calculated location:", pickle_path)
+        if not override_existing and self._find_pickle_path(pickle_name) is not None:
+            raise ValueError("A pickle file already exists at the calculated location:", self._find_pickle_path(pickle_name))
+        os.makedirs(os.path.dirname(pickle_path), exist_ok=True)
+        if self.payload_format == 'packed':
+            print("\tPacking Sample object for later usage to:", pickle_path)
+            PackedPayload.dump(sample, pickle_path, self.payload_compression, self.payload_float32)
+            return
         print("\tPickling Sample object for later usage to:", pickle_path)
         with open(pickle_path, 'wb') as sample_pickle_handle:
             pickle.dump(sample, sample_pickle_handle)
@@ -187,13 +1090,42 @@ class SampleDatabase(SampleSource):
 
         :param pickle_name: Path to the Sample's pickled representation.
         """
-        pickle_path = self._to_pickle_path(pickle_name)
-        with open(pickle_path, 'rb') as sample_pickle_handle:
-            sample = pickle.load(sample_pickle_handle)
-            if not isinstance(sample, self.sample_type):
-                raise TypeError("The object unpickled from", pickle_path, "has the wrong type!",
-                                "Is:", type(sample), "should be:", self.sample_type)
-            return sample
+        pickle_paths = self._pickle_paths(pickle_name)
+        return unpickle_sample_file(pickle_paths[0], self.sample_type, pickle_paths[1:] + pickle_paths[:1])
+
+    def _store_sample(self, sample, override_existing=False):
+        """
+        Saves a sample's data to disk.
+        Returns a dict with additional fields for the sample's db entry, which are needed to load the sample again.
+        This is the place to hook into for subclasses that store samples differently. (see _load_sample and _delete_sample)
+
+        :param sample: The Sample which should be stored, its name has to be set already.
+        :param override_existing: Whether an existing sample with the same name may be overwritten.
+        """
+        self._pickle_sample(sample, sample.name, override_existing)
+        return {}
+
+    def _load_sample(self, db_entry):
+        """
+        Loads a sample from disk.
+
+        :param db_entry: The sample's db entry.
+        """
+        return self._unpickle_sample(db_entry['pickle_name'])
+
+    def _delete_sample(self, db_entry):
+        """
+        Removes a sample's data from disk.
+
+        :param db_entry: The sample's db entry.
+        """
+        pickle_path = self._find_pickle_path(db_entry['pickle_name'])
+        if pickle_path is None:
+            print("\tWarning: Couldn't find Sample's pickled representation at '" +\
+                  self._to_pickle_path(db_entry['pickle_name']) + "'.")
+        else:
+            print("\tRemoving Sample's pickle '" + pickle_path + "' from disk.")
+            os.remove(pickle_path)
 
     def add_sample(self, sample, params_dict, override_existing=False):
         """
@@ -203,19 +1135,70 @@ class SampleDatabase(SampleSource):
         :param params_dict: The dictionary of parameters that were used to generate the sample.
         :param override_existing: Whether an exception should be thrown if a sample with that name or hash already exists.
         """
+        params_hashed, db_entry = self._new_entry(sample, params_dict, override_existing)
+        db_entry.update(self._store_sample(sample, override_existing))
+        # Add new Sample to db and save the db
+        print("\tRegistering sample to database at hash(params):", params_hashed)
+        self._cache.discard(params_hashed)
+        try:
+            self._save(('add', params_hashed, db_entry), override_existing)
+        except LookupError: # Another process added a sample with the same hash meanwhile
+            self._discard_payloads([('add', params_hashed, db_entry)])
+            raise
+
+    def add_samples(self, samples, override_existing=False):
+        """
+        Adds many new Samples to the database at once. Meant for importing lots of existing samples.
+        The samples' payloads are written concurrently by loader_workers threads (unless concurrent_payload_writes is False),
+        while samples are still being consumed from the given iterable. Then, all db entries are registered with a single
+        change record, so either all of the samples or none of them end up in the database.
+        If adding a sample fails, payloads of the other samples may be left in the sample_dir without a db entry.
+
+        :param samples: Iterable of (sample, params_dict) tuples. No two of them may have the same hash or name.
+        :param override_existing: Whether an exception should be thrown if a sample with that name or hash already exists.
+        :return: List of the hashes of the added samples.
+        """
+        records = []
+        pending = [] # (params_hashed, db_entry, future) tuples
+        params_hashes = set()
+        pickle_names = set()
+        with concurrent.futures.ThreadPoolExecutor(self.loader_workers if self.concurrent_payload_writes else 1) as executor:
+            for sample, params_dict in samples:
+                params_hashed, db_entry = self._new_entry(sample, params_dict, override_existing)
+                # Even if existing samples may be overridden, two samples of the batch would be written concurrently to the same file
+                if params_hashed in params_hashes or db_entry['pickle_name'] in pickle_names:
+                    raise LookupError("Batch contains more than one sample with hash", str(params_hashed), "or name", db_entry['pickle_name'])
+                params_hashes.add(params_hashed)
+                pickle_names.add(db_entry['pickle_name'])
+                pending.append((params_hashed, db_entry, executor.submit(self._store_sample, sample, override_existing)))
+            for params_hashed, db_entry, future in pending:
+                db_entry.update(future.result())
+                records.append(('add', params_hashed, db_entry))
+        print("\tRegistering", len(records), "samples to database.")
+        for record in records:
+            self._cache.discard(record[1])
+        try:
+            self._save(('batch', records), override_existing)
+        except LookupError: # Another process added a sample with one of the hashes meanwhile
+            self._discard_payloads(records)
+            raise
+        return [record[1] for record in records]
+
+    def _new_entry(self, sample, params_dict, override_existing):
+        """
+        Prepares adding a sample: Checks whether its hash already exists and creates its db entry (without payload fields).
+
+        :return: Tuple (params_hashed, db_entry).
+        """
         if sample.name is None:
             sample.name = str(SampleDatabase.dict_hash(params_dict))
             print("\tWarning:", "sample's name is None. Setting it to the hash of its parameters:", sample.name)
-        self._pickle_sample(sample, sample.name, override_existing)
         params_hashed = SampleDatabase.dict_hash(params_dict)
-        # Safety check, don't just overwrite a db entry
-        if not override_existing and params_hashed in self._db_dict.keys():
+        # Safety check, don't just overwrite a db entry. Fails early, but _save checks again (other processes may add it meanwhile)
+        if not override_existing and self._has_entry(params_hashed):
             raise LookupError("Newly created sample's hash already exists in the database! Hash:", str(params_hashed),\
-                              "Existing sample's pickle name is:", self._db_dict[params_hashed]['pickle_name'])
-        # Add new Sample to db and save the db
-        print("\tRegistering sample to database at hash(params):", params_hashed)
-        self._db_dict[params_hashed] = {'pickle_name': sample.name, 'params_dict': params_dict}
-        self._save()
+                              "Existing sample's pickle name is:", self._get_entry(params_hashed)['pickle_name'])
+        return params_hashed, {'pickle_name': sample.name, 'params_dict': params_dict, 'summary': SampleDatabase._summarize(sample)}
 
     def remove_sample(self, params_hashed):
         """
@@ -224,35 +1207,455 @@ class SampleDatabase(SampleSource):
         :param params_hashed: The sample's parameter's hash.
         """
 
-        if not params_hashed in self._db_dict:
+        if not self._has_entry(params_hashed):
             raise LookupError("Couldn't find a sample with hash", params_hashed)
-        # Get sample from pickled representation
-        pickle_path = self._to_pickle_path(self._db_dict[params_hashed]['pickle_name'])
-        if not os.path.isfile(pickle_path):
-            print("\tWarning: Couldn't find Sample's pickled representation at '" +\
-                  pickle_path + "'.")
-        else:
-            print("\tRemoving Sample's pickle '" + pickle_path + "' from disk.")
-            os.remove(pickle_path)
+        self._delete_sample(self._get_entry(params_hashed))
+        self._cache.discard(params_hashed)
         print("\tRemoving Sample's db entry '" + str(params_hashed) + "'.")
-        del self._db_dict[params_hashed]
-            
         # Only save the db at the end, after we know everything worked
-        self._save()
+        self._save(('remove', params_hashed))
 
     @classmethod
     def dict_hash(cls, params_dict):
         """
         Calculates and returns a hash from the given params_dict.
+        The hash is the sha1 hex digest of a canonical json encoding of the params_dict (see _canonical_value).
+        It only depends on the parameter values, not on the process that calculates it (unlike python's built-in hash function).
+        """
+        encoded_params = json.dumps(SampleDatabase._canonical_value(params_dict), sort_keys=True, separators=(',', ':'))
+        return hashlib.sha1(encoded_params.encode('utf-8')).hexdigest()
+
+    @classmethod
+    def _canonical_value(cls, value):
+        """
+        Normalizes a parameter value, so that values which compare equal in python get the same json encoding.
+        E.g. numpy scalars are turned into python scalars, tuples into lists and integral floats into ints (since 1.0 == 1).
+        Other floats are encoded by json with repr, which is the shortest string that exactly reproduces the float.
+        """
+        if isinstance(value, dict):
+            return {str(k): SampleDatabase._canonical_value(v) for k, v in value.items()}
+        if isinstance(value, (list, tuple)):
+            return [SampleDatabase._canonical_value(v) for v in value]
+        if isinstance(value, np.generic):
+            value = value.item()
+        if isinstance(value, bool) or value is None or isinstance(value, str):
+            return value
+        if isinstance(value, numbers.Integral):
+            return int(value)
+        if isinstance(value, numbers.Real):
+            value = float(value)
+            if value.is_integer():
+                return int(value)
+            return value
+        raise TypeError("Can't calculate a hash for parameter values of type", type(value))
+
+
+class SampleHandle(object):
+    """
+    Lightweight stand-in for a sample in a SampleDatabase, as yielded by SampleDatabase.__iter__ and select.
+    The handle only knows the sample's db entry. The sample itself is loaded from disk the first time one of
+    its attributes is accessed through the handle; from then on, the handle forwards all attribute accesses to it.
+    Thus, handles can be used like samples, but skipping a handle costs no disk I/O.
+    The number of matches is answered from the sample's summary, if the db entry contains one.
+    """
+
+    def __init__(self, database, params_hashed, db_entry):
+        """
+        :param database: The SampleDatabase that contains the sample.
+        :param params_hashed: The hash of the sample's params_dict.
+        :param db_entry: The sample's db entry.
+        """
+        self._database = database
+        self._db_entry = db_entry
+        self._sample = None
+        self.params_hashed = params_hashed
+
+    def __getattr__(self, name):
+        """
+        Forwards accesses to all attributes the handle doesn't have itself to the (loaded) sample.
+        """
+        if name.startswith('_'): # Don't load the sample for private or special attributes (e.g. during copying or pickling)
+            raise AttributeError(name)
+        return getattr(self.sample, name)
+
+    @property
+    def sample(self):
+        """
+        The sample itself, loaded from disk on first access.
+        """
+        if self._sample is None:
+            if self.params_hashed in self._database._cache:
+                self._sample = self._database._cache.get(self.params_hashed)
+            else:
+                self._sample = self._database._load_sample(self._db_entry)
+        return self._sample
+
+    @property
+    def loaded(self):
+        """
+        Whether the sample was loaded from disk already.
+        """
+        return self._sample is not None
+
+    @property
+    def params_dict(self):
+        """
+        The sample's params_dict as stored in the database. Must not be modified.
+        """
+        return self._db_entry['params_dict']
+
+    @property
+    def summary(self):
+        """
+        The sample's MapMatcherSampleSummary, or None if the db entry doesn't contain one.
+        """
+        if self._db_entry.get('summary') is None:
+            return None
+        return MapMatcherSampleSummary(self._db_entry['summary'])
+
+    @property
+    def scores(self):
+        """
+        The sample's cached scores, a dict that maps performance measure fingerprints to scores. (see SampleDatabase.store_scores)
+        """
+        return self._db_entry.get('scores', {})
+
+    @property
+    def censored(self):
+        """
+        The reason why the sample's run was aborted or None (see MapMatcherSample), taken from its summary if possible.
+        """
+        if self._db_entry.get('summary') is not None and 'censored' in self._db_entry['summary']:
+            return self._db_entry['summary']['censored']
+        return getattr(self.sample, 'censored', None)
+
+    @property
+    def nr_matches(self):
+        """
+        The sample's number of matches, taken from its summary if possible.
+        """
+        if self._db_entry.get('summary') is not None:
+            return self._db_entry['summary']['nr_matches']
+        return self.sample.nr_matches
+
+class ArenaSampleDatabase(SampleDatabase):
+    """
+    SampleDatabase variant that doesn't pickle each sample to its own file.
+    Instead, the error arrays of all samples are stored in a ColumnArena (see storage.py) in the sample_dir:
+    One memory-mapped file for all translation errors and one for all rotation errors.
+    The remaining (small) attributes of a sample, e.g. its name and duration, are kept in its db entry, together with:
+        * arena_offsets: The offsets of the sample's errors in the arena's columns.
+        * arena_length: The sample's number of errors per column.
+    Loaded samples contain read-only numpy views into the arena instead of lists of floats.
+    Iterating over the database reads the arena sequentially.
+
+    Only supports MapMatcherSamples. Removed samples leave unused space in the arena.
+    """
+
+    ERROR_COLUMNS = ['translation_errors', 'rotation_errors']
+
+    # Appending to the arena isn't thread-safe, but it's a sequential write anyway
+    concurrent_payload_writes = False
+
+    def __init__(self, database_path, sample_dir_path, sample_generator, **kwargs):
+        """
+        Initializes the ArenaSampleDatabase object, see SampleDatabase.__init__ for a description of the parameters.
+        Since reading from the arena doesn't involve unpickling, the loader_pool is always 'thread'.
+        """
+        self._arena = ColumnArena(sample_dir_path, ArenaSampleDatabase.ERROR_COLUMNS)
+        super().__init__(database_path, sample_dir_path, sample_generator, **kwargs)
+        self.loader_pool = 'thread'
+
+    def __iter__(self):
+        """
+        Iterator for getting all samples contained in the database, in the order they are stored in the arena.
+
+        :return: Tuple (s, p), with the SampleHandle s and the corresponding params_dict p.
         """
-        # Create a copy of the params dict and convert all lists to tuples. 
-        # This is done, because lists aren't hashable.
-        params_dict = params_dict.copy()
-        for key, value in params_dict.items():
-            if isinstance(value, list):
-                params_dict[key] = tuple(value)
-        return hash(frozenset(params_dict.items()))
+        entries = sorted(self._entries(), key=lambda entry: entry[1]['arena_offsets']['translation_errors'])
+        for params_hashed, db_entry in entries:
+            yield SampleHandle(self, params_hashed, db_entry), db_entry['params_dict'].copy()
 
+    def _store_sample(self, sample, override_existing=False):
+        """
+        Appends the sample's errors to the arena and returns the db entry fields which describe where to find them.
+        """
+        if not isinstance(sample, MapMatcherSample):
+            raise TypeError("ArenaSampleDatabase can only store MapMatcherSamples, got", type(sample))
+        print("\tAppending Sample's errors to the arena in", self.sample_dir_path)
+        arena_length = sample.nr_matches
+        # Other processes may append to the arena as well, add_sample and add_samples hold the lock meanwhile
+        arena_offsets = self._arena.append({column: getattr(sample, column) for column in ArenaSampleDatabase.ERROR_COLUMNS})
+        sample_attributes = {name: value for name, value in vars(sample).items() if not name in ArenaSampleDatabase.ERROR_COLUMNS}
+        return {'arena_offsets': arena_offsets, 'arena_length': arena_length, 'sample_attributes': sample_attributes}
+
+    def _load_sample(self, db_entry):
+        """
+        Creates a sample with views into the arena from its db entry.
+        """
+        sample = MapMatcherSample()
+        for name, value in db_entry['sample_attributes'].items():
+            setattr(sample, name, value)
+        for column in ArenaSampleDatabase.ERROR_COLUMNS:
+            setattr(sample, column, self._arena.read(column, db_entry['arena_offsets'][column], db_entry['arena_length']))
+        return sample
+
+    def _delete_sample(self, db_entry):
+        """
+        Nothing to do here, the sample's errors stay in the arena until it gets rewritten. (see _compact_payloads)
+        """
+        pass
+
+    def add_sample(self, sample, params_dict, override_existing=False):
+        """
+        Same as SampleDatabase.add_sample, but holds the lock until the sample is registered,
+        so _compact_payloads can't rewrite the arena without the sample's errors in between.
+        """
+        with self._lock.exclusive():
+            super().add_sample(sample, params_dict, override_existing)
+
+    def add_samples(self, samples, override_existing=False):
+        """
+        Same as SampleDatabase.add_samples, but holds the lock until the samples are registered. (see add_sample)
+        """
+        with self._lock.exclusive():
+            return super().add_samples(samples, override_existing)
+
+    def _read_index(self):
+        """
+        Same as SampleDatabase._read_index, but also drops the arena's memory-maps.
+        Another process may have rewritten the arena (see _compact_payloads), so the current files have to be mapped again.
+        """
+        super()._read_index()
+        self._arena.unmap()
+
+    def _payload_exists(self, db_entry):
+        """
+        Returns whether the sample's errors are within the arena's columns.
+        """
+        for column in ArenaSampleDatabase.ERROR_COLUMNS:
+            column_path = self._arena.column_path(column)
+            column_length = os.path.getsize(column_path) // self._arena.dtype.itemsize if os.path.exists(column_path) else 0
+            if db_entry['arena_offsets'][column] + db_entry['arena_length'] > column_length:
+                return False
+        return True
+
+    def _payload_files(self):
+        """
+        The arena doesn't have a file per sample, so there can't be orphans.
+        """
+        return iter([])
+
+    def _compact_payloads(self):
+        """
+        Rewrites the arena, so it only contains the errors of samples in the database, and updates their db entries.
+        Other processes may only read the database meanwhile. Samples they loaded before have to be loaded again.
+        """
+        with self._lock.exclusive():
+            entries = sorted(self._entries(), key=lambda entry: entry[1]['arena_offsets']['translation_errors'])
+            print("\tRewriting the arena with the errors of", len(entries), "samples.")
+            new_offsets = self._arena.rewrite([(db_entry['arena_offsets'], db_entry['arena_length']) for params_hashed, db_entry in entries])
+            records = []
+            for (params_hashed, db_entry), arena_offsets in zip(entries, new_offsets):
+                db_entry = dict(db_entry, arena_offsets=arena_offsets)
+                records.append(('add', params_hashed, db_entry))
+            self._save(('batch', records))
+
+class SQLiteSampleDatabase(SampleDatabase):
+    """
+    SampleDatabase variant that keeps the database in a SQLite file at database_path instead of a journaled, pickled dict.
+    Samples themselves are still pickled to the sample_dir.
+
+    The table 'samples' contains one row per sample with its hash and its pickled db entry.
+    Additionally, each parameter has its own, indexed column (named "param:<rosparam name>"), which holds the sample's parameter value.
+    Columns are added whenever a sample with a new parameter is added. Samples that don't have that parameter contain NULL there.
+    Thanks to those columns, select can let SQLite find the matching samples, instead of checking every db entry in python.
+    """
+
+    LOCK_TIMEOUT = 600 # Seconds to wait for other processes' write transactions
+
+    def _open_index(self):
+        """
+        Opens the SQLite database at database_path, or creates a new one.
+        """
+        if os.path.exists(self._database_path):
+            print("\tFound existing SQLite database, opening:", self._database_path, end=" ")
+        else:
+            print("\tDidn't find existing SQLite database, initializing new database at", self._database_path, end=" ")
+        # SQLite does its own locking, so several processes can use the database at once. Writers wait for each other.
+        # Transactions are started explicitly (see _save), so the connection is opened in autocommit mode.
+        # Samples generated in the background are registered from other threads (see submit), so the connection is shared.
+        self._connection = sqlite3.connect(self._database_path, timeout=SQLiteSampleDatabase.LOCK_TIMEOUT, isolation_level=None,
+                                           check_same_thread=False)
+        self._connection.execute("CREATE TABLE IF NOT EXISTS samples (params_hashed TEXT PRIMARY KEY, db_entry BLOB NOT NULL)")
+        self._data_version = None
+        self.refresh()
+        print("- Contains", len(self), "samples.")
+
+    def refresh(self):
+        """
+        Picks up changes other processes committed since the last refresh, which SQLite tells by its data_version.
+        Db entries are always read from the SQLite database directly, but the cache may contain samples whose entries
+        were replaced meanwhile, so it's cleared. Also, other processes may have added parameter columns.
+        """
+        data_version = self._connection.execute("PRAGMA data_version").fetchone()[0]
+        if data_version == self._data_version:
+            return
+        self._data_version = data_version
+        self._cache.clear()
+        self._neighbour_indices.clear()
+        self._param_columns = set()
+        for column_info in self._connection.execute("PRAGMA table_info(samples)"):
+            if column_info[1].startswith("param:"):
+                self._param_columns.add(column_info[1][len("param:"):])
+
+    @classmethod
+    def _column(cls, param_name):
+        """
+        Returns the quoted column name for the given parameter.
+        """
+        return '"' + ("param:" + param_name).replace('"', '""') + '"'
+
+    @classmethod
+    def _sql_value(cls, value):
+        """
+        Converts a parameter value into the value stored in its column.
+        Numbers and strings are stored as they are, everything else (e.g. lists) as canonical json.
+        """
+        if isinstance(value, np.generic):
+            value = value.item()
+        if isinstance(value, bool):
+            return int(value)
+        if isinstance(value, (numbers.Real, str)) or value is None:
+            return value
+        return json.dumps(SampleDatabase._canonical_value(value), sort_keys=True, separators=(',', ':'))
+
+    def _add_param_column(self, param_name):
+        """
+        Adds an indexed column for a new parameter.
+        """
+        print("\tAdding column for parameter", param_name, "to the SQLite database.")
+        self._connection.execute("ALTER TABLE samples ADD COLUMN " + SQLiteSampleDatabase._column(param_name))
+        self._connection.execute("CREATE INDEX " + SQLiteSampleDatabase._column("index:" + param_name) +\
+                                 " ON samples (" + SQLiteSampleDatabase._column(param_name) + ")")
+        self._param_columns.add(param_name)
+
+    def _save(self, record, override_existing=True):
+        """
+        Applies a change record (see SampleDatabase._apply) to the SQLite database, in a single transaction.
+        See SampleDatabase._save for override_existing.
+        The transaction is started with BEGIN IMMEDIATE, i.e. it holds SQLite's write lock from the start.
+        Thus, no other process can change the database (e.g. add the same parameter column) between refresh and commit.
+        Threads of this process share the connection, so they're serialized by the lock (see submit).
+        """
+        with self._lock.exclusive():
+            self._connection.execute("BEGIN IMMEDIATE")
+            try:
+                self.refresh()
+                if not override_existing:
+                    self._check_new_keys(record)
+                self._execute_record(record)
+                self._connection.execute("COMMIT")
+            except:
+                self._connection.execute("ROLLBACK")
+                # Schema changes are rolled back as well, so columns added by this transaction have to be forgotten
+                self._data_version = None
+                self.refresh()
+                raise
+
+    def _execute_record(self, record):
+        """
+        Executes the SQL statements for a change record, without committing them.
+        """
+        if record[0] == 'add':
+            params_hashed, db_entry = record[1], record[2]
+            params_dict = db_entry['params_dict']
+            for param_name in params_dict.keys():
+                if not param_name in self._param_columns:
+                    self._add_param_column(param_name)
+            param_names = list(params_dict.keys())
+            columns = ["params_hashed", "db_entry"] + [SQLiteSampleDatabase._column(p) for p in param_names]
+            values = [params_hashed, pickle.dumps(db_entry, protocol=pickle.HIGHEST_PROTOCOL)] +\
+                     [SQLiteSampleDatabase._sql_value(params_dict[p]) for p in param_names]
+            self._connection.execute("INSERT OR REPLACE INTO samples (" + ", ".join(columns) + ") VALUES (" +\
+                                     ", ".join("?" * len(columns)) + ")", values)
+            self._update_neighbour_indices(record)
+        elif record[0] == 'remove':
+            self._connection.execute("DELETE FROM samples WHERE params_hashed = ?", (record[1],))
+            self._update_neighbour_indices(record)
+        elif record[0] == 'batch':
+            for batched_record in record[1]:
+                self._execute_record(batched_record)
+        elif record[0] == 'scores':
+            get_entry = lambda params_hashed: self._get_entry(params_hashed) if self._has_entry(params_hashed) else None
+            for params_hashed, db_entry in list(SampleDatabase._scored_entries(record, get_entry)):
+                self._connection.execute("UPDATE samples SET db_entry = ? WHERE params_hashed = ?",
+                                         (pickle.dumps(db_entry, protocol=pickle.HIGHEST_PROTOCOL), params_hashed))
+        else:
+            raise ValueError("Unknown record type", record[0])
+
+    def compact(self):
+        """
+        Lets SQLite rebuild the database file, to reclaim unused space.
+        """
+        print("\tCompacting SQLite database", self._database_path)
+        self._connection.execute("VACUUM")
+
+    def _get_entry(self, params_hashed):
+        """
+        Returns the db entry with the given hash, raises a KeyError if it doesn't exist.
+        """
+        row = self._connection.execute("SELECT db_entry FROM samples WHERE params_hashed = ?", (params_hashed,)).fetchone()
+        if row is None:
+            raise KeyError(params_hashed)
+        return pickle.loads(row[0])
+
+    def _has_entry(self, params_hashed):
+        """
+        Returns whether a db entry with the given hash exists.
+        """
+        return self._connection.execute("SELECT 1 FROM samples WHERE params_hashed = ?", (params_hashed,)).fetchone() is not None
+
+    def _entries(self):
+        """
+        Iterator over all (params_hashed, db_entry) tuples in the database.
+        """
+        for params_hashed, db_entry in self._connection.execute("SELECT params_hashed, db_entry FROM samples").fetchall():
+            yield params_hashed, pickle.loads(db_entry)
+
+    def __len__(self):
+        """
+        Returns the total number of samples stored in this database.
+        """
+        return self._connection.execute("SELECT COUNT(*) FROM samples").fetchone()[0]
+
+    def select(self, fixed_params, free_params_bounds):
+        """
+        Same as SampleDatabase.select, but the conditions are checked by a single SQL query on the parameter columns.
+        """
+        self.refresh()
+        conditions = []
+        values = []
+        for p_name, p_value in fixed_params.items():
+            if p_name in self._param_columns: # Otherwise, no sample has that parameter, which is fine
+                conditions.append("(" + SQLiteSampleDatabase._column(p_name) + " IS NULL OR " + SQLiteSampleDatabase._column(p_name) + " = ?)")
+                values.append(SQLiteSampleDatabase._sql_value(p_value))
+        for p_name, bounds in free_params_bounds.items():
+            if not p_name in self._param_columns:
+                return # No sample has this parameter, so none can satisfy the conditions
+            conditions.append(SQLiteSampleDatabase._column(p_name) + " IS NOT NULL")
+            if bounds is not None:
+                conditions.append(SQLiteSampleDatabase._column(p_name) + " BETWEEN ? AND ?")
+                values.extend([SQLiteSampleDatabase._sql_value(bounds[0]), SQLiteSampleDatabase._sql_value(bounds[1])])
+        for p_name in self._param_columns: # All other parameters must not be there
+            if not p_name in fixed_params and not p_name in free_params_bounds:
+                conditions.append(SQLiteSampleDatabase._column(p_name) + " IS NULL")
+        query = "SELECT params_hashed, db_entry FROM samples"
+        if len(conditions) > 0:
+            query += " WHERE " + " AND ".join(conditions)
+        for params_hashed, db_entry in self._connection.execute(query, values).fetchall():
+            db_entry = pickle.loads(db_entry)
+            yield SampleHandle(self, params_hashed, db_entry), db_entry['params_dict'].copy()
 
 class MapMatcherScriptSource(SampleSource):
     """
@@ -273,6 +1676,24 @@ class MapMatcherScriptSource(SampleSource):
                            At key 'interface_module', the MapMatcherScriptSource expects you to tell it where to find the interface_module.
                            Either give an absolute path to the script (e.g. /home/foo/map_matcher_dev/scripts/interface.py) or
                            the name of a script that already is part of the python path (e.g. interface).
+                           For low-fidelity samples (see with_fidelity), the config has the fraction of the dataset to evaluate on at key 'fidelity'.
+                           It's not part of the params_dict, which create_objective_function_sample has to return without it, too.
+
+    Optionally, each evaluation can get a budget via the config keys 'timeout' (wall-clock seconds) and 'memory_limit' (MiB).
+    Then, generate_sample runs in a child process in its own session, whose address space is limited to memory_limit
+    (which also applies to the processes it starts). If it's still running after timeout seconds, the whole session is killed.
+    Either way, the evaluation results in a censored sample (see MapMatcherSample), which has no matches,
+    but records why and after which duration the evaluation was aborted. This only works on POSIX systems.
+
+    Hopeless evaluations can be aborted early, if the interface_module implements a third function, which is used instead of generate_sample
+    as soon as the early_stopping member is set to an EarlyStopping object:
+        * stream_sample(params_dict, config):
+            Generator that starts the evaluation process like generate_sample, and yields partial results while it's running.
+            Each partial result is a tuple (progress, translation_errors, rotation_errors), with the fraction of the dataset that was
+            processed so far and the errors of the matches made since the previous partial result. It returns the results path
+            like generate_sample. If the evaluation is aborted, the generator is closed, so it should stop the evaluation process
+            (e.g. in a finally block). With a budget, it runs in the child process, whose session is killed instead.
+    Aborted evaluations result in a censored sample ('early_stop'), which has the matches made so far.
     """
     def __init__(self, config):
         """
@@ -281,7 +1702,13 @@ class MapMatcherScriptSource(SampleSource):
         """
         print("Setting up MapMatcherScriptSource...")
         self.config = config
-        # import the map matcher specific interface implementation
+        self.interface_module = self._import_interface_module()
+        self.early_stopping = None
+
+    def _import_interface_module(self):
+        """
+        Imports and returns the map matcher specific interface implementation, as configured at config['interface_module'].
+        """
         if os.path.isabs(self.config['interface_module']):
             print("\tGot absolute path to an interface script:", self.config['interface_module'])
             interface_script_name = os.path.splitext(os.path.basename(self.config['interface_module']))[0]
@@ -292,22 +1719,134 @@ class MapMatcherScriptSource(SampleSource):
             interface_script_name = self.config['interface_module']
             print("\tDidn't get absolute path: Using script", interface_script_name, ", which can hopefully be found by python.")
         print("\tImporting interface script", interface_script_name)
-        self.interface_module = __import__(interface_script_name)
+        return __import__(interface_script_name)
+
+    def __getstate__(self):
+        """
+        Modules can't be pickled, so only the config is sent to worker processes (see create_samples_from_map_matcher_results).
+        """
+        return {'config': self.config, 'early_stopping': self.early_stopping}
+
+    def __setstate__(self, state):
+        """
+        Restores the MapMatcherScriptSource in a worker process by importing the interface_module again.
+        """
+        self.config = state['config']
+        self.interface_module = self._import_interface_module()
+        self.early_stopping = state.get('early_stopping')
 
     def __getitem__(self, params_dict):
         """
         Generates a new MapMatcherSample with the given parameters and returns it.
 
-        :param params_dict: A dictionary of parameters of the requested sample.
+        :param params_dict: A dictionary of parameters of the requested sample, possibly with a fidelity (see with_fidelity).
         """
-        # This call will lock until the map matcher evaluation is finished
-        results_path = self.interface_module.generate_sample(params_dict, self.config)
-        generated_sample_params_dict, generated_sample = self.create_sample_from_map_matcher_results(results_path)
+        params_dict, fidelity = split_fidelity(params_dict)
+        config = self.config if fidelity is None else dict(self.config, fidelity=fidelity)
+        streaming = self.early_stopping is not None and hasattr(self.interface_module, 'stream_sample')
+        partial_results = _PartialResults(self.early_stopping) if streaming else None
+        if config.get('timeout') is not None or config.get('memory_limit') is not None:
+            results_path, censored_sample = self._generate_with_budget(params_dict, config, partial_results)
+            if censored_sample is not None:
+                return censored_sample
+        elif streaming:
+            results_path, censored_sample = self._generate_streaming(params_dict, config, partial_results)
+            if censored_sample is not None:
+                return censored_sample
+        else:
+            # This call will lock until the map matcher evaluation is finished
+            results_path = self.interface_module.generate_sample(params_dict, config)
+        generated_sample_params_dict, generated_sample = self.create_sample_from_map_matcher_results(results_path, config)
         # Check if the parameters were conveyed correctly
         if not generated_sample_params_dict == params_dict:
             raise RuntimeError("Sample requested with parameters", params_dict, "ended up being generated with parameters", generated_sample_params_dict, "!")
         return generated_sample
 
+    def _generate_streaming(self, params_dict, config, partial_results):
+        """
+        Runs stream_sample of the interface_module and aborts it early if it's hopeless (see class documentation).
+
+        :param config: The config for the interface_module, i.e. config of this MapMatcherScriptSource with the requested fidelity.
+        :param partial_results: The _PartialResults to collect the streamed results in.
+        :return: Tuple (results_path, censored_sample). One of them is None, depending on whether the evaluation finished.
+        """
+        start_time = time.time()
+        stream = self.interface_module.stream_sample(params_dict, config)
+        while True:
+            try:
+                progress, translation_errors, rotation_errors = next(stream)
+            except StopIteration as stop:
+                return stop.value, None
+            if partial_results.add(progress, translation_errors, rotation_errors):
+                print("\tEvaluation can't beat the incumbent anymore, stopping it.")
+                stream.close()
+                return None, self._censored_sample(params_dict, 'early_stop', time.time() - start_time, partial_results)
+
+    def _generate_with_budget(self, params_dict, config, partial_results=None):
+        """
+        Runs generate_sample of the interface_module within the configured timeout and memory_limit (see class documentation).
+        If partial_results are given, stream_sample is run instead, and the evaluation is also aborted early if it's hopeless.
+
+        :param config: The config for the interface_module, i.e. config of this MapMatcherScriptSource with the requested fidelity.
+        :param partial_results: Optionally, the _PartialResults to collect the streamed results in.
+        :return: Tuple (results_path, censored_sample). One of them is None, depending on whether the evaluation finished.
+        """
+        if os.name != 'posix':
+            raise RuntimeError("Evaluation budgets ('timeout' and 'memory_limit') are only supported on POSIX systems.")
+        timeout = config.get('timeout')
+        memory_limit = config.get('memory_limit')
+        print("\tGenerating sample with a budget of", timeout, "seconds and", memory_limit, "MiB.")
+        start_time = time.time()
+        receiver, sender = multiprocessing.Pipe(duplex=False)
+        process = multiprocessing.Process(target=_generate_within_budget,
+                                          args=(self, params_dict, config, sender, memory_limit, partial_results is not None))
+        process.start()
+        sender.close() # Otherwise, receiving wouldn't notice if the child died
+        try:
+            while True:
+                remaining_time = None if timeout is None else max(0, start_time + timeout - time.time())
+                if not receiver.poll(remaining_time):
+                    print("\tWarning: Evaluation exceeded its timeout of", timeout, "seconds, killing it.")
+                    return None, self._censored_sample(params_dict, 'timeout', time.time() - start_time, partial_results)
+                try:
+                    outcome, value = receiver.recv()
+                except EOFError: # The child died without a result, e.g. since it was killed by the OOM killer
+                    process.join()
+                    print("\tWarning: Evaluation process died with exit code", process.exitcode)
+                    return None, self._censored_sample(params_dict, 'crashed', time.time() - start_time, partial_results)
+                if outcome == 'partial':
+                    if partial_results.add(*value):
+                        print("\tEvaluation can't beat the incumbent anymore, killing it.")
+                        return None, self._censored_sample(params_dict, 'early_stop', time.time() - start_time, partial_results)
+                    continue
+                if outcome == 'memory':
+                    print("\tWarning: Evaluation exceeded its memory limit of", memory_limit, "MiB:", value)
+                    return None, self._censored_sample(params_dict, 'memory', time.time() - start_time, partial_results)
+                if outcome == 'error':
+                    raise RuntimeError("Sample generation failed:\n" + value)
+                return value, None
+        finally:
+            # Kill the session, including all processes generate_sample started, in case they're still running
+            try:
+                os.killpg(process.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+            process.join()
+            receiver.close()
+
+    def _censored_sample(self, params_dict, reason, duration, partial_results=None):
+        """
+        Returns a censored sample for an evaluation that was aborted after duration seconds.
+        If partial_results are given, the sample has the matches that were streamed until then.
+        """
+        sample = MapMatcherSample()
+        sample.translation_errors = partial_results.translation_errors if partial_results is not None else []
+        sample.rotation_errors = partial_results.rotation_errors if partial_results is not None else []
+        sample.duration = datetime.timedelta(seconds=duration)
+        sample.censored = reason
+        sample.name = SampleDatabase.dict_hash(params_dict) + "_" + reason
+        return sample
+
     @property
     def sample_type(self):
         """
@@ -315,11 +1854,12 @@ class MapMatcherScriptSource(SampleSource):
         """
         return MapMatcherSample
 
-    def create_sample_from_map_matcher_results(self, results_path, override_existing=False):
+    def create_sample_from_map_matcher_results(self, results_path, override_existing=False, config=None):
         """
         Creates a new Sample object from a finished map matcher run and adds it to the database.
 
         :param results_path: The path to the directory which contains the map matcher's results.
+        :param config: The config for the interface_module, defaults to the config of this MapMatcherScriptSource.
         :return: Tuple with the params_dict of the added sample (determined by the interface_module) and the sample itself.
         """
 
@@ -328,7 +1868,7 @@ class MapMatcherScriptSource(SampleSource):
         sample = MapMatcherSample()
         # This function actually fills the sample with data.
         # Its implementation depends on which map matching pipeline is optimized.
-        params_dict = self.interface_module.create_objective_function_sample(results_path, sample, self.config)
+        params_dict = self.interface_module.create_objective_function_sample(results_path, sample, config or self.config)
         # Calculate a name for the sample
         sample.name = os.path.basename(results_path)
         if sample.name == "results": # In some cases the results are placed in a dir called 'results'
@@ -336,11 +1876,172 @@ class MapMatcherScriptSource(SampleSource):
             sample.name = os.path.basename(os.path.dirname(results_path))
         return params_dict, sample
 
+    def create_samples_from_map_matcher_results(self, results_paths, workers=None):
+        """
+        Iterator that creates new Sample objects from many finished map matcher runs, in parallel worker processes.
+        The results are yielded in the order of results_paths, so they can be passed directly to SampleDatabase.add_samples.
+
+        :param results_paths: List of paths to directories which contain the map matcher's results.
+        :param workers: The number of worker processes. Defaults to the number of CPUs.
+        :return: Tuples (params_dict, sample), like create_sample_from_map_matcher_results.
+        """
+        with concurrent.futures.ProcessPoolExecutor(workers) as executor:
+            for params_dict, sample in executor.map(self.create_sample_from_map_matcher_results, results_paths):
+                yield params_dict, sample
+
+class _PartialResults(object):
+    """
+    Collects the partial results that stream_sample of a MapMatcherScriptSource's interface_module yields,
+    and checks with an EarlyStopping object whether the evaluation is hopeless.
+    """
+    def __init__(self, early_stopping):
+        self.early_stopping = early_stopping
+        self.translation_errors = []
+        self.rotation_errors = []
+        self._checked_progress = 0 # The progress at the last check
+
+    def add(self, progress, translation_errors, rotation_errors):
+        """
+        Adds a partial result and returns whether the evaluation should be aborted.
+        Only checks again once the progress increased by the early_stopping's check_interval.
+        """
+        self.translation_errors.extend(translation_errors)
+        self.rotation_errors.extend(rotation_errors)
+        if progress - self._checked_progress < self.early_stopping.check_interval:
+            return False
+        self._checked_progress = progress
+        return self.early_stopping.hopeless(self.translation_errors, self.rotation_errors, progress)
+
+def _generate_within_budget(script_source, params_dict, config, sender, memory_limit, streaming):
+    """
+    Runs generate_sample of a MapMatcherScriptSource's interface_module in a child process (see MapMatcherScriptSource._generate_with_budget).
+    Sends a tuple (outcome, value) with the outcome 'ok' and the results path, or 'memory' or 'error' and a description.
+    If streaming, runs stream_sample instead and sends each partial result as ('partial', partial_result) first.
+    """
+    os.setsid() # Own session, so the parent can kill all processes started by generate_sample at once
+    if memory_limit is not None:
+        resource.setrlimit(resource.RLIMIT_AS, (memory_limit * 2**20, memory_limit * 2**20))
+    try:
+        if streaming:
+            stream = script_source.interface_module.stream_sample(params_dict, config)
+            while True:
+                try:
+                    partial_result = next(stream)
+                except StopIteration as stop:
+                    results_path = stop.value
+                    break
+                sender.send(('partial', tuple(partial_result)))
+        else:
+            results_path = script_source.interface_module.generate_sample(params_dict, config)
+        sender.send(('ok', results_path))
+    except MemoryError:
+        sender.send(('memory', traceback.format_exc()))
+    except Exception:
+        sender.send(('error', traceback.format_exc()))
+
+_pool_sample_generator = None # The sample generator of a PoolSampleSource's worker process
+
+def _init_pool_worker(sample_generator):
+    """
+    Initializes a worker process of a PoolSampleSource with the sample generator it uses for all its tasks.
+    """
+    global _pool_sample_generator
+    _pool_sample_generator = sample_generator
+
+def _generate_in_pool_worker(params_dict, early_stopping=None):
+    """
+    Generates a sample in a worker process of a PoolSampleSource.
+    If the sample generator supports early stopping (see MapMatcherScriptSource), it uses the given EarlyStopping object.
+    """
+    if hasattr(_pool_sample_generator, 'early_stopping'):
+        _pool_sample_generator.early_stopping = early_stopping
+    return _pool_sample_generator[params_dict]
+
+class PoolSampleSource(SampleSource):
+    """
+    Sample source that runs up to a number of sample generations concurrently, each in a separate worker process.
+    The samples are actually generated by another sample source (e.g. a MapMatcherScriptSource), which is sent to each worker.
+
+    Use submit to start generating a sample without waiting for it, which returns a concurrent.futures.Future.
+    __getitem__ still blocks until the sample is done. Requests for parameters whose generation is already running share
+    the same future. A SampleDatabase that uses a PoolSampleSource as its sample_generator offers the same submit method,
+    which also adds each sample to the database as soon as it's finished.
+    """
+    def __init__(self, sample_generator, workers=None):
+        """
+        :param sample_generator: Sample source that generates the samples. It has to be picklable.
+        :param workers: The maximum number of concurrent generations. Defaults to the number of CPUs.
+        """
+        print("Setting up PoolSampleSource with", workers or os.cpu_count(), "workers...")
+        self.sample_generator = sample_generator
+        self.workers = workers
+        self._executor = None # Started with the first request
+        self._running = {} # Maps the hashes of requested params_dicts to the futures of their generations
+        self._running_lock = threading.Lock()
+
+    def submit(self, params_dict):
+        """
+        Starts generating the sample with the given parameters in a worker process.
+
+        :param params_dict: A dictionary of parameters of the requested sample.
+        :return: A concurrent.futures.Future, whose result is the generated sample.
+        """
+        params_hashed = SampleDatabase.dict_hash(params_dict)
+        with self._running_lock:
+            if params_hashed in self._running:
+                return self._running[params_hashed]
+            if self._executor is None:
+                self._executor = concurrent.futures.ProcessPoolExecutor(self.workers, initializer=_init_pool_worker,
+                                                                        initargs=(self.sample_generator,))
+            # The early stopping criterion is sent with each request, so the workers know the current incumbent
+            generation = self._executor.submit(_generate_in_pool_worker, params_dict, getattr(self.sample_generator, 'early_stopping', None))
+            self._running[params_hashed] = generation
+        generation.add_done_callback(lambda generation: self._finished(params_hashed))
+        return generation
+
+    def _finished(self, params_hashed):
+        """
+        Forgets a finished generation, so requesting the same parameters again starts a new one.
+        """
+        with self._running_lock:
+            self._running.pop(params_hashed, None)
+
+    @property
+    def nr_running(self):
+        """
+        The number of generations that were submitted, but aren't finished yet.
+        """
+        with self._running_lock:
+            return len(self._running)
+
+    def shutdown(self, wait=True):
+        """
+        Stops the worker processes. If wait is True, waits for all running generations to finish first.
+        """
+        if self._executor is not None:
+            self._executor.shutdown(wait)
+            self._executor = None
+
+    def __getitem__(self, params_dict):
+        """
+        Generates a new sample with the given parameters in a worker process and returns it.
+
+        :param params_dict: A dictionary of parameters of the requested sample.
+        """
+        return self.submit(params_dict).result()
+
+    @property
+    def sample_type(self):
+        """
+        The PoolSampleSource supplies samples of its sample_generator's type.
+        """
+        return self.sample_generator.sample_type
+
 class MapMatcherFakeSource(SampleSource):
     """
     Generates fake MapMatcherSamples.
     Instead of actually running an evaluation process, it determines the sample's contents with the following functions:
-    number_of_matches: (x1-x2)*sin(x1)
+    number_of_matches: (x1-x2)*sin(x1); Scaled by the fidelity for low-fidelity samples (see with_fidelity)
     translation errors: [x1^2 + (2*x2-10)^2]; For all elements
     rotation errors: [0, ... , 0]; Translation errors should suffice for testing
     duration: always 0, since currently not used
@@ -351,9 +2052,10 @@ class MapMatcherFakeSource(SampleSource):
     def __getitem__(self, params_dict):
         x1 = params_dict['x1']
         x2 = params_dict['x2']
+        fidelity = split_fidelity(params_dict)[1] or 1
         sample = MapMatcherSample()
         translation_error = np.float_power(x1, 2) + np.float_power(2 * x2 - 10, 2)
-        nr_matches = int(round(abs((x1-x2)*np.sin(x1))))
+        nr_matches = int(round(fidelity * abs((x1-x2)*np.sin(x1))))
         sample.translation_errors = [translation_error] * nr_matches
         sample.rotation_errors = [0] * nr_matches
         return sample
@@ -10,6 +10,8 @@ Contains classes that define what a sample is.
 Samples are used to define an objective function (see objective_function.py) via discrete observations of that function.
 """
 
+import numpy as np
+
 class MapMatcherSample(object):
     """
     Represents a sample generated by a map matcher.
@@ -20,8 +22,12 @@ class MapMatcherSample(object):
         * rotation_errors: A list of rotation errors per match (degree).
         *---> Translation error n and rotation error n are both expected to be the result of match n.
         * duration: A datetime.timedelta object, which contains the duration it took to generate the sample.
+        * censored: None for complete runs. Otherwise, the reason why the run was aborted (e.g. 'timeout', 'memory' or 'early_stop'),
+                    see MapMatcherScriptSource. Censored samples only contain the matches that were streamed before, if any.
     """
 
+    censored = None # Default for samples that were pickled before censoring existed
+
     def __init__(self):
         """
         Creates a function sample object with empty data contents.
@@ -33,6 +39,7 @@ class MapMatcherSample(object):
         self.translation_errors = None
         self.rotation_errors = None
         self.duration = None
+        self.censored = None
         # Other fields, e.g. for user output
         self.name = None
 
@@ -44,3 +51,100 @@ class MapMatcherSample(object):
         assert(len(self.translation_errors) == len(self.rotation_errors))
         return len(self.translation_errors)
 
+
+class MapMatcherSampleSummary(object):
+    """
+    A compact summary of a MapMatcherSample, which is small enough to be stored in a database's index.
+    Contains the following properties:
+        * nr_matches: The sample's number of matches.
+        * duration: The sample's duration.
+        * censored: The reason why the sample's run was aborted, or None. (see MapMatcherSample)
+        * name: The sample's name.
+        * translation_error_stats, rotation_error_stats: Each a dict with statistics of the respective error list:
+            * sum, mean, max: The sum, mean and maximum of the errors. (mean and max are None, if there are no errors)
+            * quantiles: Dict which maps each quantile in QUANTILES to its value. (empty, if there are no errors)
+            * histogram: Tuple (counts, bin_edges) of a histogram with HISTOGRAM_BINS bins. (empty lists, if there are no errors)
+
+    Since it has a nr_matches property, a summary can be used instead of a sample for performance measures that
+    only need the number of matches (e.g. NrMatchesMeasure).
+    """
+
+    QUANTILES = [0.5, 0.9, 0.95, 0.99]
+    HISTOGRAM_BINS = 10
+
+    def __init__(self, summary_dict):
+        """
+        Creates a summary object from its dict representation (see from_sample and to_dict).
+        """
+        self._summary_dict = summary_dict
+
+    @classmethod
+    def from_sample(cls, sample):
+        """
+        Calculates the summary of the given MapMatcherSample.
+        """
+        summary_dict = {'nr_matches': sample.nr_matches, 'duration': sample.duration, 'name': sample.name, 'censored': sample.censored}
+        for error_name in ['translation_errors', 'rotation_errors']:
+            errors = np.asarray(getattr(sample, error_name), dtype=float)
+            if len(errors) == 0:
+                summary_dict[error_name] = {'sum': 0.0, 'mean': None, 'max': None, 'quantiles': {}, 'histogram': ([], [])}
+                continue
+            counts, bin_edges = np.histogram(errors, bins=cls.HISTOGRAM_BINS)
+            summary_dict[error_name] = {'sum': float(np.sum(errors)),
+                                        'mean': float(np.mean(errors)),
+                                        'max': float(np.max(errors)),
+                                        'quantiles': dict(zip(cls.QUANTILES, np.quantile(errors, cls.QUANTILES).tolist())),
+                                        'histogram': (counts.tolist(), bin_edges.tolist())}
+        return cls(summary_dict)
+
+    def to_dict(self):
+        """
+        Returns the dict representation of this summary, which only contains built-in python types.
+        """
+        return self._summary_dict
+
+    def __str__(self):
+        return "MapMatcherSampleSummary(" + str(self.name) + ": " + str(self.nr_matches) + " matches, max errors " +\
+               str(self.translation_error_stats['max']) + " m / " + str(self.rotation_error_stats['max']) + " deg)"
+
+    @property
+    def nr_matches(self):
+        """
+        The number of matches of the summarized sample.
+        """
+        return self._summary_dict['nr_matches']
+
+    @property
+    def duration(self):
+        """
+        The duration it took to generate the summarized sample.
+        """
+        return self._summary_dict['duration']
+
+    @property
+    def name(self):
+        """
+        The name of the summarized sample.
+        """
+        return self._summary_dict['name']
+
+    @property
+    def censored(self):
+        """
+        The reason why the summarized sample's run was aborted, or None. (Summaries of older versions don't contain it)
+        """
+        return self._summary_dict.get('censored')
+
+    @property
+    def translation_error_stats(self):
+        """
+        Dict with statistics of the summarized sample's translation errors.
+        """
+        return self._summary_dict['translation_errors']
+
+    @property
+    def rotation_error_stats(self):
+        """
+        Dict with statistics of the summarized sample's rotation errors.
+        """
+        return self._summary_dict['rotation_errors']
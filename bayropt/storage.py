@@ -0,0 +1,696 @@
+#!/usr/bin/env python3
+
+##########################################################################
+# Copyright (c) 2017 German Aerospace Center (DLR). All rights reserved. #
+# SPDX-License-Identifier: BSD-2-Clause                                  #
+##########################################################################
+
+"""
+Contains low-level storage helpers, which are used by the SampleDatabase (see sample_sources.py).
+None of those classes know anything about samples; they only deal with files, bytes and python objects.
+"""
+
+import os
+import pickle
+import struct
+import zlib
+import lzma
+import numbers
+import collections
+import contextlib
+import threading
+import numpy as np
+from scipy.spatial import cKDTree
+try:
+    import fcntl
+except ImportError: # Not available on Windows, FileLock then only works between threads
+    fcntl = None
+
+class Journal(object):
+    """
+    Append-only journal on top of a pickled snapshot.
+
+    The state of the journaled object is stored in two files:
+        * The snapshot: A pickled python object, written from time to time (see compact).
+        * The journal: All changes since the last snapshot, appended as separate records.
+    Opening the journal means loading the snapshot and replaying all records on top of it.
+    Thus, recording a change costs the same, no matter how big the snapshot is.
+
+    Each record is stored as a header (length and crc32 checksum of the payload) followed by the pickled payload.
+    If a process crashes while appending a record, the record at the end of the journal is incomplete.
+    It will fail the checksum test and is ignored (and cut off) when the journal is replayed.
+    The snapshot is replaced atomically (written to a temporary file, then renamed), so it can't be corrupted either.
+    Since the journal is only truncated after the snapshot was replaced, a crash in between means records get replayed twice.
+    Records should therefore be idempotent.
+    """
+
+    HEADER = struct.Struct("<II") # (payload length, crc32 of payload)
+
+    def __init__(self, snapshot_path, journal_path=None):
+        """
+        :param snapshot_path: Path to the pickled snapshot.
+        :param journal_path: Path to the journal file. Defaults to the snapshot_path with an additional ".journal" suffix.
+        """
+        self.snapshot_path = snapshot_path
+        self.journal_path = journal_path if journal_path is not None else snapshot_path + ".journal"
+        self.offset = 0 # Byte offset in the journal file up to which records were read or written
+        self.nr_records = 0 # Number of records in the journal file, up to the offset
+        self.snapshot_id = None # Identifies the snapshot file that was read or written last, see is_current
+
+    def __len__(self):
+        """
+        Returns the number of records that were appended since the last snapshot.
+        """
+        return self.nr_records
+
+    def read_snapshot(self):
+        """
+        Returns the unpickled snapshot, or None if there is none.
+        """
+        if not os.path.exists(self.snapshot_path):
+            return None
+        with open(self.snapshot_path, 'rb') as snapshot_handle:
+            self.snapshot_id = Journal._file_id(snapshot_handle.fileno())
+            self.offset = 0
+            self.nr_records = 0
+            return pickle.load(snapshot_handle)
+
+    def is_current(self):
+        """
+        Returns a tuple (snapshot_current, journal_current), which tells whether other processes changed the files on disk:
+            * snapshot_current is False, if the journal was compacted since the snapshot was read (or written) by this object.
+              All records were replaced, so the snapshot has to be read again and the journal replayed from the start.
+            * journal_current is False, if records were appended that this object didn't read (or write) yet.
+              Those can be read by replay.
+        """
+        try:
+            snapshot_current = Journal._file_id(self.snapshot_path) == self.snapshot_id
+        except FileNotFoundError:
+            snapshot_current = self.snapshot_id is None
+        try:
+            journal_current = os.path.getsize(self.journal_path) == self.offset
+        except FileNotFoundError:
+            journal_current = self.offset == 0
+        return snapshot_current, journal_current
+
+    @classmethod
+    def _file_id(cls, file):
+        """
+        Returns a tuple that changes whenever the file at the given path (or file descriptor) is replaced or modified.
+        """
+        file_stat = os.stat(file)
+        return (file_stat.st_dev, file_stat.st_ino, file_stat.st_size, file_stat.st_mtime_ns)
+
+    def replay(self):
+        """
+        Iterator over all records in the journal file, starting at the current offset.
+        Stops at the end of the file or at the first incomplete or corrupt record, which is then cut off.
+        """
+        if not os.path.exists(self.journal_path):
+            return
+        with open(self.journal_path, 'rb') as journal_handle:
+            journal_handle.seek(self.offset)
+            while True:
+                header = journal_handle.read(Journal.HEADER.size)
+                if len(header) == 0:
+                    break # Regular end of the journal
+                if len(header) == Journal.HEADER.size:
+                    length, checksum = Journal.HEADER.unpack(header)
+                    payload = journal_handle.read(length)
+                    if len(payload) == length and zlib.crc32(payload) == checksum:
+                        self.offset = journal_handle.tell()
+                        self.nr_records += 1
+                        yield pickle.loads(payload)
+                        continue
+                print("\tWarning: Found incomplete record at the end of journal", self.journal_path, "(crashed while writing?), discarding it.")
+                self._truncate(self.offset)
+                break
+
+    def append(self, record):
+        """
+        Appends a single record to the journal and makes sure it's on disk before returning.
+
+        :param record: Any picklable python object.
+        """
+        payload = pickle.dumps(record, protocol=pickle.HIGHEST_PROTOCOL)
+        with open(self.journal_path, 'ab') as journal_handle:
+            journal_handle.seek(self.offset)
+            journal_handle.write(Journal.HEADER.pack(len(payload), zlib.crc32(payload)) + payload)
+            journal_handle.flush()
+            os.fsync(journal_handle.fileno())
+            self.offset = journal_handle.tell()
+        self.nr_records += 1
+
+    def compact(self, state):
+        """
+        Writes the given state as the new snapshot and clears the journal.
+
+        :param state: The complete state, i.e. the snapshot with all journal records applied to it.
+        """
+        atomic_pickle_dump(state, self.snapshot_path)
+        self.snapshot_id = Journal._file_id(self.snapshot_path)
+        self._truncate(0)
+        self.nr_records = 0
+
+    def _truncate(self, offset):
+        """
+        Cuts off the journal file at the given offset.
+        """
+        if os.path.exists(self.journal_path):
+            with open(self.journal_path, 'r+b') as journal_handle:
+                journal_handle.truncate(offset)
+                journal_handle.flush()
+                os.fsync(journal_handle.fileno())
+        self.offset = offset
+
+def atomic_pickle_dump(obj, path):
+    """
+    Pickles obj to path, without ever leaving a partially written file at path.
+    The object is pickled into a temporary file first, which then replaces the file at path.
+    """
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'wb') as tmp_handle:
+        pickle.dump(obj, tmp_handle, protocol=pickle.HIGHEST_PROTOCOL)
+        tmp_handle.flush()
+        os.fsync(tmp_handle.fileno())
+    os.replace(tmp_path, path)
+
+class FileLock(object):
+    """
+    Lock that is shared between processes via flock on a lock file, e.g. processes that work on the same SampleDatabase.
+    It can either be held shared (by many readers at once) or exclusive (by a single writer), see shared and exclusive.
+
+    Within a process, the lock is reentrant: Nested shared or exclusive sections of the same process don't block
+    each other, as long as an exclusive section isn't requested inside a shared one (flock can't upgrade atomically).
+    Threads of the same process are serialized by an additional RLock, since flock locks belong to the process.
+    """
+
+    def __init__(self, path):
+        """
+        :param path: Path to the lock file. It's created if it doesn't exist and is never removed.
+        """
+        self.path = path
+        self._thread_lock = threading.RLock()
+        self._handle = None
+        self._depth = 0 # Number of nested sections holding the lock
+        self._exclusive = False
+
+    def shared(self):
+        """
+        Returns a context manager that holds the lock shared, i.e. other processes can't hold it exclusive meanwhile.
+        """
+        return self._locked(exclusive=False)
+
+    def exclusive(self):
+        """
+        Returns a context manager that holds the lock exclusive, i.e. no other process can hold it meanwhile.
+        """
+        return self._locked(exclusive=True)
+
+    @contextlib.contextmanager
+    def _locked(self, exclusive):
+        with self._thread_lock:
+            if self._depth == 0:
+                self._handle = open(self.path, 'a+b')
+                if fcntl is not None:
+                    fcntl.flock(self._handle.fileno(), fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+                self._exclusive = exclusive
+            elif exclusive and not self._exclusive:
+                raise RuntimeError("Can't acquire an exclusive lock while holding the shared lock", self.path)
+            self._depth += 1
+            try:
+                yield
+            finally:
+                self._depth -= 1
+                if self._depth == 0:
+                    self._handle.close() # Releases the flock
+                    self._handle = None
+
+class SingleFlight(object):
+    """
+    Per-key locks that are shared between threads and processes, for running the same work (e.g. generating a sample) only once,
+    even if several callers request it at the same time. The first caller owns the key until it releases it,
+    all others wait for that (or see that they don't own it, with blocking=False), and then find the work done.
+
+    Each key has a lock file in directory, which is locked via flock while the key is owned, and removed when it's released.
+    A caller that opened the lock file before it was removed notices that when it gets the flock, and tries again.
+    Threads of the same process are serialized by a thread lock per key first, since flock locks belong to the process.
+    Unlike FileLock's RLock, the thread lock may be released by another thread than the one that acquired it.
+    """
+
+    def __init__(self, directory):
+        """
+        :param directory: Directory for the lock files. It's created if it doesn't exist.
+        """
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._keys_lock = threading.Lock()
+        self._keys = {} # Maps keys to [thread lock, nr. of callers using it, lock file handle]
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + ".lock")
+
+    def acquire(self, key, blocking=True):
+        """
+        Makes the caller own the key. Blocks until the current owner released it, unless blocking is False.
+
+        :return: Whether the key is owned by the caller now, which is always True if blocking.
+        """
+        with self._keys_lock:
+            entry = self._keys.setdefault(key, [threading.Lock(), 0, None])
+            entry[1] += 1
+        try:
+            if entry[0].acquire(blocking):
+                try:
+                    entry[2] = self._lock_file(self._path(key), blocking)
+                except BaseException:
+                    entry[0].release()
+                    raise
+                if entry[2] is not None:
+                    return True
+                entry[0].release()
+        except BaseException:
+            self._forget(key, entry)
+            raise
+        self._forget(key, entry)
+        return False
+
+    def release(self, key):
+        """
+        Releases a key the caller owns (see acquire).
+        """
+        with self._keys_lock:
+            entry = self._keys[key]
+        handle, entry[2] = entry[2], None
+        if fcntl is not None:
+            # Remove the lock file while still holding the flock, so nobody can lock it without noticing the removal
+            os.remove(handle.name)
+            handle.close()
+        else: # Open files can't be removed, but without flock, there are no other processes to care about anyway
+            handle.close()
+            os.remove(handle.name)
+        entry[0].release()
+        self._forget(key, entry)
+
+    @contextlib.contextmanager
+    def owned(self, key):
+        """
+        Returns a context manager that owns the key (see acquire) while it's active.
+        """
+        self.acquire(key)
+        try:
+            yield
+        finally:
+            self.release(key)
+
+    def _forget(self, key, entry):
+        """
+        Drops the thread lock of a key once no caller of this process uses it anymore.
+        """
+        with self._keys_lock:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._keys[key]
+
+    @staticmethod
+    def _lock_file(path, blocking):
+        """
+        Opens the lock file at path and gets its flock. Returns the file handle, or None if it's locked and not blocking.
+        """
+        while True:
+            handle = open(path, 'a+b')
+            if fcntl is not None:
+                try:
+                    fcntl.flock(handle.fileno(), fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    handle.close()
+                    return None
+            try:
+                if os.fstat(handle.fileno()).st_ino == os.stat(path).st_ino:
+                    return handle
+            except FileNotFoundError:
+                pass
+            handle.close() # The previous owner removed the file after this caller opened it, try again with a new one
+
+class PackedPayload(object):
+    """
+    Compact file format for objects whose data mostly consists of long lists of numbers (e.g. samples).
+    Pickling a list of floats stores every float as a separate python object, which takes several times the space of the raw values.
+    Instead, a packed payload stores such lists as typed numpy arrays, optionally downcast to float32, and compresses the result.
+
+    A file consists of MAGIC, one byte that identifies the compression (index in COMPRESSIONS) and the compressed pickle of
+    a dict with the object's attributes, split into 'arrays' and (all other) 'attributes'.
+    Since pickles never start with MAGIC, is_packed can tell packed payloads and plain pickles apart.
+    Loaded objects contain numpy arrays where the original object contained lists of numbers.
+    """
+
+    MAGIC = b"\x00BAYROPT-PACKED\x01"
+    COMPRESSIONS = ['none', 'zlib', 'lzma']
+
+    @classmethod
+    def dump(cls, obj, path, compression='zlib', float32=False):
+        """
+        Writes the attributes of obj to the file at path.
+
+        :param obj: The object to store. Its attributes have to be picklable.
+        :param path: The path of the file that should be written.
+        :param compression: One of COMPRESSIONS.
+        :param float32: If True, float arrays are stored with single precision, which halves their size but loses precision.
+        """
+        if not compression in PackedPayload.COMPRESSIONS:
+            raise ValueError("Unknown compression", compression, "should be one of", PackedPayload.COMPRESSIONS)
+        payload = PackedPayload.split_attributes(obj)
+        if float32:
+            payload['arrays'] = {name: array.astype(np.float32) if array.dtype.kind == 'f' else array
+                                 for name, array in payload['arrays'].items()}
+        data = PackedPayload._compress(compression, pickle.dumps(payload, protocol=pickle.HIGHEST_PROTOCOL))
+        with open(path, 'wb') as payload_handle:
+            payload_handle.write(PackedPayload.MAGIC + bytes([PackedPayload.COMPRESSIONS.index(compression)]) + data)
+
+    @classmethod
+    def split_attributes(cls, obj):
+        """
+        Splits the attributes of obj into number arrays and all other attributes.
+        Returns a dict with the keys 'arrays' (maps names to numpy arrays) and 'attributes' (maps names to the other values).
+        """
+        split = {'arrays': {}, 'attributes': {}}
+        for name, value in vars(obj).items():
+            array = PackedPayload._to_array(value)
+            if array is None:
+                split['attributes'][name] = value
+            else:
+                split['arrays'][name] = array
+        return split
+
+    @classmethod
+    def is_packed(cls, payload_handle):
+        """
+        Returns whether the file behind the given handle (opened in binary mode) is a packed payload.
+        Afterwards, the handle points to the beginning of the file again.
+        """
+        is_packed = payload_handle.read(len(PackedPayload.MAGIC)) == PackedPayload.MAGIC
+        payload_handle.seek(0)
+        return is_packed
+
+    @classmethod
+    def load(cls, payload_handle, obj_type):
+        """
+        Creates an object of obj_type (with its default constructor) and sets the attributes stored in the file behind payload_handle.
+        """
+        payload_handle.seek(len(PackedPayload.MAGIC))
+        compression = PackedPayload.COMPRESSIONS[payload_handle.read(1)[0]]
+        payload = pickle.loads(PackedPayload._decompress(compression, payload_handle.read()))
+        obj = obj_type()
+        for name, value in payload['attributes'].items():
+            setattr(obj, name, value)
+        for name, array in payload['arrays'].items():
+            setattr(obj, name, array)
+        return obj
+
+    @classmethod
+    def _to_array(cls, value):
+        """
+        Returns value as numpy array, if it is a non-empty list of numbers or a numeric numpy array. Otherwise, returns None.
+        """
+        if isinstance(value, np.ndarray):
+            return value if value.dtype.kind in 'iuf' else None
+        if isinstance(value, list) and len(value) > 0 and\
+           all(isinstance(element, numbers.Real) and not isinstance(element, bool) for element in value):
+            return np.asarray(value)
+        return None
+
+    @classmethod
+    def _compress(cls, compression, data):
+        if compression == 'zlib':
+            return zlib.compress(data)
+        if compression == 'lzma':
+            return lzma.compress(data)
+        return data
+
+    @classmethod
+    def _decompress(cls, compression, data):
+        if compression == 'zlib':
+            return zlib.decompress(data)
+        if compression == 'lzma':
+            return lzma.decompress(data)
+        return data
+
+class ColumnArena(object):
+    """
+    Stores many variable-length float arrays in a few big, memory-mapped files.
+
+    The arena consists of named columns, each column is a single file of raw (native byte order) values of the arena's dtype.
+    Arrays are appended to the end of their column's file. The returned offsets (in elements, not bytes) and the array's
+    length are all that is needed to get the array back later, as a read-only view into the memory-mapped file.
+    Reading doesn't copy any data and doesn't need to open a file per array, so scanning many arrays in offset order
+    becomes a sequential read.
+
+    Appended arrays are never moved. Space of arrays that aren't needed anymore can only be reclaimed by rewriting
+    the arena, see rewrite.
+    """
+
+    def __init__(self, directory, columns, dtype=np.float64):
+        """
+        :param directory: The directory in which the column files are stored.
+        :param columns: List of column names. Each column is stored in the file <directory>/<column>.<dtype>.
+        :param dtype: The numpy dtype of all stored values.
+        """
+        self.directory = directory
+        self.columns = list(columns)
+        self.dtype = np.dtype(dtype)
+        self._maps = {} # Maps column names to their current memory-map
+
+    def column_path(self, column):
+        """
+        Returns the path to the file of the given column.
+        """
+        return os.path.join(self.directory, column + "." + self.dtype.name)
+
+    def append(self, arrays):
+        """
+        Appends one array per column to the arena.
+
+        :param arrays: A dict that maps each column name to the array-like that should be appended to that column.
+        :return: A dict that maps each column name to the offset at which its array was stored.
+        """
+        offsets = {}
+        for column in self.columns:
+            data = np.ascontiguousarray(arrays[column], dtype=self.dtype)
+            with open(self.column_path(column), 'ab') as column_handle:
+                # The offset is determined by the current file size, so a partially appended array (crash) won't shift later ones
+                offsets[column] = column_handle.tell() // self.dtype.itemsize
+                column_handle.seek(offsets[column] * self.dtype.itemsize)
+                column_handle.truncate()
+                column_handle.write(data.tobytes())
+                column_handle.flush()
+                os.fsync(column_handle.fileno())
+        return offsets
+
+    def read(self, column, offset, length):
+        """
+        Returns a read-only view of length elements in the given column, starting at offset.
+        """
+        if length == 0:
+            return np.empty(0, dtype=self.dtype)
+        column_map = self._maps.get(column)
+        if column_map is None or offset + length > len(column_map):
+            # The column's file grew since it was mapped (or it wasn't mapped yet), so map it again
+            column_map = np.memmap(self.column_path(column), dtype=self.dtype, mode='r')
+            self._maps[column] = column_map
+        if offset + length > len(column_map):
+            raise LookupError("Requested array exceeds the size of arena column", self.column_path(column), offset, length)
+        return column_map[offset:offset + length]
+
+    def unmap(self):
+        """
+        Drops all memory-maps, so the column files get mapped again on the next read (e.g. after another process rewrote them).
+        Views returned by read before stay valid, they keep the old mapping alive.
+        """
+        self._maps.clear()
+
+    def rewrite(self, entries):
+        """
+        Rewrites all column files, so they only contain the given arrays (in the given order).
+        Returns a list with new offsets-dicts, one per entry.
+        The new files are written next to the old ones and replace them only at the end.
+
+        :param entries: List of (offsets, length) tuples of arrays to keep, offsets being dicts as returned by append.
+        """
+        new_offsets = [{} for entry in entries]
+        for column in self.columns:
+            tmp_path = self.column_path(column) + ".tmp"
+            with open(tmp_path, 'wb') as tmp_handle:
+                position = 0
+                for i, (offsets, length) in enumerate(entries):
+                    tmp_handle.write(np.asarray(self.read(column, offsets[column], length)).tobytes())
+                    new_offsets[i][column] = position
+                    position += length
+                tmp_handle.flush()
+                os.fsync(tmp_handle.fileno())
+            self._maps.pop(column, None)
+            os.replace(tmp_path, self.column_path(column))
+        return new_offsets
+
+class LRUCache(object):
+    """
+    In-memory cache with a memory budget in bytes, which evicts the least recently used objects first.
+    Since the cache can't know how much memory an object needs, a size_function has to estimate it.
+    Objects that are bigger than the complete budget aren't cached at all.
+    The cache counts hits, misses and evictions, see stats.
+    """
+
+    def __init__(self, max_bytes, size_function):
+        """
+        :param max_bytes: The memory budget of the cache in bytes. If 0, nothing is cached.
+        :param size_function: Function that returns the estimated size of an object in bytes.
+        """
+        self.max_bytes = max_bytes
+        self.size_function = size_function
+        self.nr_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._objects = collections.OrderedDict() # Maps keys to (object, size) tuples, least recently used first
+
+    def __len__(self):
+        """
+        Returns the number of cached objects.
+        """
+        return len(self._objects)
+
+    def __contains__(self, key):
+        """
+        Returns whether an object is cached at key, without counting it as hit or miss.
+        """
+        return key in self._objects
+
+    def get(self, key):
+        """
+        Returns the object cached at key and marks it as recently used, or returns None if there is none.
+        """
+        if not key in self._objects:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._objects.move_to_end(key)
+        return self._objects[key][0]
+
+    def put(self, key, obj):
+        """
+        Caches obj at key, evicting least recently used objects until it fits into the budget.
+        """
+        self.discard(key)
+        size = self.size_function(obj)
+        if size > self.max_bytes:
+            return
+        while self.nr_bytes + size > self.max_bytes:
+            evicted_key, (evicted_obj, evicted_size) = self._objects.popitem(last=False)
+            self.nr_bytes -= evicted_size
+            self.evictions += 1
+        self._objects[key] = (obj, size)
+        self.nr_bytes += size
+
+    def discard(self, key):
+        """
+        Removes the object at key from the cache, if it's there.
+        """
+        if key in self._objects:
+            obj, size = self._objects.pop(key)
+            self.nr_bytes -= size
+
+    def clear(self):
+        """
+        Removes all objects from the cache.
+        """
+        self._objects.clear()
+        self.nr_bytes = 0
+
+    @property
+    def stats(self):
+        """
+        Returns a dict with the cache's hits, misses, evictions, number of cached objects and their estimated size in bytes.
+        """
+        return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                'objects': len(self._objects), 'bytes': self.nr_bytes}
+
+class NeighbourIndex(object):
+    """
+    Spatial index that finds the nearest point within a tolerance, among the points of the same group.
+    Each group's points are kept in a KD-tree, so queries take logarithmic time in the number of points.
+    Points that are added or removed after a group's tree was built are kept aside and checked linearly,
+    until there are more than rebuild_threshold of them. Then the group's tree is built again.
+    """
+
+    def __init__(self, rebuild_threshold=256):
+        """
+        :param rebuild_threshold: Number of changes to a group after which its tree is rebuilt.
+        """
+        self.rebuild_threshold = rebuild_threshold
+        self._groups = {} # Maps groups to [tree, tree_ids, added, removed] lists (see _rebuild)
+        self._item_groups = {} # Maps item ids to their group
+
+    def __len__(self):
+        """
+        Returns the number of indexed points.
+        """
+        return len(self._item_groups)
+
+    def add(self, group, item_id, point):
+        """
+        Adds a point to the group, replacing the point of item_id if there already is one.
+        """
+        self.remove(item_id)
+        tree, tree_ids, added, removed = self._groups.setdefault(group, [None, [], {}, set()])
+        added[item_id] = np.asarray(point, dtype=np.float64)
+        self._item_groups[item_id] = group
+        self._maybe_rebuild(group)
+
+    def remove(self, item_id):
+        """
+        Removes the point of item_id, if it's indexed.
+        """
+        group = self._item_groups.pop(item_id, None)
+        if group is None:
+            return
+        tree, tree_ids, added, removed = self._groups[group]
+        if added.pop(item_id, None) is None:
+            removed.add(item_id) # It's in the tree, so it has to be skipped until the tree is rebuilt
+        self._maybe_rebuild(group)
+
+    def nearest(self, group, point, tolerance):
+        """
+        Returns a tuple (item_id, distance) of the group's point that is nearest to point, or None if none is within tolerance.
+        """
+        if not group in self._groups:
+            return None
+        tree, tree_ids, added, removed = self._groups[group]
+        point = np.asarray(point, dtype=np.float64)
+        best = None
+        if tree is not None:
+            # Query enough neighbours that at least one of them wasn't removed
+            k = min(len(tree_ids), len(removed) + 1)
+            distances, indices = tree.query(point, k=[i + 1 for i in range(k)], distance_upper_bound=tolerance)
+            for distance, index in zip(distances, indices):
+                if np.isfinite(distance) and not tree_ids[index] in removed:
+                    best = (tree_ids[index], float(distance))
+                    break
+        for item_id, added_point in added.items():
+            distance = float(np.linalg.norm(added_point - point))
+            if distance <= tolerance and (best is None or distance < best[1]):
+                best = (item_id, distance)
+        return best
+
+    def _maybe_rebuild(self, group):
+        """
+        Rebuilds the group's tree from all of its current points, if it changed more than rebuild_threshold times.
+        """
+        tree, tree_ids, added, removed = self._groups[group]
+        if len(added) + len(removed) <= self.rebuild_threshold:
+            return
+        points = [tree.data[i] for i, item_id in enumerate(tree_ids) if not item_id in removed] if tree is not None else []
+        tree_ids = [item_id for item_id in tree_ids if not item_id in removed] + list(added.keys())
+        points += list(added.values())
+        if len(tree_ids) == 0:
+            del self._groups[group]
+            return
+        self._groups[group] = [cKDTree(np.array(points)), tree_ids, {}, set()]
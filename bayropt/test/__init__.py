@@ -1,3 +1,3 @@
-from .test_sample_sources import TestDatabase
+from .test_sample_sources import TestDatabase, TestArenaDatabase, TestSQLiteDatabase
 
-__all__ = ["TestDatabase"]
+__all__ = ["TestDatabase", "TestArenaDatabase", "TestSQLiteDatabase"]
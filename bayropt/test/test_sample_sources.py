@@ -1,10 +1,79 @@
 from unittest import TestCase
 import os
+import sys
 import shutil
+import pickle
+import subprocess
+import multiprocessing
+import concurrent.futures
+import time
+import numpy as np
 
-from bayropt import SampleDatabase
+from bayropt import SampleDatabase, ArenaSampleDatabase, SQLiteSampleDatabase, PoolSampleSource, MapMatcherFakeSource, MapMatcherScriptSource, MapMatcherSample, SuccessiveHalving, EarlyStopping, with_fidelity
+from bayropt.performance_measures import NrMatchesMeasure, LogisticTranslationErrorMeasure
+from bayropt.objective_function import ObjectiveFunction
+from bayropt.job_queue import JobQueue, QueueSampleSource, run_worker
+
+def _add_samples_in_process(database_type, database_path, sample_dir_path, x1_values):
+    sample_db = database_type(database_path, sample_dir_path, MapMatcherFakeSource(), compaction_interval=3)
+    for x1 in x1_values:
+        sample_db[{'x1': float(x1), 'x2': 2.0}]
+
+class _CountingSource(MapMatcherFakeSource):
+    """
+    Slow MapMatcherFakeSource that appends the x1 of each generated sample to a file, to count the generations of all processes.
+    """
+    def __init__(self, count_path):
+        self.count_path = count_path
+
+    def __getitem__(self, params_dict):
+        time.sleep(0.3)
+        with open(self.count_path, 'a') as count_file:
+            count_file.write(str(params_dict['x1']) + "\n")
+        return super().__getitem__(params_dict)
+
+def _request_in_process(database_type, database_path, sample_dir_path, count_path, params_dict):
+    database_type(database_path, sample_dir_path, _CountingSource(count_path))[params_dict]
+
+def _run_queue_worker(database_type, database_path, sample_dir_path, queue_path, max_jobs):
+    sample_db = database_type(database_path, sample_dir_path, MapMatcherFakeSource())
+    run_worker(JobQueue(queue_path), sample_db, MapMatcherFakeSource(), poll_interval=0.1, max_jobs=max_jobs)
+
+STREAMING_INTERFACE = """
+import os
+import json
+import datetime
+
+def generate_sample(params_dict, config):
+    raise RuntimeError("Only streaming is supported")
+
+def stream_sample(params_dict, config):
+    try:
+        for i in range(10):
+            yield (i + 1) / 10, [params_dict['x1']] * 5, [0.0] * 5
+    except GeneratorExit:
+        open(os.path.join(config['results_dir'], "closed_" + str(params_dict['x1'])), 'w').close()
+        raise
+    results_path = os.path.join(config['results_dir'], "results_" + str(params_dict['x1']))
+    os.mkdir(results_path)
+    with open(os.path.join(results_path, "params.json"), 'w') as params_file:
+        json.dump(params_dict, params_file)
+    return results_path
+
+def create_objective_function_sample(results_path, sample, config):
+    with open(os.path.join(results_path, "params.json")) as params_file:
+        params_dict = json.load(params_file)
+    sample.translation_errors = [params_dict['x1']] * 50
+    sample.rotation_errors = [0.0] * 50
+    sample.duration = datetime.timedelta(0)
+    return params_dict
+"""
 
 class TestDatabase(TestCase):
+    database_type = SampleDatabase
+    database_file = "sample_db.pkl"
+    journaled = True # Whether the database type uses a Journal
+
     def setUp(self):
         # Get the dir in which this file resides
         self.test_path = os.path.dirname(os.path.realpath(__file__))
@@ -15,12 +84,610 @@ class TestDatabase(TestCase):
         os.mkdir(self.test_path)
         os.mkdir(os.path.join(self.test_path, "samples"))
         # finally, create sample db object to test with
-        self.sample_db = SampleDatabase(os.path.join(self.test_path, "sample_db.pkl"), os.path.join(self.test_path, "samples"), None)
+        self.sample_db = self._open_db()
 
     def tearDown(self):
         shutil.rmtree(self.test_path) # delete the workdir again
 
+    def _open_db(self, **kwargs):
+        return self.database_type(os.path.join(self.test_path, self.database_file), os.path.join(self.test_path, "samples"), MapMatcherFakeSource(), **kwargs)
+
     def test_creation(self):
         self.assertTrue(isinstance(self.sample_db, SampleDatabase))
         self.assertTrue(os.path.isdir(os.path.join(self.test_path, "samples")))
-        self.assertTrue(os.path.isfile(os.path.join(self.test_path, "sample_db.pkl")))
+        self.assertTrue(os.path.isfile(os.path.join(self.test_path, self.database_file)))
+
+    def test_reopen(self):
+        params = [{'x1': float(x1), 'x2': 2.0} for x1 in range(1, 6)]
+        for p in params:
+            self.sample_db[p]
+        self.sample_db.remove_sample(SampleDatabase.dict_hash(params[0]))
+        reopened_db = self._open_db()
+        self.assertEqual(len(reopened_db), 4)
+        self.assertFalse(reopened_db.exists(params[0]))
+        self.assertEqual(list(reopened_db[params[1]].translation_errors), list(self.sample_db[params[1]].translation_errors))
+
+    def test_select(self):
+        for x1 in range(1, 6):
+            for x2 in range(1, 4):
+                self.sample_db[{'x1': float(x1), 'x2': float(x2), 'x3': 1}]
+        self.sample_db[{'x1': 1.0, 'x2': 1.0, 'x3': 2}]
+        self.sample_db[{'x1': 1.0, 'x2': 1.0}]
+        self.sample_db[{'x1': 1.0, 'x2': 1.0, 'x3': 1, 'x4': 0}]
+        selected = [p for s, p in self.sample_db.select({'x2': 2.0, 'x3': 1}, {'x1': (2, 4)})]
+        self.assertEqual(sorted(p['x1'] for p in selected), [2.0, 3.0, 4.0])
+        self.assertTrue(all(p['x2'] == 2.0 and p['x3'] == 1 for p in selected))
+        # Fixed parameters may be missing, free parameters are required
+        selected = [p for s, p in self.sample_db.select({'x2': 1.0, 'x3': 1}, {'x1': None})]
+        self.assertEqual(len(selected), 6)
+        self.assertEqual(len(list(self.sample_db.select({'x1': 1.0, 'x2': 1.0, 'x3': 1}, {'x5': None}))), 0)
+
+    def test_sample_cache(self):
+        params = {'x1': 1.0, 'x2': -3.0}
+        sample = self.sample_db[params] # generates the sample, miss
+        self.assertIs(self.sample_db[params], sample) # hit
+        self.assertEqual(self.sample_db.cache_stats['hits'], 1)
+        # A budget that only fits one sample evicts the least recently used one
+        self.sample_db = self._open_db(cache_size=SampleDatabase._sample_size(sample) + 1)
+        self.sample_db[params]
+        self.sample_db[{'x1': 3.0, 'x2': -3.0}] # smaller sample
+        self.sample_db[params]
+        self.assertEqual(self.sample_db.cache_stats['hits'], 0)
+        self.assertEqual(self.sample_db.cache_stats['evictions'], 2)
+        # Removed samples are removed from the cache as well
+        self.sample_db.remove_sample(SampleDatabase.dict_hash(params))
+        self.assertEqual(self.sample_db.cache_stats['objects'], 0)
+
+    def test_summaries(self):
+        params = {'x1': 4.0, 'x2': -3.0}
+        sample = self.sample_db[params]
+        summary = self.sample_db.summary(params)
+        self.assertEqual(summary.nr_matches, sample.nr_matches)
+        self.assertEqual(summary.translation_error_stats['max'], max(sample.translation_errors))
+        self.assertEqual(sum(summary.translation_error_stats['histogram'][0]), sample.nr_matches)
+        self.assertEqual(NrMatchesMeasure(10)(summary), NrMatchesMeasure(10)(sample))
+        # Summaries of db entries without a summary (older versions) are calculated once
+        params_hashed = SampleDatabase.dict_hash(params)
+        db_entry = self.sample_db._get_entry(params_hashed)
+        del db_entry['summary']
+        self.sample_db._save(('add', params_hashed, db_entry))
+        self.assertEqual([s.nr_matches for s, p in self._open_db().summaries()], [sample.nr_matches])
+        self.assertTrue('summary' in self._open_db()._get_entry(params_hashed))
+
+    def test_lazy_handles(self):
+        for x1 in range(1, 6):
+            self.sample_db[{'x1': float(x1), 'x2': -3.0}]
+        reopened_db = self._open_db()
+        handles = [s for s, p in reopened_db]
+        self.assertEqual(len(handles), 5)
+        self.assertFalse(any(h.loaded for h in handles))
+        self.assertEqual(sorted(h.nr_matches for h in handles), sorted(s.nr_matches for s, p in self.sample_db))
+        self.assertFalse(any(h.loaded for h in handles)) # nr_matches is taken from the summary
+        handle = handles[0]
+        self.assertEqual(list(handle.translation_errors), list(self.sample_db[handle.params_dict].translation_errors))
+        self.assertTrue(handle.loaded)
+        self.assertEqual(sorted(h for h, p in reopened_db.iter_params()), sorted(h.params_hashed for h in handles))
+
+    def test_load_many(self):
+        for x1 in range(1, 6):
+            self.sample_db[{'x1': float(x1), 'x2': -3.0}]
+        keys = sorted(h for h, p in self.sample_db.iter_params())
+        expected = [list(self.sample_db[self.sample_db._get_entry(k)['params_dict']].translation_errors) for k in keys]
+        for loader_pool in ['thread', 'process']:
+            reopened_db = self._open_db(loader_workers=2, loader_pool=loader_pool, cache_size=0)
+            self.assertEqual([list(s.translation_errors) for s in reopened_db.load_many(keys)], expected)
+            handles = list(reopened_db.iter_parallel())
+            self.assertTrue(all(h.loaded for h, p in handles))
+            self.assertEqual([p for h, p in handles], [p for h, p in reopened_db]) # Same order as __iter__
+        with self.assertRaises(LookupError):
+            self.sample_db.load_many(["nonexistent"])
+
+    def test_add_samples(self):
+        params_dicts = [{'x1': float(x1), 'x2': -3.0} for x1 in range(1, 6)]
+        generator = MapMatcherFakeSource()
+        samples = []
+        for params_dict in params_dicts:
+            sample = generator[params_dict]
+            sample.name = "batch_" + str(int(params_dict['x1']))
+            samples.append((sample, params_dict))
+        keys = self.sample_db.add_samples(samples)
+        self.assertEqual(keys, [SampleDatabase.dict_hash(p) for p in params_dicts])
+        reopened_db = self._open_db()
+        self.assertEqual(len(reopened_db), 5)
+        for sample, params_dict in samples:
+            self.assertTrue(reopened_db.exists(params_dict))
+            self.assertEqual(list(reopened_db[params_dict].translation_errors), list(sample.translation_errors))
+        # Nothing gets registered if the batch contains an existing sample
+        with self.assertRaises(LookupError):
+            reopened_db.add_samples([(generator[{'x1': 6.0, 'x2': -3.0}], {'x1': 6.0, 'x2': -3.0}), samples[0]])
+        self.assertEqual(len(self._open_db()), 5)
+        # Duplicates within a batch are rejected, even if existing samples may be overridden
+        with self.assertRaises(LookupError):
+            reopened_db.add_samples([samples[0], samples[0]], override_existing=True)
+        renamed_sample = generator[{'x1': 7.0, 'x2': -3.0}]
+        renamed_sample.name = samples[1][0].name
+        with self.assertRaises(LookupError):
+            reopened_db.add_samples([samples[1], (renamed_sample, {'x1': 7.0, 'x2': -3.0})], override_existing=True)
+        self.assertEqual(len(self._open_db()), 5)
+
+    def test_shared_access(self):
+        other_db = self._open_db(compaction_interval=3)
+        self.sample_db[{'x1': 1.0, 'x2': 2.0}]
+        self.assertTrue(other_db.exists({'x1': 1.0, 'x2': 2.0})) # Picks up entries added by others
+        for x1 in range(2, 6):
+            other_db[{'x1': float(x1), 'x2': 2.0}] # Compacts the journal on the way
+        self.assertEqual(len(self.sample_db), 5)
+        self.sample_db.remove_sample(SampleDatabase.dict_hash({'x1': 1.0, 'x2': 2.0}))
+        self.assertEqual(len(other_db), 4)
+        self.assertEqual(len(self._open_db()), 4)
+
+    def test_no_lost_updates(self):
+        stale_db = self._open_db() # Doesn't know about samples added after this, until it's refreshed
+        for db, name in [(self.sample_db, "first"), (stale_db, "second")]:
+            sample = MapMatcherSample()
+            sample.translation_errors = [1.0]
+            sample.rotation_errors = [0.0]
+            sample.name = name
+            if db is stale_db:
+                with self.assertRaises(LookupError):
+                    db.add_sample(sample, {'x1': 1.0})
+            else:
+                db.add_sample(sample, {'x1': 1.0})
+        self.assertEqual(self._open_db()._get_entry(SampleDatabase.dict_hash({'x1': 1.0}))['pickle_name'], "first")
+        self.assertEqual(self.sample_db.check(orphan_age=-1)['orphans'], []) # The second sample's file was removed again
+
+    def test_concurrent_processes(self):
+        database_path = os.path.join(self.test_path, self.database_file)
+        processes = [multiprocessing.Process(target=_add_samples_in_process,
+                                             args=(self.database_type, database_path, os.path.join(self.test_path, "samples"), range(i * 5, (i + 1) * 5)))
+                     for i in range(4)]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+            self.assertEqual(process.exitcode, 0)
+        self.assertEqual(len(self.sample_db), 20) # No lost updates
+        self.assertEqual(len(self._open_db()), 20)
+
+    def test_packed_payloads(self):
+        if self.database_type is ArenaSampleDatabase:
+            self.skipTest("Database type doesn't store samples as files.")
+        packed_db = self._open_db(payload_format='packed', payload_compression='lzma', payload_float32=True, cache_size=0)
+        paths = []
+        for db, params in [(self.sample_db, {'x1': 1.0}), (packed_db, {'x1': 2.0})]:
+            sample = MapMatcherSample()
+            sample.translation_errors = list(np.random.RandomState(0).rand(1000))
+            sample.rotation_errors = [0] * 1000
+            sample.name = "sample_" + str(params['x1'])
+            db.add_sample(sample, params)
+            paths.append(db._to_pickle_path(sample.name))
+        self.assertTrue(os.path.getsize(paths[1]) * 3 < os.path.getsize(paths[0]))
+        # Both formats can be read, regardless of the database's payload_format
+        for db in [packed_db, self._open_db(cache_size=0)]:
+            for params in [{'x1': 1.0}, {'x1': 2.0}]:
+                self.assertEqual(db[params].nr_matches, 1000)
+                np.testing.assert_allclose(db[params].translation_errors, np.random.RandomState(0).rand(1000), rtol=1e-6)
+        self.assertEqual(packed_db[{'x1': 2.0}].translation_errors.dtype, np.float32)
+        with self.assertRaises(ValueError):
+            self._open_db(payload_format='zip')
+
+    def test_sharding(self):
+        if self.database_type is ArenaSampleDatabase:
+            self.skipTest("Database type doesn't store samples as files.")
+        for x1 in range(1, 4):
+            self.sample_db[{'x1': float(x1), 'x2': -3.0}] # Stored in the flat sample_dir
+        sharded_db = self._open_db(shard_levels=2, shard_width=1)
+        sharded_db[{'x1': 4.0, 'x2': -3.0}]
+        pickle_name = sharded_db._get_entry(SampleDatabase.dict_hash({'x1': 4.0, 'x2': -3.0}))['pickle_name']
+        pickle_path = sharded_db._to_pickle_path(pickle_name)
+        self.assertTrue(os.path.isfile(pickle_path))
+        self.assertEqual(os.path.relpath(pickle_path, os.path.join(self.test_path, "samples")).count(os.sep), 2)
+        self.assertEqual(len(os.listdir(os.path.join(self.test_path, "samples"))), 4) # 3 flat files, 1 shard directory
+        # Flat samples are still found, until they're migrated
+        expected_nr_matches = [s.nr_matches for s, p in self.sample_db]
+        self.assertEqual([s.nr_matches for s in sharded_db.load_many([h for h, p in sharded_db.iter_params()])], expected_nr_matches)
+        self.assertEqual(sharded_db.migrate_sample_files(), 3)
+        self.assertEqual(sharded_db.migrate_sample_files(), 0)
+        self.assertTrue(all(os.path.isdir(os.path.join(self.test_path, "samples", f)) for f in os.listdir(os.path.join(self.test_path, "samples"))))
+        self.assertEqual([s.nr_matches for s in self._open_db(shard_levels=2, shard_width=1, cache_size=0).load_many([h for h, p in sharded_db.iter_params()])],
+                         expected_nr_matches)
+        sharded_db.remove_sample(SampleDatabase.dict_hash({'x1': 4.0, 'x2': -3.0}))
+        self.assertFalse(os.path.exists(pickle_path))
+
+    def test_check(self):
+        params = [{'x1': float(x1), 'x2': -3.0} for x1 in range(1, 6)]
+        expected_nr_matches = [self.sample_db[p].nr_matches for p in params]
+        duplicate_nr_matches = expected_nr_matches[2]
+        self.assertTrue(all(len(affected) == 0 for affected in self.sample_db.check().values()))
+        self.sample_db.remove_sample(SampleDatabase.dict_hash(params[0]))
+        if self.database_type is not ArenaSampleDatabase:
+            samples_path = os.path.join(self.test_path, "samples")
+            missing_entry = self.sample_db._get_entry(SampleDatabase.dict_hash(params[1]))
+            os.remove(self.sample_db._to_pickle_path(missing_entry['pickle_name']))
+            for name in ["orphan", "fresh"]:
+                with open(os.path.join(samples_path, name + ".pkl"), 'wb') as orphan_handle:
+                    pickle.dump(MapMatcherSample(), orphan_handle)
+            os.utime(os.path.join(samples_path, "orphan.pkl"), (0, 0)) # Files that were just written aren't orphans yet
+            # A second entry for the same sample file and an entry at the wrong key
+            duplicate_entry = dict(self.sample_db._get_entry(SampleDatabase.dict_hash(params[2])), params_dict={'x1': 9.0, 'x2': -3.0})
+            self.sample_db._save(('add', SampleDatabase.dict_hash(duplicate_entry['params_dict']), duplicate_entry))
+            wrong_key_entry = self.sample_db._get_entry(SampleDatabase.dict_hash(params[3]))
+            self.sample_db._save(('batch', [('remove', SampleDatabase.dict_hash(params[3])), ('add', "wrong_key", wrong_key_entry)]))
+            report = self.sample_db.check()
+            self.assertEqual(report['missing'], [SampleDatabase.dict_hash(params[1])])
+            self.assertEqual(report['orphans'], [os.path.join(samples_path, "orphan.pkl")])
+            self.assertEqual(report['duplicates'], [SampleDatabase.dict_hash(params[2])])
+            self.assertEqual(report['wrong_keys'], ["wrong_key"])
+            expected_nr_matches[2] = None # Only the duplicate entry (at x1 = 9) is kept
+        self.sample_db.check(repair=True)
+        self.assertTrue(all(len(affected) == 0 for affected in self.sample_db.check().values()))
+        reopened_db = self._open_db(cache_size=0)
+        for p, nr_matches in zip(params, expected_nr_matches):
+            if nr_matches is None or not reopened_db.exists(p):
+                continue
+            self.assertEqual(reopened_db[p].nr_matches, nr_matches)
+        self.assertEqual(len(reopened_db), 4 if self.database_type is ArenaSampleDatabase else 3)
+        if self.database_type is ArenaSampleDatabase: # The removed sample's errors are gone from the arena
+            self.assertEqual(os.path.getsize(reopened_db._arena.column_path('translation_errors')) // 8, sum(expected_nr_matches[1:]))
+        else:
+            self.assertEqual(reopened_db[{'x1': 9.0, 'x2': -3.0}].nr_matches, duplicate_nr_matches)
+            self.assertTrue(reopened_db.exists(params[3]))
+
+    def test_cache_picks_up_replaced_entries(self):
+        params = {'x1': 1.0, 'x2': -3.0}
+        self.assertEqual(self.sample_db[params].nr_matches, 3)
+        other_db = self._open_db()
+        sample = MapMatcherSample()
+        sample.translation_errors = [1.0] * 7
+        sample.rotation_errors = [0.0] * 7
+        sample.name = "replacement"
+        other_db.add_sample(sample, params, override_existing=True)
+        self.assertEqual(self.sample_db[params].nr_matches, 7) # Not the cached sample anymore
+
+    def test_bundles(self):
+        params = [{'x1': float(x1), 'x2': -3.0} for x1 in range(1, 6)]
+        for p in params:
+            self.sample_db[p]
+        bundle_paths = self.sample_db.export_bundle(os.path.join(self.test_path, "bundle.npz"), samples_per_file=2)
+        self.assertEqual(len(bundle_paths), 3)
+        subset_paths = self.sample_db.export_bundle(os.path.join(self.test_path, "subset"), keys=[SampleDatabase.dict_hash(params[0])])
+        self.assertEqual(subset_paths, [os.path.join(self.test_path, "subset-0000.npz")])
+        # Import into a new database, which already contains one of the samples
+        os.mkdir(os.path.join(self.test_path, "other_samples"))
+        other_db = self.database_type(os.path.join(self.test_path, "other_" + self.database_file), os.path.join(self.test_path, "other_samples"), MapMatcherFakeSource())
+        self.assertEqual(other_db.import_bundle(subset_paths[0]), [SampleDatabase.dict_hash(params[0])])
+        imported = [key for bundle_path in bundle_paths for key in other_db.import_bundle(bundle_path)]
+        self.assertEqual(sorted(imported), sorted(SampleDatabase.dict_hash(p) for p in params[1:]))
+        self.assertEqual(len(other_db), 5)
+        for p in params:
+            self.assertEqual(list(other_db[p].translation_errors), list(self.sample_db[p].translation_errors))
+            self.assertEqual(other_db.summary(p).nr_matches, self.sample_db[p].nr_matches)
+        with self.assertRaises(LookupError):
+            other_db.import_bundle(subset_paths[0], skip_existing=False)
+
+    def test_score_cache(self):
+        for x1 in range(1, 6):
+            self.sample_db[{'x1': float(x1), 'x2': -3.0}]
+        default_params, design_space = {'x1': 1.0, 'x2': -3.0}, {'x1': (0, 10)}
+        values = sorted(y for x, y, s in ObjectiveFunction(self.sample_db, LogisticTranslationErrorMeasure(400.0), default_params, design_space))
+        # The scores are cached per measure configuration, and survive reopening the database
+        measure = LogisticTranslationErrorMeasure.from_dict({'type': 'LogisticTranslationErrorMeasure', 'max_relevant_error': 400.0})
+        obj_function = ObjectiveFunction(self._open_db(), measure, default_params, design_space)
+        rated = list(obj_function)
+        self.assertEqual(sorted(y for x, y, s in rated), values)
+        self.assertFalse(any(s.loaded for x, y, s in rated))
+        # Changing the configuration means the samples have to be rated again
+        obj_function = ObjectiveFunction(self._open_db(), LogisticTranslationErrorMeasure(800.0), default_params, design_space)
+        rated = list(obj_function)
+        self.assertTrue(all(s.loaded for x, y, s in rated))
+        self.assertNotEqual(sorted(y for x, y, s in rated), values)
+        # Replacing a sample discards its scores
+        self.sample_db.add_sample(self.sample_db[default_params], default_params, override_existing=True)
+        self.assertEqual(next(self._open_db().select(default_params, {}))[0].scores, {})
+
+    def test_add_parameter(self):
+        params = [{'x1': float(x1), 'x2': -3.0} for x1 in range(1, 6)]
+        samples = [self.sample_db[p] for p in params]
+        self.sample_db[{'x1': 1.0, 'x2': -3.0, 'x3': 2}] # Already has the new parameter
+        self.sample_db[{'x1': 2.0, 'x2': -3.0, 'x3': 1}] # Collides with the patched params of the second sample
+        self.assertEqual(self.sample_db.add_parameter('x3', 1), 4)
+        reopened_db = self._open_db()
+        self.assertEqual(len(reopened_db), 7)
+        self.assertFalse(reopened_db.exists(params[0]))
+        self.assertTrue(reopened_db.exists(params[1]))
+        for p, sample in zip(params[2:], samples[2:]):
+            patched_params = dict(p, x3=1)
+            self.assertEqual(list(reopened_db[patched_params].translation_errors), list(sample.translation_errors))
+            self.assertEqual(reopened_db.summary(patched_params).nr_matches, sample.nr_matches)
+        self.assertEqual(len(list(reopened_db.select({'x2': -3.0, 'x3': 1}, {'x1': None}))), 6) # Includes the unpatched one
+        # Running it again only patches what's left
+        self.assertEqual(reopened_db.add_parameter('x3', 1), 0)
+
+    def test_nearest(self):
+        for x1 in range(1, 6):
+            self.sample_db[{'x1': float(x1), 'x2': -3.0}]
+        scales = {'x1': 0.1}
+        sample, params_dict = self.sample_db.nearest({'x1': 2.04, 'x2': -3.0}, scales, 0.01)
+        self.assertEqual(params_dict, {'x1': 2.0, 'x2': -3.0})
+        self.assertEqual(sample.params_hashed, SampleDatabase.dict_hash(params_dict))
+        self.assertIsNone(self.sample_db.nearest({'x1': 2.04, 'x2': -3.0}, scales, 0.001))
+        self.assertIsNone(self.sample_db.nearest({'x1': 2.0, 'x2': -2.0}, scales, 0.01)) # Other params have to be identical
+        # The index picks up samples that are added or removed afterwards, also by other processes
+        other_db = self._open_db()
+        other_db[{'x1': 2.05, 'x2': -3.0}]
+        self.assertEqual(self.sample_db.nearest({'x1': 2.04, 'x2': -3.0}, scales, 0.01)[1]['x1'], 2.05)
+        other_db.remove_sample(SampleDatabase.dict_hash({'x1': 2.05, 'x2': -3.0}))
+        self.assertEqual(self.sample_db.nearest({'x1': 2.04, 'x2': -3.0}, scales, 0.01)[1]['x1'], 2.0)
+        # The objective function reuses neighbours instead of generating new samples
+        obj_function = ObjectiveFunction(self.sample_db, NrMatchesMeasure(10), {'x1': 1.0, 'x2': -3.0}, {'x1': (0, 10)},
+                                         normalization=False, neighbour_tolerance=0.01)
+        self.assertEqual(obj_function.evaluate(x1=2.04), NrMatchesMeasure(10)(self.sample_db[{'x1': 2.0, 'x2': -3.0}]))
+        self.assertEqual(len(self.sample_db), 5)
+        obj_function.evaluate(x1=2.5)
+        self.assertEqual(len(self.sample_db), 6)
+
+    def test_submit(self):
+        pool = PoolSampleSource(MapMatcherFakeSource(), workers=2)
+        sample_db = self.database_type(os.path.join(self.test_path, self.database_file), os.path.join(self.test_path, "samples"), pool)
+        try:
+            self.sample_db[{'x1': 1.0, 'x2': -3.0}]
+            params = [{'x1': float(x1), 'x2': -3.0} for x1 in range(1, 6)]
+            futures = [sample_db.submit(p) for p in params]
+            self.assertTrue(futures[0].done()) # Existed already
+            self.assertIs(pool.submit(params[1]), pool.submit(params[1])) # Running generations are shared
+            samples = [future.result() for future in futures]
+            self.assertEqual(len(self._open_db()), 5)
+            for p, sample in zip(params, samples):
+                self.assertEqual(list(self.sample_db[p].translation_errors), list(sample.translation_errors))
+            # __getitem__ generates through the pool as well
+            self.assertEqual(sample_db[{'x1': 6.0, 'x2': -3.0}].nr_matches, MapMatcherFakeSource()[{'x1': 6.0, 'x2': -3.0}].nr_matches)
+            # The objective function dispatches batches to the pool
+            obj_function = ObjectiveFunction(sample_db, NrMatchesMeasure(10), {'x1': 1.0, 'x2': -3.0}, {'x1': (0, 10)}, normalization=False)
+            values = obj_function.evaluate_batch([{'x1': 7.0}, {'x1': 8.0}, {'x1': 7.0}])
+            self.assertEqual(values, [NrMatchesMeasure(10)(self.sample_db[{'x1': x1, 'x2': -3.0}]) for x1 in [7.0, 8.0, 7.0]])
+            self.assertEqual(len(sample_db), 8)
+            futures = [obj_function.submit(x1=x1) for x1 in [9.0, 8.0]]
+            self.assertEqual([future.result() for future in futures], [NrMatchesMeasure(10)(self.sample_db[{'x1': x1, 'x2': -3.0}]) for x1 in [9.0, 8.0]])
+        finally:
+            pool.shutdown()
+
+    def test_censored_samples(self):
+        interface_path = os.path.join(self.test_path, "slow_interface.py")
+        with open(interface_path, 'w') as interface_file:
+            interface_file.write("import time\ndef generate_sample(params_dict, config):\n    time.sleep(60)\n")
+        script_source = MapMatcherScriptSource({'interface_module': interface_path, 'timeout': 0.5})
+        sample_db = self.database_type(os.path.join(self.test_path, self.database_file), os.path.join(self.test_path, "samples"), script_source)
+        self.sample_db[{'x1': 1.0, 'x2': -3.0}]
+        # Evaluations that exceed their budget are killed and scored with the penalty
+        obj_function = ObjectiveFunction(sample_db, NrMatchesMeasure(10), {'x1': 1.0, 'x2': -3.0}, {'x1': (0, 10)}, normalization=False)
+        self.assertEqual(obj_function.evaluate(x1=2.0), 0)
+        reopened_db = self._open_db()
+        self.assertEqual(len(reopened_db), 2)
+        censored_sample = reopened_db[{'x1': 2.0, 'x2': -3.0}]
+        self.assertEqual(censored_sample.censored, 'timeout')
+        self.assertGreaterEqual(censored_sample.duration.total_seconds(), 0.5)
+        self.assertLess(censored_sample.duration.total_seconds(), 30)
+        # The penalty is configurable, and it's known without loading the samples
+        obj_function = ObjectiveFunction(self._open_db(), NrMatchesMeasure(10), {'x1': 1.0, 'x2': -3.0}, {'x1': (0, 10)},
+                                         normalization=False, censored_penalty=-1)
+        rated = {x['x1']: (y, s) for x, y, s in obj_function}
+        self.assertEqual(rated[2.0][0], -1)
+        self.assertEqual(rated[2.0][1].censored, 'timeout')
+        self.assertIsNone(rated[1.0][1].censored)
+        self.assertFalse(rated[2.0][1].loaded)
+
+    def test_early_stopping(self):
+        interface_path = os.path.join(self.test_path, "streaming_interface.py")
+        with open(interface_path, 'w') as interface_file:
+            interface_file.write(STREAMING_INTERFACE)
+        script_source = MapMatcherScriptSource({'interface_module': interface_path, 'results_dir': self.test_path})
+        measure = LogisticTranslationErrorMeasure(1.0)
+        script_source.early_stopping = EarlyStopping(measure)
+        sample_db = self.database_type(os.path.join(self.test_path, self.database_file), os.path.join(self.test_path, "samples"), script_source)
+        # Without an incumbent, evaluations run until the end
+        self.assertIsNone(sample_db[{'x1': 3.0}].censored)
+        good_sample = sample_db[{'x1': 0.1}]
+        self.assertEqual(good_sample.nr_matches, 50)
+        estimate = script_source.early_stopping.estimate(good_sample.translation_errors[:5], good_sample.rotation_errors[:5], 0.1)
+        self.assertTrue(estimate[1] <= estimate[0] <= estimate[2])
+        self.assertAlmostEqual(estimate[0], measure(good_sample))
+        # Once there's one, hopeless evaluations are stopped at the first check
+        script_source.early_stopping.incumbent = measure(good_sample)
+        self.assertIsNone(sample_db[{'x1': 0.05}].censored)
+        bad_sample = sample_db[{'x1': 5.0}]
+        self.assertEqual(bad_sample.censored, 'early_stop')
+        self.assertEqual(bad_sample.nr_matches, 5)
+        self.assertTrue(os.path.exists(os.path.join(self.test_path, "closed_5.0")))
+        # With a budget, the streaming evaluation runs in a child process, which is killed instead
+        script_source.config['timeout'] = 30
+        self.assertEqual(sample_db[{'x1': 4.0}].censored, 'early_stop')
+        self.assertIsNone(sample_db[{'x1': 0.06}].censored)
+        self.assertEqual(self._open_db().summary({'x1': 4.0}).censored, 'early_stop')
+
+    def test_fidelity(self):
+        obj_function = ObjectiveFunction(self.sample_db, NrMatchesMeasure(10), {'x1': 1.0, 'x2': -3.0}, {'x1': (0, 10)}, normalization=False)
+        scheduler = SuccessiveHalving(obj_function, min_fidelity=1/9, eta=3)
+        self.assertEqual(len(scheduler.fidelities), 3)
+        candidates = [{'x1': float(x1)} for x1 in range(1, 10)]
+        results = scheduler.run(candidates)
+        self.assertEqual(len(results), 1)
+        best_candidate, value = results[0]
+        self.assertEqual(value, obj_function.evaluate(**best_candidate.copy()))
+        # Samples are keyed by fidelity: 9 + 3 + 1, and the full-fidelity one is the same as without multi-fidelity evaluation
+        self.assertEqual(len(self.sample_db), 13)
+        self.assertEqual([x for x, y, s in obj_function], [dict(best_candidate, x2=-3.0)])
+        low_fidelity_params = with_fidelity({'x1': 7.0, 'x2': -3.0}, 1/9)
+        self.assertTrue(self.sample_db.exists(low_fidelity_params))
+        self.assertLess(self.sample_db.summary(low_fidelity_params).nr_matches, MapMatcherFakeSource()[{'x1': 7.0, 'x2': -3.0}].nr_matches)
+        self.assertEqual(with_fidelity(low_fidelity_params, 1), {'x1': 7.0, 'x2': -3.0})
+
+    def test_single_flight(self):
+        count_path = os.path.join(self.test_path, "generations")
+        sample_db = self._open_db()
+        sample_db.sample_generator = _CountingSource(count_path)
+        params = {'x1': 1.0, 'x2': -3.0}
+        # Concurrent requests of threads
+        with concurrent.futures.ThreadPoolExecutor(4) as executor:
+            samples = list(executor.map(lambda i: sample_db[params], range(4)))
+        self.assertTrue(all(list(sample.translation_errors) == list(samples[0].translation_errors) for sample in samples))
+        # Concurrent requests of processes
+        args = (self.database_type, os.path.join(self.test_path, self.database_file), os.path.join(self.test_path, "samples"), count_path)
+        processes = [multiprocessing.Process(target=_request_in_process, args=args + ({'x1': 2.0, 'x2': -3.0},)) for i in range(3)]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+            self.assertEqual(process.exitcode, 0)
+        # Background requests of a database that shares the store wait for the owner's generation
+        other_db = self._open_db()
+        pool = PoolSampleSource(_CountingSource(count_path), workers=2)
+        other_db.sample_generator = pool
+        future = other_db.submit({'x1': 3.0, 'x2': -3.0})
+        waiting_future = sample_db.submit({'x1': 3.0, 'x2': -3.0}) # Has no submit, so it blocks until the generation is done
+        self.assertEqual(list(future.result(timeout=30).translation_errors), list(waiting_future.result().translation_errors))
+        sample_db.sample_generator = pool
+        self.assertEqual(len(other_db.submit({'x1': 3.0, 'x2': -3.0}).result(timeout=30).translation_errors), len(future.result().translation_errors))
+        futures = [other_db.submit({'x1': 4.0, 'x2': -3.0}), sample_db.submit({'x1': 4.0, 'x2': -3.0})]
+        self.assertEqual(len(futures[0].result(timeout=30).translation_errors), len(futures[1].result(timeout=30).translation_errors))
+        pool.shutdown()
+        with open(count_path) as count_file:
+            self.assertEqual(sorted(count_file.read().split()), ['1.0', '2.0', '3.0', '4.0'])
+        self.assertEqual(os.listdir(os.path.join(self.test_path, self.database_file + ".inflight")), [])
+
+    def test_job_queue(self):
+        job_queue = JobQueue(os.path.join(self.test_path, "queue.sqlite"), max_attempts=3)
+        params = {'x1': 1.0, 'x2': -3.0}
+        job_id = job_queue.put(params)
+        self.assertEqual(job_queue.put(params), job_id) # No second job
+        self.assertEqual(job_queue.claim("w1", 60), (job_id, params))
+        self.assertIsNone(job_queue.claim("w2", 60))
+        job_queue.fail(job_id, "w1", "error")
+        self.assertEqual(job_queue.status(job_id)['state'], 'queued') # Retried
+        self.assertEqual(job_queue.claim("w2", -1), (job_id, params)) # Already expired, as if w2 died
+        self.assertFalse(job_queue.renew(job_id, "w1", 60))
+        self.assertEqual(job_queue.claim("w1", 60), (job_id, params)) # Re-queued
+        self.assertFalse(job_queue.renew(job_id, "w2", 60))
+        self.assertTrue(job_queue.renew(job_id, "w1", 60))
+        job_queue.fail(job_id, "w1", "error")
+        self.assertEqual(job_queue.status(job_id), {'state': 'failed', 'attempts': 3, 'worker': None, 'error': "error"})
+        job_queue.put(params)
+        self.assertEqual(job_queue.counts(), {'queued': 1})
+
+    def test_queue_workers(self):
+        queue_path = os.path.join(self.test_path, "queue.sqlite")
+        queue_source = QueueSampleSource(JobQueue(queue_path), poll_interval=0.1)
+        sample_db = self.database_type(os.path.join(self.test_path, self.database_file), os.path.join(self.test_path, "samples"), queue_source)
+        queue_source.database = sample_db
+        params = [{'x1': float(x1), 'x2': -3.0} for x1 in range(1, 5)]
+        futures = [sample_db.submit(p) for p in params]
+        workers = [multiprocessing.Process(target=_run_queue_worker, args=(self.database_type, os.path.join(self.test_path, self.database_file),
+                                                                           os.path.join(self.test_path, "samples"), queue_path, 2))
+                   for i in range(2)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+            self.assertEqual(worker.exitcode, 0)
+        for p, future in zip(params, futures):
+            self.assertEqual(future.result(timeout=10).nr_matches, MapMatcherFakeSource()[p].nr_matches)
+        self.assertEqual(len(self._open_db()), 4)
+        self.assertEqual(queue_source.job_queue.counts(), {'done': 4})
+
+    def test_journal_replay(self):
+        if not self.journaled:
+            self.skipTest("Database type doesn't use a journal.")
+        self.sample_db[{'x1': 1.0, 'x2': 2.0}]
+        # The database file itself hasn't been rewritten, all changes are in the journal
+        self.assertTrue(os.path.getsize(os.path.join(self.test_path, "sample_db.pkl.journal")) > 0)
+        self.assertEqual(len(self._open_db()), 1)
+
+    def test_journal_compaction(self):
+        if not self.journaled:
+            self.skipTest("Database type doesn't use a journal.")
+        self.sample_db = self._open_db(compaction_interval=2)
+        for x1 in range(1, 6):
+            self.sample_db[{'x1': float(x1), 'x2': 2.0}]
+        self.assertTrue(len(self.sample_db._journal) <= 5)
+        self.assertEqual(len(self._open_db()), 5)
+
+    def test_journal_crash_while_writing(self):
+        if not self.journaled:
+            self.skipTest("Database type doesn't use a journal.")
+        self.sample_db[{'x1': 1.0, 'x2': 2.0}]
+        self.sample_db[{'x1': 2.0, 'x2': 2.0}]
+        # Simulate a crash in the middle of appending the last record
+        journal_path = os.path.join(self.test_path, "sample_db.pkl.journal")
+        with open(journal_path, 'r+b') as journal_handle:
+            journal_handle.truncate(os.path.getsize(journal_path) - 3)
+        reopened_db = self._open_db()
+        self.assertEqual(len(reopened_db), 1)
+        # The incomplete record was cut off, so new records are readable again
+        reopened_db[{'x1': 3.0, 'x2': 2.0}]
+        self.assertEqual(len(self._open_db()), 2)
+
+    def test_dict_hash_is_seed_independent(self):
+        params = {'x1': 0.25, 'x2': 5, 'name': "test", 'list': [1, 2.5]}
+        hash_script = "from bayropt import SampleDatabase; print(SampleDatabase.dict_hash(" + repr(params) + "))"
+        hashes = set()
+        for seed in ["1", "2"]:
+            env = dict(os.environ, PYTHONHASHSEED=seed)
+            hashes.add(subprocess.check_output([sys.executable, "-c", hash_script], env=env).decode().strip())
+        self.assertEqual(hashes, {SampleDatabase.dict_hash(params)})
+        # Values that compare equal get the same hash
+        self.assertEqual(SampleDatabase.dict_hash(params),
+                         SampleDatabase.dict_hash({'list': (1.0, np.float64(2.5)), 'name': "test", 'x2': 5.0, 'x1': np.float32(0.25)}))
+        self.assertNotEqual(SampleDatabase.dict_hash(params), SampleDatabase.dict_hash(dict(params, x1=0.26)))
+
+    def test_migrate_old_keys(self):
+        if not self.database_type is SampleDatabase:
+            self.skipTest("Only databases of the SampleDatabase type were created with old keys.")
+        params = {'x1': 1.0, 'x2': 2.0}
+        sample = self.sample_db.sample_generator[params]
+        sample.name = "old_sample"
+        with open(os.path.join(self.test_path, "samples", "old_sample.pkl"), 'wb') as sample_handle:
+            pickle.dump(sample, sample_handle)
+        # Write a database with a key from python's built-in hash function, like older versions did
+        with open(os.path.join(self.test_path, "sample_db.pkl"), 'wb') as db_handle:
+            pickle.dump({hash(frozenset(params.items())): {'pickle_name': "old_sample", 'params_dict': params}}, db_handle)
+        migrated_db = self._open_db()
+        self.assertTrue(migrated_db.exists(params))
+        self.assertEqual(list(migrated_db[params].translation_errors), sample.translation_errors)
+
+class TestArenaDatabase(TestDatabase):
+    database_type = ArenaSampleDatabase
+
+    def test_arena_views(self):
+        params = [{'x1': float(x1), 'x2': -3.0} for x1 in range(1, 6)]
+        for p in params:
+            self.sample_db[p]
+        # No pickle files, only the arena's columns
+        self.assertEqual(sorted(os.listdir(os.path.join(self.test_path, "samples"))), ["rotation_errors.float64", "translation_errors.float64"])
+        reopened_db = self._open_db()
+        for p in params:
+            sample = reopened_db[p]
+            expected_sample = self.sample_db.sample_generator[p]
+            self.assertIsInstance(sample.translation_errors, np.memmap)
+            self.assertEqual(list(sample.translation_errors), expected_sample.translation_errors)
+            self.assertEqual(sample.nr_matches, expected_sample.nr_matches)
+        self.assertEqual([p['x1'] for s, p in reopened_db], [p['x1'] for p in params])
+
+class TestSQLiteDatabase(TestDatabase):
+    database_type = SQLiteSampleDatabase
+    database_file = "sample_db.sqlite"
+    journaled = False
+
+    def test_param_columns(self):
+        self.sample_db[{'x1': 1.0, 'x2': 2.0, 'some/list': [1, 2]}]
+        self.assertEqual(self._open_db()._param_columns, {'x1', 'x2', 'some/list'})
+        self.assertEqual(len(list(self.sample_db.select({'x2': 2.0, 'some/list': [1, 2]}, {'x1': (0, 1)}))), 1)
+        self.assertEqual(len(list(self.sample_db.select({'x2': 2.0, 'some/list': [2, 1]}, {'x1': (0, 1)}))), 0)
+
+    def test_failed_transaction(self):
+        self.sample_db[{'x1': 1.0, 'x2': 2.0}]
+        db_entry = dict(self.sample_db._get_entry(SampleDatabase.dict_hash({'x1': 1.0, 'x2': 2.0})), params_dict={'x1': 1.0, 'x9': 2.0})
+        with self.assertRaises(ValueError):
+            self.sample_db._save(('batch', [('add', SampleDatabase.dict_hash(db_entry['params_dict']), db_entry), ('unknown',)]))
+        # The column added by the failed transaction was rolled back as well
+        self.assertEqual(self.sample_db._param_columns, {'x1', 'x2'})
+        self.assertEqual(self._open_db()._param_columns, {'x1', 'x2'})
+        self.assertEqual(len(self.sample_db), 1)
@@ -16,6 +16,7 @@ import yaml
 import sys
 import shutil # for removing full filetrees
 import itertools
+import concurrent.futures
 from sklearn.gaussian_process.kernels import Matern
 from bayes_opt import BayesianOptimization
 
@@ -65,7 +66,8 @@ class ExperimentCoordinator(object):
         # Setup the sample source
         ###########
         print("Setting up sample source...")
-        use_db = self._params['sample_source']['type'] = "SampleDatabase" # check if sample db is used
+        # check if sample db is used, the type determines which SampleDatabase class should be used
+        use_db = self._params['sample_source']['type'] in ["SampleDatabase", "ArenaSampleDatabase", "SQLiteSampleDatabase"]
         if use_db:
             sample_source_defs = self._params['sample_source']['config']['sample_generator']
         else:
@@ -81,10 +83,26 @@ class ExperimentCoordinator(object):
             sample_generator = bayropt.MapMatcherFakeSource()
         else:
             raise ValueError("Unknown sample source type", sample_source_defs['type'])
+        if 'workers' in sample_source_defs:
+            # Let a pool of worker processes generate samples, so several of them can be generated at once
+            sample_generator = bayropt.PoolSampleSource(sample_generator, sample_source_defs['workers'])
+        # The generator that actually runs the evaluations, also used by queue workers (see --queue-worker)
+        self.job_generator = sample_generator
+        self.job_queue = None
+        if 'queue' in sample_source_defs:
+            # Let independent workers (possibly on other machines) generate the samples, see bayropt.job_queue
+            self.job_queue = bayropt.JobQueue(self._resolve_relative_path(sample_source_defs['queue']['path']),
+                                              sample_source_defs['queue'].get('max_attempts', 3))
+            sample_generator = bayropt.QueueSampleSource(self.job_queue, sample_source_defs['queue'].get('poll_interval', 10))
         if use_db:
             database_path = self._resolve_relative_path(self._params['sample_source']['config']['database_path'])
             sample_directory_path = self._resolve_relative_path(self._params['sample_source']['config']['sample_directory'])
-            self.sample_db = bayropt.SampleDatabase(database_path, sample_directory_path, sample_generator)
+            sample_database_type = getattr(bayropt, self._params['sample_source']['type'])
+            # Optional keyword arguments for the database, e.g. its cache_size
+            database_options = self._params['sample_source']['config'].get('options', {})
+            self.sample_db = sample_database_type(database_path, sample_directory_path, sample_generator, **database_options)
+            if self.job_queue is not None:
+                sample_generator.database = self.sample_db # The workers add the samples to this database
         else:
             print("\tWARNING: Not using sample db, plots will probably crash now")
             self.sample_db = sample_generator
@@ -98,7 +116,15 @@ class ExperimentCoordinator(object):
         self.obj_function = bayropt.ObjectiveFunction(self.sample_db, self.performance_measure,
                                                       default_params, self.opt_bounds(),
                                                       self._params['rounding_decimal_places'],
-                                                      normalization=self._params['normalize'])
+                                                      normalization=self._params['normalize'],
+                                                      neighbour_tolerance=self._params.get('neighbour_tolerance', 0),
+                                                      censored_penalty=self._params.get('censored_penalty'))
+        # Abort evaluations that can't beat the best known sample anymore, if the interface module streams partial results
+        self.early_stopping = None
+        script_source = getattr(self.job_generator, 'sample_generator', self.job_generator) # Unwrap a PoolSampleSource
+        if 'early_stopping' in self._params and hasattr(script_source, 'early_stopping'):
+            self.early_stopping = bayropt.EarlyStopping(self.performance_measure, **self._params['early_stopping'])
+            script_source.early_stopping = self.early_stopping
         ###########
         # Create an BayesianOptimization object, that contains the GPR logic.
         # Will supply us with new param-samples and will try to model the map matcher metric function.
@@ -375,6 +401,14 @@ class ExperimentCoordinator(object):
         self.iteration = state_dict['iteration']
         self.best_samples = state_dict['best_samples']
         self.max_performance_measure = state_dict['max_performance_measure']
+        if self.early_stopping is not None:
+            self.early_stopping.incumbent = self.max_performance_measure
+
+    def _scores(self, samples, performance_measure):
+        """
+        Returns a list with the values of performance_measure for the samples, using the scores cached in the sample database.
+        """
+        return [y for s, x, y in self.obj_function.scores([(s, None) for s in samples], performance_measure)]
 
     def _samples_plot(self, x_axis_ticks, samples, x_axis_pos=None, show_pm_values=True, bar_width=1, xticklabels_spacing=1):
         """
@@ -395,7 +429,7 @@ class ExperimentCoordinator(object):
         axes[0].set_ylabel(str(self.performance_measure))
         axes[0].tick_params(axis='y', colors='black')
         # Get the weighted error performance measure value for all samples
-        error_measure_data = [self.performance_measure.error_measure(s) for s in samples]
+        error_measure_data = self._scores(samples, self.performance_measure.error_measure)
         weighted_error_measure_data = [self.performance_measure.error_weight * e for e in error_measure_data]
         axes[0].bar([x-bar_width/2 for x in x_axis_pos], weighted_error_measure_data, color=colors['violet'], width=bar_width,
                     label=u"$\\epsilon$") # plot bars for the error measure
@@ -404,7 +438,7 @@ class ExperimentCoordinator(object):
             for x, bar_top, val in zip(x_axis_pos, weighted_error_measure_data, error_measure_data):
                 axes[0].text(x+bar_width/2+0.02, bar_top/2-0.035, str(round(val,2)), color=colors['violet'])
         # Get the weighted matches performance measure value for all samples
-        matches_measure_data = [self.performance_measure.matches_measure(s) for s in samples]
+        matches_measure_data = self._scores(samples, self.performance_measure.matches_measure)
         weighted_matches_measure_data = [self.performance_measure.matches_weight * m for m in matches_measure_data]
         axes[0].bar([x-bar_width/2 for x in x_axis_pos], weighted_matches_measure_data, color=colors['red'], width=bar_width, bottom=weighted_error_measure_data,
                     label=u"$\\upsilon$") # plot bars for the matches measure on top of the error measure
@@ -413,7 +447,7 @@ class ExperimentCoordinator(object):
             for x, bar_top_err, bar_top_ma, val in zip(x_axis_pos, weighted_error_measure_data, weighted_matches_measure_data, matches_measure_data):
                 axes[0].text(x+bar_width/2+0.02, bar_top_err + (bar_top_ma/2)-0.035, str(round(val,2)), color=colors['red'])
         # Get the complete performance measure value for all samples
-        complete_measure_data = [self.performance_measure(s) for s in samples]
+        complete_measure_data = self._scores(samples, self.performance_measure)
         if show_pm_values:
             # Add text for the value of the complete measure (the weighted sum)
             for x, bar_top, val in zip(x_axis_pos, [sum(x) for x in zip(weighted_error_measure_data, weighted_matches_measure_data)], complete_measure_data):
@@ -822,14 +856,29 @@ class ExperimentCoordinator(object):
             n_iter = opt_params_dict.get('samples_per_iteration', 1)
             kappa = opt_params_dict.get('kappa', 2)
             kappa_fine_tuning = opt_params_dict.get('kappa_fine_tuning', 1)
+            batch_size = opt_params_dict.get('batch_size', 1)
+            async_workers = opt_params_dict.get('async_workers', 0)
+            multi_fidelity = opt_params_dict.get('multi_fidelity')
         else:
             init_points = 0
             n_iter = 1
             kappa = 2
             kappa_fine_tuning = 1
+            batch_size = 1
+            async_workers = 0
+            multi_fidelity = None
 
         print("\033[1;4;35m", self.iteration_string(), ":\033[0m", sep="")
-        self.optimizer.maximize(init_points=init_points, n_iter=n_iter, kappa=kappa if not self.fine_tune else kappa_fine_tuning, **self.gpr_kwargs)
+        if multi_fidelity is not None:
+            self.maximize_multi_fidelity(init_points, n_iter, multi_fidelity, kappa if not self.fine_tune else kappa_fine_tuning)
+        elif async_workers > 0:
+            self.maximize_async(init_points, n_iter, async_workers, kappa if not self.fine_tune else kappa_fine_tuning)
+        elif batch_size > 1:
+            self.maximize_batches(init_points, n_iter, batch_size, kappa if not self.fine_tune else kappa_fine_tuning)
+        else:
+            self.optimizer.maximize(init_points=init_points, n_iter=n_iter, kappa=kappa if not self.fine_tune else kappa_fine_tuning, **self.gpr_kwargs)
+        if isinstance(self.sample_db, bayropt.SampleDatabase):
+            print("\tSample cache:", self.sample_db.cache_stats)
         # Check if we found a new best parameter set
         self.handle_new_best_parameters()
         display_names = list(self._params['optimization_definitions'].keys())
@@ -849,6 +898,99 @@ class ExperimentCoordinator(object):
         pickle.dump(self._get_state(), open(os.path.join(self._params['plots_directory'], "experiment_state.pkl"), 'wb'))
         self.optimizer.space.target_func = self.obj_function.evaluate # Restore reference to objective function
 
+    def maximize_batches(self, init_points, n_batches, batch_size, kappa):
+        """
+        Variant of the optimizer's maximize method, which proposes batch_size points at once (see bayropt.propose_batch)
+        and evaluates them concurrently (see ObjectiveFunction.evaluate_batch), instead of one point after another.
+        The evaluations only run in parallel if the sample generator is a pool, see the sample_generator's 'workers' option.
+
+        :param init_points: Number of random points to probe before the first batch, if the optimizer wasn't initialized yet.
+        :param n_batches: Number of batches to propose and evaluate.
+        :param batch_size: Number of points per batch.
+        :param kappa: The optimizer's exploration parameter.
+        """
+        # Let the optimizer evaluate the initialization points and fit its GP, without proposing any new points
+        self.optimizer.maximize(init_points=init_points, n_iter=0, kappa=kappa, **self.gpr_kwargs)
+        liar = self._params['optimizer_params'].get('batch_liar', 'min')
+        space = self.optimizer.space
+        for i in range(n_batches):
+            batch = bayropt.propose_batch(self.optimizer.gp, space.X, space.Y, space.bounds, batch_size, kappa,
+                                          self.optimizer.random_state, liar=liar)
+            # Points of the batch may be equal to known ones, those are evaluated again but not added to the optimizer
+            values = self.obj_function.evaluate_batch([dict(zip(space.keys, x)) for x in batch])
+            for x, y in zip(batch, values):
+                if not x in space:
+                    space.add_observation(x, y)
+                self.optimizer.res['all']['values'].append(y)
+                self.optimizer.res['all']['params'].append(dict(zip(space.keys, x)))
+            self.optimizer.res['max'] = space.max_point()
+            self.optimizer.gp.fit(space.X, space.Y)
+
+    def maximize_multi_fidelity(self, init_points, n_brackets, config, kappa):
+        """
+        Multi-fidelity variant of the optimizer's maximize method: Proposes many candidate points at once (see bayropt.propose_batch)
+        and lets a successive halving scheduler (see bayropt.SuccessiveHalving) decide which of them are evaluated on the complete dataset.
+        Only those full-fidelity values are added to the optimizer.
+        The candidates of each rung are evaluated concurrently if the sample generator is a pool, see the sample_generator's 'workers' option.
+
+        :param init_points: Number of random points to probe first, if the optimizer wasn't initialized yet.
+        :param n_brackets: Number of times to propose candidates and run the scheduler on them.
+        :param config: Dict with the keys 'candidates' (number of candidates per bracket), 'min_fidelity' and 'eta' (see SuccessiveHalving).
+        :param kappa: The optimizer's exploration parameter.
+        """
+        self.optimizer.maximize(init_points=init_points, n_iter=0, kappa=kappa, **self.gpr_kwargs)
+        liar = self._params['optimizer_params'].get('batch_liar', 'min')
+        scheduler = bayropt.SuccessiveHalving(self.obj_function, config.get('min_fidelity', 1/9), config.get('eta', 3))
+        space = self.optimizer.space
+        for i in range(n_brackets):
+            candidates = bayropt.propose_batch(self.optimizer.gp, space.X, space.Y, space.bounds, config.get('candidates', 27), kappa,
+                                               self.optimizer.random_state, liar=liar)
+            for optimized_params, y in scheduler.run([dict(zip(space.keys, x)) for x in candidates]):
+                x = np.array([optimized_params[key] for key in space.keys])
+                if not x in space:
+                    space.add_observation(x, y)
+                self.optimizer.res['all']['values'].append(y)
+                self.optimizer.res['all']['params'].append(optimized_params)
+            self.optimizer.res['max'] = space.max_point()
+            self.optimizer.gp.fit(space.X, space.Y)
+
+    def maximize_async(self, init_points, n_evaluations, workers, kappa):
+        """
+        Asynchronous variant of the optimizer's maximize method: Keeps up to workers evaluations running at all times.
+        Whenever one of them finishes, its result is added to the optimizer and a new point is proposed right away.
+        The points that are still being evaluated are accounted for by fantasized values (see bayropt.propose_batch),
+        so no worker has to wait for the slowest evaluation of a batch.
+        The evaluations only run in parallel if the sample generator is a pool, see the sample_generator's 'workers' option.
+
+        :param init_points: Number of random points to probe first, if the optimizer wasn't initialized yet.
+        :param n_evaluations: Number of points to propose and evaluate.
+        :param workers: Maximum number of evaluations that run at the same time.
+        :param kappa: The optimizer's exploration parameter.
+        """
+        self.optimizer.maximize(init_points=init_points, n_iter=0, kappa=kappa, **self.gpr_kwargs)
+        liar = self._params['optimizer_params'].get('batch_liar', 'believer')
+        space = self.optimizer.space
+        pending = {} # Maps the futures of running evaluations to their points
+        nr_submitted = 0
+        while nr_submitted < n_evaluations or len(pending) > 0:
+            # Fill up the free workers
+            while len(pending) < workers and nr_submitted < n_evaluations:
+                x = bayropt.propose_batch(self.optimizer.gp, space.X, space.Y, space.bounds, 1, kappa, self.optimizer.random_state,
+                                          liar=liar, pending=list(pending.values()))[0]
+                pending[self.obj_function.submit(**dict(zip(space.keys, x)))] = x
+                nr_submitted += 1
+            print("\t", len(pending), " evaluations running, ", n_evaluations - nr_submitted, " left to propose.", sep="")
+            finished, running = concurrent.futures.wait(list(pending.keys()), return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in finished:
+                x = pending.pop(future)
+                y = future.result()
+                if not x in space:
+                    space.add_observation(x, y)
+                self.optimizer.res['all']['values'].append(y)
+                self.optimizer.res['all']['params'].append(dict(zip(space.keys, x)))
+            self.optimizer.res['max'] = space.max_point()
+            self.optimizer.gp.fit(space.X, space.Y)
+
     def handle_new_best_parameters(self):
         """
         Call regularily to check whether a new best set of parameters has beend found (e.g. each iteration).
@@ -858,6 +1000,8 @@ class ExperimentCoordinator(object):
         if self.max_performance_measure < self.optimizer.res['max']['max_val']:
             print("\t\033[1;35mNew maximum found, outputting params and plots!\033[0m")
             self.max_performance_measure = self.optimizer.res['max']['max_val']
+            if self.early_stopping is not None:
+                self.early_stopping.incumbent = self.max_performance_measure
             # Dump the best parameter set currently known by the optimizer
             yaml.dump(self.max_rosparams, open(os.path.join(self._params['plots_directory'], "best_rosparams_" + self.iteration_string() + ".yaml"), 'w'))
             # store the best known sample in the best_samples dict, for boxplots
@@ -1022,6 +1166,33 @@ if __name__ == '__main__': # don't execute when module is imported
         parser.add_argument('--list-samples', '-ls',
                             dest='list_samples', action='store_true',
                             help="Lists those samples in the database, which are relevant for this experiment and exits.")
+        parser.add_argument('--migrate-sample-files', '-msf',
+                            dest='migrate_sample_files', action='store_true',
+                            help="Moves all sample files from the flat sample directory into the shard directories configured by" +\
+                                 " the database's shard_levels option and exits. Can be used while other experiments use the database.")
+        parser.add_argument('--queue-worker', '-qw',
+                            dest='queue_worker', action='store_true',
+                            help="Runs a worker that takes jobs from the queue configured at the sample_generator's 'queue' option, " +\
+                                 "generates their samples and adds them to the sample database. Start as many workers as you like, on any host " +\
+                                 "that can access the queue and the database. The worker runs until it's killed.")
+        parser.add_argument('--export-samples', '-es',
+                            dest='export_samples', metavar='BUNDLE_PATH',
+                            help="Exports the samples which are relevant for this experiment into bundle files" +\
+                                 " (BUNDLE_PATH-0000.npz, ...), which can be imported with --import-samples, and exits.")
+        parser.add_argument('--export-all-samples', '-eas',
+                            dest='export_all_samples', metavar='BUNDLE_PATH',
+                            help="Same as --export-samples, but exports all samples in the database.")
+        parser.add_argument('--import-samples', '-is',
+                            dest='import_samples', nargs='+', metavar='BUNDLE_FILE',
+                            help="Imports the samples in the given bundle files (see --export-samples) into the database and exits." +\
+                                 " Samples that already exist in the database are skipped.")
+        parser.add_argument('--check-database', '-cdb',
+                            dest='check_database', action='store_true',
+                            help="Checks the sample database for entries without sample data, orphaned sample files," +\
+                                 " duplicate entries and wrong keys, prints a report and exits.")
+        parser.add_argument('--repair-database', '-rdb',
+                            dest='repair_database', action='store_true',
+                            help="Same as --check-database, but also repairs the found problems and compacts the database.")
         parser.add_argument('--remove-samples', '-rm',
                             dest='remove_samples', nargs='+', help=rm_arg_help)
         parser.add_argument('--clean-map-matcher-env', '-cmme',
@@ -1030,6 +1201,10 @@ if __name__ == '__main__': # don't execute when module is imported
                                  "I.e. remove all directories of map matcher runs that didn't finish and, because of that, weren't added to the database.")
         parser.add_argument('--add-samples', '-a',
                             dest='add_samples', nargs='+', help=add_arg_help)
+        parser.add_argument('--workers', '-j',
+                            dest='workers', type=int, default=None,
+                            help="Only used with --add-samples. The number of processes that parse map matcher results in parallel." +\
+                                 " Defaults to the number of CPUs.")
         parser.add_argument('--plot-paramspace-line', '-p',
                             dest='plot_paramspace_line', nargs='+',
                             help="Plots a 1D visualization of the metric's behaviour when changing the given parameter." +\
@@ -1064,8 +1239,9 @@ if __name__ == '__main__': # don't execute when module is imported
                             help="Utility command that can be used when a new parameter has been added to the map matcher. " +\
                                  "Expects two arguments: First, a single string, corresponding to the rosparam name of the new parameter. " +\
                                  "Second, that parameter's default value, which should induce the same map matcher behaviour as before the parameter was introduced. " +\
-                                 "This method will iterate over all samples in this experiment's sample database and add the new parameter with the given value to each sample. " +\
-                                 "The new parameter will only be added if it wasn't already present in the sample's parameter dict.")
+                                 "This method will add the new parameter with the given value to the parameters of each sample in this experiment's sample database. " +\
+                                 "The new parameter will only be added if it wasn't already present in the sample's parameter dict. " +\
+                                 "Only the database index is changed, so this is fast and can simply be repeated if it was interrupted.")
         parser.add_argument('--resume', '-r',
                             help="Expects a path to an old, pickled experiment state. Will try to resume that experiment." +\
                                  "Take care: Changes to the code and to the parameters won't take effect when restarting an old experiment.")
@@ -1119,26 +1295,63 @@ if __name__ == '__main__': # don't execute when module is imported
             sys.exit()
         if args.list_all_samples:
             print("--> Mode: List All Samples <--")
-            for sample in experiment_coordinator.sample_db:
-                print(sample)
+            for summary, params_dict in experiment_coordinator.sample_db.summaries():
+                print(summary)
+                print("\tParameters:", params_dict)
             print("Total number of samples", len(experiment_coordinator.sample_db))
             sys.exit()
+        if args.export_samples or args.export_all_samples:
+            print("--> Mode: Export Samples <--")
+            if args.export_samples:
+                keys = [sample.params_hashed for sample, params_dict in experiment_coordinator.obj_function.samples()]
+                bundle_paths = experiment_coordinator.sample_db.export_bundle(args.export_samples, keys)
+            else:
+                bundle_paths = experiment_coordinator.sample_db.export_bundle(args.export_all_samples)
+            print("Wrote", len(bundle_paths), "bundle files:", bundle_paths)
+            sys.exit()
+        if args.import_samples:
+            print("--> Mode: Import Samples <--")
+            for bundle_path in args.import_samples:
+                experiment_coordinator.sample_db.import_bundle(bundle_path)
+            print("Total number of samples", len(experiment_coordinator.sample_db))
+            sys.exit()
+        if args.check_database or args.repair_database:
+            print("--> Mode: Check Database <--")
+            experiment_coordinator.sample_db.check(repair=args.repair_database)
+            sys.exit()
+        if args.queue_worker:
+            print("--> Mode: Queue Worker <--")
+            if experiment_coordinator.job_queue is None:
+                raise ValueError("The experiment's sample_generator has no 'queue' configured.")
+            queue_defs = experiment_coordinator._params['sample_source']['config']['sample_generator']['queue']
+            bayropt.run_worker(experiment_coordinator.job_queue, experiment_coordinator.sample_db, experiment_coordinator.job_generator,
+                               lease_duration=queue_defs.get('lease_duration', 600), poll_interval=queue_defs.get('poll_interval', 10))
+            sys.exit()
+        if args.migrate_sample_files:
+            print("--> Mode: Migrate Sample Files <--")
+            experiment_coordinator.sample_db.migrate_sample_files()
+            sys.exit()
         if args.list_samples:
             print("--> Mode: List Samples <--")
             count = 0
-            for x, y, s in experiment_coordinator.obj_function:
+            listed_samples = list(experiment_coordinator.obj_function)
+            if isinstance(experiment_coordinator.performance_measure, bayropt.MixerMeasure):
+                # Rate all samples with each component at once, so the scores are cached together
+                component_scores = [experiment_coordinator._scores([s for x, y, s in listed_samples], measure) for measure in
+                                    (experiment_coordinator.performance_measure.error_measure, experiment_coordinator.performance_measure.matches_measure)]
+            for i, (x, y, s) in enumerate(listed_samples):
                 count += 1
-                print(s)
+                print(experiment_coordinator.sample_db.summary(x))
                 print("\tOptimized Parameters:")
                 for display_name in experiment_coordinator.optimization_defs.keys():
                     print("\t\t", display_name, "=", x[experiment_coordinator._to_rosparam(display_name)])
                 print("\tMetric-value:", y)
                 if isinstance(experiment_coordinator.performance_measure, bayropt.MixerMeasure):
                     print("\t\terror measure", type(experiment_coordinator.performance_measure.error_measure), "=",
-                          experiment_coordinator.performance_measure.error_measure(s),
+                          component_scores[0][i],
                           "(weight", 1 - experiment_coordinator.performance_measure.matches_weight, ")")
                     print("\t\tnr. matches measure", type(experiment_coordinator.performance_measure.matches_measure), "=",
-                          experiment_coordinator.performance_measure.matches_measure(s),
+                          component_scores[1][i],
                           "(weight", experiment_coordinator.performance_measure.matches_weight, ")")
             print("Number of usable samples:", count)
             sys.exit()
@@ -1172,9 +1385,10 @@ if __name__ == '__main__': # don't execute when module is imported
             sys.exit()
         if args.add_samples:
             print("--> Mode: Add Samples <--")
-            for sample_path in args.add_samples:
-                params_dict, sample = experiment_coordinator.sample_db.sample_generator.create_sample_from_map_matcher_results(sample_path, override_existing=True)
-                experiment_coordinator.sample_db.add_sample(sample, params_dict, override_existing=True)
+            sample_generator = experiment_coordinator.sample_db.sample_generator
+            created_samples = sample_generator.create_samples_from_map_matcher_results(args.add_samples, args.workers)
+            # All samples are registered in a single transaction, after all of them were parsed and written
+            experiment_coordinator.sample_db.add_samples(((sample, params_dict) for params_dict, sample in created_samples), override_existing=True)
             sys.exit()
         if args.plot_paramspace_line:
             print("--> Mode: Plot Paramspace Projected on Line <--")
@@ -1190,32 +1404,26 @@ if __name__ == '__main__': # don't execute when module is imported
             print("Patching new parameter", args.new_param[0], "with default value", args.new_param[1])
             if not len(args.new_param) == 2:
                 raise ValueError("new_param's length isn't 2. --add-new-param requires exactly two arguments (see -h for more information).")
-            # Create a list that contains all samples which don't contain the new parameter (new_param[0])
-            patch_samples_list = []
-            # and a member to save a single sample which already contains the new parameter, used for typecasting
-            other_sample = None
-            # fill the two variables above
-            for sample in experiment_coordinator.sample_db:
-                if not args.new_param[0] in sample.parameters.keys():
-                    patch_samples_list.append(sample)
-                elif other_sample is None:
-                    other_sample = sample
-            # check if there was a sample in the db to extract the type information
-            if other_sample is None:
-                raise RuntimeError("No sample in the db already has the new parameter. Can't go on with patching, since I don't know which type it should have. (fixme, maybe?)")
-            new_param_type = type(other_sample.parameters[args.new_param[0]])
-            print("Total number of samples that need to be patched:", len(patch_samples_list))
-            print(len(experiment_coordinator.sample_db) - len(patch_samples_list), "already seem to have that parameter.")
-            print("New parameter's type is", new_param_type)
+            # Count the samples that don't contain the new parameter yet, and use one that does for typecasting
+            nr_unpatched = 0
+            new_param_type = None
+            for params_hashed, params_dict in experiment_coordinator.sample_db.iter_params():
+                if not args.new_param[0] in params_dict:
+                    nr_unpatched += 1
+                elif new_param_type is None:
+                    new_param_type = type(params_dict[args.new_param[0]])
+            if new_param_type is None:
+                # No sample has the new parameter yet, so take the type from the value's yaml representation
+                new_param_value = yaml.safe_load(args.new_param[1])
+            else:
+                new_param_value = new_param_type(args.new_param[1])
+            print("Total number of samples that need to be patched:", nr_unpatched)
+            print(len(experiment_coordinator.sample_db) - nr_unpatched, "already seem to have that parameter.")
+            print("New parameter's value is", repr(new_param_value), "of type", type(new_param_value))
             print("Execute the patching routine? (y/n)")
             if input() in ['y', 'Y', 'yes', 'Yes']:
-                for sample in patch_samples_list:
-                    # Get the hash to find the unpatched sample in the db
-                    sample_hash = bayropt.SampleDatabase.dict_hash(sample.parameters)
-                    # Patch the sample's parameters dict, casting the default value to the correct type
-                    sample.parameters[args.new_param[0]] = new_param_type(args.new_param[1])
-                    # Update the sample in the db (and its .pkl on disk)
-                    experiment_coordinator.sample_db.update_sample(sample_hash, sample) # TODO: fixme after refactor
+                # Only patches the database index, the samples themselves don't store their parameters
+                experiment_coordinator.sample_db.add_parameter(args.new_param[0], new_param_value)
             else:
                 print("aborted.")
             sys.exit()
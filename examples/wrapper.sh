@@ -4,7 +4,7 @@
 # SPDX-License-Identifier: BSD-2-Clause                                  #
 ##########################################################################
 
-# Helper script for running the experiment_coordinator.py script with a fixed PYTHONHASHSEED.
+# Helper script for running the experiment_coordinator.py script from anywhere.
 
 # Get the path to the actual folder this script is in, so the python script can be found
 SOURCE="${BASH_SOURCE[0]}"
@@ -15,5 +15,5 @@ while [ -h "$SOURCE" ]; do # resolve $SOURCE until the file is no longer a symli
 done
 DIR="$( cd -P "$( dirname "$SOURCE" )" && pwd )"
 
-# Set PYTHONHASHSEED to some fixed value and start the python script
-PYTHONHASHSEED='42' python3 "$DIR/experiment_coordinator.py" $@
+# Start the python script
+python3 "$DIR/experiment_coordinator.py" $@